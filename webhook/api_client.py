@@ -1,86 +1,366 @@
+import asyncio
+import base64
+import hashlib
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import cached_property
 from pathlib import Path
+from typing import Dict, List, Optional, Union
 
+from loguru import logger
 from mistralai import Mistral
 from mistralai import TextChunk
 
+from colruyt_parser import parse_colruyt_markdown
 from models import Invoice
+from resilience import acall_with_retries, breaker, call_with_retries, httpx_clients
+from tracing import span
+
+OCR_MODEL = "mistral-ocr-latest"
+PARSE_MODEL = "pixtral-12b-latest"
+
+# Seconds allowed for each remote stage of the async OCR pipeline
+DEFAULT_STAGE_TIMEOUTS = {
+    "upload": 30.0,
+    "signed_url": 10.0,
+    "ocr": 90.0,
+    "parse": 90.0,
+}
+
+# Documents up to this size are sent inline as a base64 data URL, skipping
+# the upload and signed URL round trips. Larger ones are uploaded.
+DEFAULT_INLINE_MAX_BYTES = 1024 * 1024
+# Hours a signed URL stays valid; reused for re-sent files until shortly before
+SIGNED_URL_EXPIRY_HOURS = 24
 
 
 class MistralAIClient:
-    def __init__(self, api_token: str):
-        self.client = Mistral(api_key=api_token)
+    def __init__(
+        self,
+        api_token: str,
+        stage_timeouts: Dict[str, float] = None,
+        inline_max_bytes: int = DEFAULT_INLINE_MAX_BYTES,
+        local_parser: bool = True,
+        split_pages: bool = False,
+        max_page_workers: int = 8,
+        retries: int = 2,
+    ):
+        http_client, async_http_client = httpx_clients()
+        self.client = Mistral(
+            api_key=api_token, client=http_client, async_client=async_http_client
+        )
+        # Transient failures are retried within the stage's timeout; the
+        # breaker fails fast while Mistral is down
+        self.retries = retries
+        self.circuit = breaker("mistral")
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        self.ocr_model = OCR_MODEL
+        self.parse_model = PARSE_MODEL
+        # 0 always uploads, a negative value always sends inline
+        self.inline_max_bytes = inline_max_bytes
+        # sha256 of uploaded content -> (file id, signed URL, URL expiry time)
+        self._uploads: Dict[str, tuple] = {}
+        # Try the deterministic Colruyt parser before asking the LLM
+        self.local_parser = local_parser
+        # Parse each page of a multi-page receipt in its own request, at most
+        # `max_page_workers` at a time, and return one Invoice per page
+        self.split_pages = split_pages
+        self.max_page_workers = max_page_workers
 
-    def get_response(self, file_path: str):
+    def get_response(self, file_path: str, content: bytes = None):
         """
         Sends an image or PDF to the Mistral AI OCR API and returns structured data.
+        Pass the file's `content` if it is already in memory to avoid reading it again.
+        """
+        try:
+            file_ext = Path(file_path).suffix.lower()
+            if file_ext == '.pdf':
+                return self.structured_pdf_ocr(file_path, content)
+            else:
+                raise ValueError("Unsupported file type. Only PDF files are supported.")
+        except Exception as e:
+            raise ValueError(f"Failed to get response from Mistral AI API: {e}") from e
+
+    async def get_response_async(self, file_path: str, content: bytes = None):
+        """
+        Async counterpart of `get_response`, does not block the event loop.
         """
         try:
             file_ext = Path(file_path).suffix.lower()
             if file_ext == '.pdf':
-                return self.structured_pdf_ocr(file_path)
+                return await self.structured_pdf_ocr_async(file_path, content)
             else:
                 raise ValueError("Unsupported file type. Only PDF files are supported.")
+        except asyncio.TimeoutError as e:
+            raise ValueError(f"Mistral AI API timed out: {e}") from e
         except Exception as e:
-            raise ValueError(f"Failed to get response from Mistral AI API: {e}")
+            raise ValueError(f"Failed to get response from Mistral AI API: {e}") from e
+
+    @staticmethod
+    def _parse_messages(all_markdown: str) -> list:
+        return [
+            {
+                "role": "user",
+                "content": [
+                    TextChunk(text=(
+                        f"This is the PDF's OCR in markdown:\n{all_markdown}\n.\n"
+                        "Convert this into a structured JSON response "
+                        "with the OCR contents in a sensible dictionnary."
+                    ))
+                ]
+            }
+        ]
 
-    def structured_pdf_ocr(self, pdf_path: str) -> Invoice:
+    @staticmethod
+    def _number_pages(invoices: List[Invoice]) -> List[Invoice]:
+        for page, invoice in enumerate(invoices, start=1):
+            invoice.page = page
+        return invoices
+
+    def _parse(self, markdown: str) -> Invoice:
+        chat_response = self._call(
+            "parse",
+            self.client.chat.parse,
+            model=self.parse_model,
+            messages=self._parse_messages(markdown),
+            response_format=Invoice,
+            temperature=0,
+        )
+        return chat_response.choices[0].message.parsed
+
+    async def _parse_async(self, markdown: str, semaphore: asyncio.Semaphore = None) -> Invoice:
+        async with semaphore or nullcontext():
+            chat_response = await self._stage(
+                "parse",
+                self.client.chat.parse_async,
+                model=self.parse_model,
+                messages=self._parse_messages(markdown),
+                response_format=Invoice,
+                temperature=0,
+            )
+        return chat_response.choices[0].message.parsed
+
+    def _inline(self, content: bytes) -> bool:
+        return self.inline_max_bytes < 0 or len(content) <= self.inline_max_bytes
+
+    @staticmethod
+    def _data_url(content: bytes) -> dict:
+        encoded = base64.b64encode(content).decode("ascii")
+        return {
+            "type": "document_url",
+            "document_url": f"data:application/pdf;base64,{encoded}",
+        }
+
+    def _reusable_upload(self, content_hash: str) -> Optional[tuple]:
+        upload = self._uploads.get(content_hash)
+        if upload is not None and upload[2] > time.time():
+            logger.info(f"Reusing uploaded file {upload[0]}.")
+            return upload
+        return None
+
+    def _remember_upload(self, content_hash: str, file_id: str, url: str) -> None:
+        # Stop reusing the URL an hour before it expires
+        expires_at = time.time() + (SIGNED_URL_EXPIRY_HOURS - 1) * 3600
+        self._uploads[content_hash] = (file_id, url, expires_at)
+
+    def _document(self, file_name: str, content: bytes) -> dict:
+        """
+        The OCR `document` argument for `content`: inline for small files,
+        otherwise a signed URL, uploading only if this content was not
+        uploaded before.
+        """
+        if self._inline(content):
+            logger.info(f"Sending {file_name} inline ({len(content)} bytes).")
+            return self._data_url(content)
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        upload = self._reusable_upload(content_hash)
+        if upload is None:
+            uploaded_pdf = self._call(
+                "upload",
+                self.client.files.upload,
+                file={"file_name": file_name, "content": content},
+                purpose="ocr",
+            )
+            signed_url = self._call(
+                "signed_url",
+                self.client.files.get_signed_url,
+                file_id=uploaded_pdf.id,
+                expiry=SIGNED_URL_EXPIRY_HOURS,
+            )
+            self._remember_upload(content_hash, uploaded_pdf.id, signed_url.url)
+            upload = self._uploads[content_hash]
+        return {"type": "document_url", "document_url": upload[1]}
+
+    async def _document_async(self, file_name: str, content: bytes) -> dict:
+        """Async version of `_document`."""
+        if self._inline(content):
+            logger.info(f"Sending {file_name} inline ({len(content)} bytes).")
+            return self._data_url(content)
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        upload = self._reusable_upload(content_hash)
+        if upload is None:
+            uploaded_pdf = await self._stage(
+                "upload",
+                self.client.files.upload_async,
+                file={"file_name": file_name, "content": content},
+                purpose="ocr",
+            )
+            signed_url = await self._stage(
+                "signed_url",
+                self.client.files.get_signed_url_async,
+                file_id=uploaded_pdf.id,
+                expiry=SIGNED_URL_EXPIRY_HOURS,
+            )
+            self._remember_upload(content_hash, uploaded_pdf.id, signed_url.url)
+            upload = self._uploads[content_hash]
+        return {"type": "document_url", "document_url": upload[1]}
+
+    @cached_property
+    def _ocr_kwargs(self) -> dict:
+        """
+        Ask OCR for the `Invoice` schema directly (document annotation) when
+        the installed SDK supports it, saving the separate parse request.
+        """
+        if "document_annotation_format" not in inspect.signature(
+            self.client.ocr.process
+        ).parameters:
+            return {}
+        try:
+            from mistralai.extra import response_format_from_pydantic_model
+        except ImportError:
+            return {}
+        return {"document_annotation_format": response_format_from_pydantic_model(Invoice)}
+
+    def _extract(self, ocr_response) -> Optional[Invoice]:
+        """The invoice from the OCR response alone, or None if the LLM is needed."""
+        annotation = getattr(ocr_response, "document_annotation", None)
+        if annotation:
+            logger.info("Using the OCR document annotation.")
+            return Invoice.model_validate_json(annotation)
+        if self.local_parser:
+            invoice = parse_colruyt_markdown([page.markdown for page in ocr_response.pages])
+            if invoice is not None:
+                logger.info("Parsed the receipt locally, skipping the LLM.")
+                return invoice
+        return None
+
+    def structured_pdf_ocr(
+        self, pdf_path: str, content: bytes = None
+    ) -> Union[Invoice, List[Invoice]]:
         """
         Process a PDF document using OCR and extract structured data.
 
         Args:
             pdf_path: Path to the PDF file to process
+            content: The PDF's bytes, if already read; otherwise read from `pdf_path`
 
         Returns:
-            Invoice object containing the extracted data
+            Invoice object containing the extracted data, or one Invoice per
+            page if `split_pages` is set and the PDF has several pages
 
         Raises:
             AssertionError: If the PDF file does not exist
         """
         # Validate input file
         pdf_file = Path(pdf_path)
-        assert pdf_file.is_file(), "The provided PDF path does not exist."
-
-        # Upload the PDF file to Mistral
-        uploaded_pdf = self.client.files.upload(
-            file={
-                "file_name": pdf_file.name,
-                "content": open(pdf_file, "rb"),
-            },
-            purpose="ocr"
-        )
+        if content is None:
+            assert pdf_file.is_file(), "The provided PDF path does not exist."
+            content = pdf_file.read_bytes()
 
-        # Get a signed URL for the uploaded file
-        signed_url = self.client.files.get_signed_url(file_id=uploaded_pdf.id)
+        document = self._document(pdf_file.name, content)
 
         # Process the PDF using OCR
-        ocr_response = self.client.ocr.process(
-            model="mistral-ocr-latest",
-            document={"type": "document_url", "document_url": signed_url.url}
+        ocr_response = self._call(
+            "ocr",
+            self.client.ocr.process,
+            model=self.ocr_model,
+            document=document,
+            **self._ocr_kwargs,
         )
 
-        # Extract text from all pages
-        all_markdown = "\n\n".join([page.markdown for page in ocr_response.pages])
-
-        # Parse the OCR result into a structured JSON response
-        chat_response = self.client.chat.parse(
-            model="pixtral-12b-latest",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        TextChunk(text=(
-                            f"This is the PDF's OCR in markdown:\n{all_markdown}\n.\n"
-                            "Convert this into a structured JSON response "
-                            "with the OCR contents in a sensible dictionnary."
-                        ))
-                    ]
-                }
-            ],
-            response_format=Invoice,
-            temperature=0
+        invoice = self._extract(ocr_response)
+        if invoice is not None:
+            return invoice
+
+        pages = [page.markdown for page in ocr_response.pages]
+        if self.split_pages and len(pages) > 1:
+            # Parse the pages concurrently, one structured response per page
+            with ThreadPoolExecutor(min(self.max_page_workers, len(pages))) as executor:
+                return self._number_pages(list(executor.map(self._parse, pages)))
+
+        # Parse the OCR result of all pages into a structured JSON response
+        return self._parse("\n\n".join(pages))
+
+    def _call(self, name: str, method, **kwargs):
+        """Call one remote stage, retrying transient errors within its timeout."""
+        with span(f"mistral.{name}"):
+            return call_with_retries(
+                lambda timeout: method(**kwargs, timeout_ms=int(timeout * 1000)),
+                retries=self.retries,
+                deadline=self.stage_timeouts[name],
+                circuit=self.circuit,
+            )
+
+    async def _stage(self, name: str, method, **kwargs):
+        """Await one remote stage, retrying transient errors within its timeout."""
+        try:
+            with span(f"mistral.{name}"):
+                return await acall_with_retries(
+                    lambda: method(**kwargs),
+                    retries=self.retries,
+                    deadline=self.stage_timeouts[name],
+                    circuit=self.circuit,
+                )
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(
+                f"stage '{name}' exceeded {self.stage_timeouts[name]}s"
+            )
+
+    async def structured_pdf_ocr_async(
+        self, pdf_path: str, content: bytes = None
+    ) -> Union[Invoice, List[Invoice]]:
+        """
+        Async version of `structured_pdf_ocr` using the SDK's async methods.
+
+        Each round trip (upload and signed URL unless the file is sent inline or
+        was uploaded before, OCR, parse) is bounded by `self.stage_timeouts`,
+        including retries of transient errors.
+
+        Raises:
+            AssertionError: If the PDF file does not exist
+            asyncio.TimeoutError: If a stage exceeds its timeout
+        """
+        pdf_file = Path(pdf_path)
+        if content is None:
+            assert pdf_file.is_file(), "The provided PDF path does not exist."
+            content = await asyncio.to_thread(pdf_file.read_bytes)
+
+        document = await self._document_async(pdf_file.name, content)
+        ocr_response = await self._stage(
+            "ocr",
+            self.client.ocr.process_async,
+            model=self.ocr_model,
+            document=document,
+            **self._ocr_kwargs,
         )
 
-        return chat_response.choices[0].message.parsed
+        invoice = self._extract(ocr_response)
+        if invoice is not None:
+            return invoice
+
+        pages = [page.markdown for page in ocr_response.pages]
+        if self.split_pages and len(pages) > 1:
+            semaphore = asyncio.Semaphore(self.max_page_workers)
+            invoices = await asyncio.gather(
+                *(self._parse_async(markdown, semaphore) for markdown in pages)
+            )
+            return self._number_pages(list(invoices))
+
+        return await self._parse_async("\n\n".join(pages))
 
 if __name__ == "__main__":
     import os
@@ -1,64 +1,63 @@
+import asyncio
 import difflib
-import hashlib
-import io
 import math
 import os
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import polars as pl
 from dotenv import load_dotenv
 from loguru import logger
-from splitwise import Splitwise
 from splitwise.expense import Expense
 from splitwise.group import Group
 from splitwise.user import ExpenseUser
 from tabulate import tabulate
-from telegram import Bot, Update
+from telegram import Message, Update
 
-from api_client import MistralAIClient
-# from blob_utils import async_azure_upload_ndjson, get_async_container_client
 
-from azure.storage.blob import BlobServiceClient, ContainerClient
-from invoice_parser import InvoiceParser
-from utils import get_hash_map
+from category_index import DEFAULT_RULES_PATH, get_category_index
+from expense_batch import collapse_items, submit_expenses
+from idempotency import IdempotencyGuard
+from image_ingest import IMAGE_MIME_TYPES, image_to_pdf
+from ingest import IngestedFile, ingest_bytes, ingest_file
+from invoice_store import InvoiceStore
+from services import services
+from tracing import span, timed
 
 env_path = ".env"
 if load_dotenv(env_path):
     logger.info(f"Loaded env variables from {env_path}.")
 
-# Your bot token from BotFather
-BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 # Your API token for securing the endpoint
 API_TOKEN = os.getenv("API_TOKEN")
 CHATGPT_API_TOKEN = os.getenv("CHATGPT_API_TOKEN")
 
-bot = Bot(token=BOT_TOKEN)
-# api_client = ChatGPTClient(CHATGPT_API_TOKEN)
-api_client = MistralAIClient(os.getenv("MISTRAL_API_TOKEN"))
-parser = InvoiceParser(api_client)
-
-# SPLITWISE_GROUP=
-s = Splitwise(
-    os.getenv("SPLITWISE_CONSUMER_KEY"),
-    os.getenv("SPLITWISE_CONSUMER_SECRET"),
-    api_key=os.getenv("SPLITWISE_API_KEY"),
-)
-current = s.getCurrentUser()
-group = s.getGroup()
+# The Telegram bot, Mistral client and Splitwise client are built lazily by
+# `services` on first use, so importing this module makes no network calls.
 SOFIE_MAARTEN_SW_GROUP_NAME = "Anti Hangriness Sofieke"
 BLIJDEBERG_SW_GROUP_NAME = "Blijdeberg"
-
-data_path = Path("../data")
-data_path.mkdir(exist_ok=True)
-data_path = data_path.as_posix()
+# Concurrent createExpense calls per receipt
+SPLITWISE_MAX_WORKERS = int(os.getenv("SPLITWISE_MAX_WORKERS", 4))
+# Register one itemised expense per category instead of one per item
+SPLITWISE_COLLAPSE_CATEGORIES = os.getenv("SPLITWISE_COLLAPSE_CATEGORIES", "").lower() in ("1", "true")
+# Category rules (terms and how each category is split) used by process_invoice
+CATEGORY_RULES_PATH = os.getenv("CATEGORY_RULES_PATH", DEFAULT_RULES_PATH)
+# "queue" hands invoices to worker.py via the job queue, "inline" processes
+# them inside the webhook request
+INVOICE_JOBS = os.getenv("INVOICE_JOBS", "inline").lower()
+# Seconds a receipt stays claimed while it is processed; a claim left by a
+# host that died mid-parse lapses after this, so the receipt can be resent
+INVOICE_CLAIM_TTL = float(os.getenv("INVOICE_CLAIM_TTL", 15 * 60))
+
+data_path = Path("../data").as_posix()
 
 
 def get_group(group_name: str = SOFIE_MAARTEN_SW_GROUP_NAME) -> Group:
-    group = list(filter(lambda g: g.getName() == group_name, s.getGroups()))
-    if group != []:
-        return group[0]
+    group = services.groups.get(group_name)
+    if group is not None:
+        return group
     else:
         logger.warning(f"Group {SOFIE_MAARTEN_SW_GROUP_NAME} does not exists.")
         create_sw_group()
@@ -66,24 +65,28 @@ def get_group(group_name: str = SOFIE_MAARTEN_SW_GROUP_NAME) -> Group:
 
 def create_sw_group():
     logger.info(f"Creating group {SOFIE_MAARTEN_SW_GROUP_NAME}")
+    s = services.splitwise
     group = group = Group()
     group.setName(SOFIE_MAARTEN_SW_GROUP_NAME)
     sofie = list(filter(lambda f: f.first_name == "Sofie", s.getFriends()))[0]
     group.addMember(sofie)
     s.createGroup(group)
+    services.groups.refresh()
 
 
-def register_splitwise_expense(
+def build_splitwise_expense(
     item_dict: Dict,
     payer_name: str,
     friend_names: List = None,
     maartens_owe_percentage: float = None,
     sofies_pct: float = 0,
     group_name: str = SOFIE_MAARTEN_SW_GROUP_NAME,
-):
+) -> Optional[Expense]:
+    """Build the Splitwise expense for one item without submitting it."""
     price = item_dict["adjusted_amount"]
     description = item_dict["description"]
 
+    current = services.current_user
     group = get_group(group_name)
     members = group.members
     available_members = [f.first_name for f in members]
@@ -105,13 +108,15 @@ def register_splitwise_expense(
             logger.error(
                 f"Friend {friend.first_name} is not in the group {group_name}."
             )
-            return
+            return None
 
     expense = Expense()
     expense.setGroupId(group.id)
     expense.setCost(price)
     expense.setDescription(description)
     expense.setDate(item_dict.get("date", None))
+    if item_dict.get("details"):
+        expense.setDetails(item_dict["details"])
     maarten_exp = ExpenseUser()
     maarten_exp.setId(current.id)
 
@@ -158,21 +163,28 @@ def register_splitwise_expense(
         expense.addUser(friend_exp)
         total_share += equal_share
 
-    nExpense, errors = s.createExpense(expense)
-    if errors:
-        logger.error(errors)
+    return expense
 
 
-def register_splitwise_expenses(
+def build_splitwise_expenses(
     items: List,
     payer_name: str,
     friend_names: List = None,
     maartens_owe_percentage: float = None,
     group_name: str = SOFIE_MAARTEN_SW_GROUP_NAME,
     sofies_pct: float = None,
-):
-    for item in items:
-        register_splitwise_expense(
+    collapse_description: str = None,
+) -> List[Expense]:
+    """
+    Build the expenses for a list of items.
+
+    If `collapse_description` is given, the items are merged into a single
+    itemised expense with that description.
+    """
+    if collapse_description is not None:
+        items = collapse_items(items, collapse_description)
+    expenses = [
+        build_splitwise_expense(
             item,
             payer_name,
             friend_names,
@@ -180,126 +192,81 @@ def register_splitwise_expenses(
             group_name=group_name,
             sofies_pct=sofies_pct,
         )
+        for item in items
+    ]
+    return [e for e in expenses if e is not None]
 
 
-def calculate_file_hash(file_path: str) -> str:
-    """Calculate SHA-256 hash of a file"""
-    hasher = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
-
-def get_container_client(container_name: str) -> ContainerClient:
-    """Get a synchronous container client"""
-    connection_string = os.getenv("AzureWebJobsStorage")
-    if not connection_string:
-        raise ValueError("No Azure Storage connection string found in environment variables")
-    
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    return blob_service_client.get_container_client(container_name)
-
-def azure_upload_ndjson(df: pl.DataFrame, blob_name: str):
-    """Synchronous upload of DataFrame as NDJSON to blob storage"""
-    container_name = "function"
-    container_client = get_container_client(container_name)
-    
-    # Convert DataFrame to NDJSON
-    ndjson_data = io.BytesIO()
-    df.write_ndjson(ndjson_data)
-    ndjson_data.seek(0)
-    
-    # Upload to blob storage
-    blob_client = container_client.get_blob_client(blob_name)
-    blob_client.upload_blob(ndjson_data, overwrite=True)
-
-def local_save_ndjson(df: pl.DataFrame, file_name: str, data_path: str = data_path) -> None:
-    """Save DataFrame as NDJSON to local file system"""
-    # Ensure the output directory exists
-    output_dir = Path(data_path) / "output"
-    output_dir.mkdir(exist_ok=True)
-    
-    # Save the DataFrame to NDJSON file
-    output_path = output_dir / file_name
-    df.write_ndjson(output_path)
-    logger.info(f"Saved DataFrame to {output_path}")
-
-def parse_invoice(local_file_path: str, data_path=data_path) -> pl.DataFrame:
-    """Parse an invoice using local file operations"""
-    parser = InvoiceParser(api_client, output_path=data_path)
-    file_hash = calculate_file_hash(local_file_path)
-    
-    # Ensure local storage directories exist
-    output_dir = Path(data_path) / "output"
-    invoices_dir = Path(data_path) / "invoices"
-    output_dir.mkdir(exist_ok=True)
-    invoices_dir.mkdir(exist_ok=True)
-    
-    # Output file paths
-    df_output_file = output_dir / "output.ndjson"
-    invoice_file = invoices_dir / f"{file_hash}.pdf"
+@lru_cache(maxsize=None)
+def get_invoice_store(data_path: str = data_path) -> InvoiceStore:
+    """Process-wide invoice store, so its hashes are loaded only once"""
+    return InvoiceStore(Path(data_path) / "output" / "store")
 
-    # Convert Path to string if needed
-    if isinstance(local_file_path, Path):
-        local_file_path_str = str(local_file_path)
+
+def save_invoice_df(df: pl.DataFrame, data_path: str = data_path) -> None:
+    """
+    Append a parsed invoice frame to the local invoice history (and the blob
+    history). Invoices already in the history, e.g. parsed again after a
+    cache hit, are not appended twice.
+    """
+    if not get_invoice_store(data_path).append(df):
+        return
+    if services.history is not None:
+        try:
+            services.history.append(df)
+        except Exception as e:
+            logger.warning(f"Failed to append to the blob history: {e}")
+
+
+def invoice_result_to_df(
+    invoice_result, local_file_path: str, file_hash: str
+) -> pl.DataFrame:
+    """Flatten one or more parsed Invoice objects into a DataFrame"""
+    # Handle both single invoice and list of invoices
+    if hasattr(invoice_result, "model_dump_json"):
+        invoice_json = invoice_result.model_dump_json()
+        df = pl.DataFrame([invoice_json])
     else:
-        local_file_path_str = local_file_path
+        # Assuming list of Invoice objects
+        invoice_jsons = [inv.model_dump_json() for inv in invoice_result]
+        df = pl.DataFrame(invoice_jsons)
 
-    try:
-        # Check if invoice file already exists
-        if invoice_file.exists():
-            logger.info(f"Invoice file {invoice_file} already exists.")
-            
-            # Check if output file exists and contains this invoice data
-            if df_output_file.exists():
-                try:
-                    # Read existing data
-                    df_existing = pl.read_ndjson(df_output_file)
-                    
-                    if file_hash in df_existing["file_hash"].to_list():
-                        logger.info(f"File hash {file_hash} already exists. Reading from local storage.")
-                        return df_existing.filter(pl.col("file_hash") == file_hash)
-                    else:
-                        logger.info(f"File hash {file_hash} not found in existing output. Continuing with parse.")
-                except Exception as e:
-                    logger.warning(f"Failed to read output data: {str(e)}")
-        else:
-            logger.info(f"Invoice file {invoice_file} not found, copying file.")
-            
-            # Copy the invoice file to the invoices directory
-            try:
-                import shutil
-                shutil.copy2(local_file_path_str, invoice_file)
-            except Exception as e:
-                logger.warning(f"Error copying invoice file: {str(e)}")
-    
-    except Exception as e:
-        logger.warning(f"Error with file operations: {str(e)}")
+    df = df.select(
+        pl.col("column_0").str.json_decode().alias("page_struct")
+    ).unnest("page_struct")
 
-    # Process the invoice
-    try:
-        invoice_result = parser.parse_invoice(local_file_path_str)
+    return df.with_columns(
+        pl.lit(local_file_path).alias("path"),
+        pl.lit(file_hash).alias("file_hash"),
+    )
 
-        # Handle both single invoice and list of invoices
-        if hasattr(invoice_result, "model_dump_json"):
-            invoice_json = invoice_result.model_dump_json()
-            df = pl.DataFrame([invoice_json])
-        else:
-            # Assuming list of Invoice objects
-            invoice_jsons = [inv.model_dump_json() for inv in invoice_result]
-            df = pl.DataFrame(invoice_jsons)
 
-        df = df.select(
-            pl.col("column_0").str.json_decode().alias("page_struct")
-        ).unnest("page_struct")
+@timed("parse_invoice")
+def parse_invoice(
+    local_file_path: str, data_path=data_path, ingested: Optional[IngestedFile] = None
+) -> pl.DataFrame:
+    """
+    Parse an invoice using local file operations. Pass `ingested` if the
+    file has been read and stored already, so it is not read again.
+    """
+    # Convert Path to string if needed
+    local_file_path_str = str(local_file_path)
+    # Read the file once: hash it, keep a content-addressed copy and reuse
+    # the same bytes for the OCR upload
+    if ingested is None:
+        with span("ingest"):
+            ingested = ingest_file(local_file_path_str, data_path)
+    file_hash = ingested.file_hash
 
-        df = df.with_columns(
-            pl.lit(local_file_path_str).alias("path"),
-            pl.lit(file_hash).alias("file_hash"),
+    # Process the invoice
+    try:
+        invoice_result = services.parser.parse_invoice(
+            local_file_path_str, file_hash, content=ingested.content
         )
+        df = invoice_result_to_df(invoice_result, local_file_path_str, file_hash)
 
         # Save result to local file system
-        local_save_ndjson(df, "output.ndjson", data_path)
+        save_invoice_df(df, data_path)
         
         return df
     except ValueError as e:
@@ -307,99 +274,108 @@ def parse_invoice(local_file_path: str, data_path=data_path) -> pl.DataFrame:
         raise
 
 
-def filter_items(invoice_items_df: pl.DataFrame, items: List[str]) -> pl.DataFrame:
-    output = get_hash_map(invoice_items_df, items).sort(
-        "max_similarity_ratio", descending=True
-    )
+@timed("parse_invoice")
+async def parse_invoice_async(
+    local_file_path: str, data_path=data_path, ingested: Optional[IngestedFile] = None
+) -> pl.DataFrame:
+    """Like `parse_invoice`, but the OCR calls do not block the event loop"""
+    local_file_path_str = str(local_file_path)
+    if ingested is None:
+        with span("ingest"):
+            ingested = await asyncio.to_thread(ingest_file, local_file_path_str, data_path)
+    file_hash = ingested.file_hash
 
-    # Make sure to preserve the date field if it exists in the dataframe
-    columns_to_select = ["description", "adjusted_amount"]
-    if "date" in invoice_items_df.columns:
-        columns_to_select.append("date")
-
-    return output.select(columns_to_select)
+    try:
+        invoice_result = await services.parser.parse_invoice_async(
+            local_file_path_str, file_hash, content=ingested.content
+        )
+        df = invoice_result_to_df(invoice_result, local_file_path_str, file_hash)
+        await asyncio.to_thread(save_invoice_df, df, data_path)
+        return df
+    except ValueError as e:
+        logger.error(f"Error: {e}")
+        raise
 
 
-def group_waarborg_fields(invoice_items_df: pl.DataFrame) -> pl.DataFrame:
+def group_waarborg_lazy(
+    invoice_items_lf: pl.LazyFrame, by: str = "file_hash"
+) -> pl.LazyFrame:
+    """Merge all waarborg (deposit) lines of an invoice into one 'waarborg net' line"""
+    columns = invoice_items_lf.collect_schema().names()
     waarborg_filter = pl.col("description").str.contains("waarborg")
-    waarborg_df = invoice_items_df.filter(waarborg_filter)
-
-    if waarborg_df.is_empty():
-        return invoice_items_df
-
-    return pl.concat(
-        [
-            invoice_items_df.filter(~waarborg_filter),
-            waarborg_df.group_by(pl.lit(1))
-            .agg(
-                pl.exclude(["adjusted_amount"]).first(),
-                pl.sum("adjusted_amount").alias("adjusted_amount"),
-            )
-            .select(invoice_items_df.columns)
-            .with_columns(pl.lit("waarborg net").alias("description")),
-        ]
+
+    waarborg_lf = (
+        invoice_items_lf.filter(waarborg_filter)
+        .group_by(by, maintain_order=True)
+        .agg(
+            pl.exclude("adjusted_amount", by).first(),
+            pl.sum("adjusted_amount").alias("adjusted_amount"),
+        )
+        .select(columns)
+        .with_columns(pl.lit("waarborg net").alias("description"))
     )
+    return pl.concat([invoice_items_lf.filter(~waarborg_filter), waarborg_lf])
 
 
-def clean_invoice_df(invoice_items_df: pl.DataFrame) -> pl.DataFrame:
+def group_waarborg_fields(invoice_items_df: pl.DataFrame, by: str = "file_hash") -> pl.DataFrame:
+    return group_waarborg_lazy(invoice_items_df.lazy(), by).collect()
+
+
+def clean_invoices_lazy(
+    invoices_lf: pl.LazyFrame, by: str = "file_hash"
+) -> pl.LazyFrame:
+    """
+    Lazy cleaning pipeline for one or many parsed invoices.
+
+    `by` names the column identifying an invoice, so shifts, totals and the
+    waarborg grouping never cross invoice boundaries. A single invoice is
+    cleaned by the same key: window expressions over it keep the columns
+    aligned where plain shifts followed by a filter trip a polars panic on
+    multi-page frames. Adds `items_sum` and `amount_mismatch` so the
+    total-amount check can be done on the collected result.
+    """
     total_amount_filter = pl.col("description").str.contains(
         "total payment|total amount"
     )
-
-    adjusted_discount = (
-        pl.when(
-            pl.col("next_description").str.to_lowercase().str.starts_with("korting")
-        )
-        .then(pl.col("next_discount"))
-        .otherwise(
-            # pl.when(pl.col("description").str.contains("korting"))
-            # .then(pl.col("discount"))
-            # .otherwise(pl.lit(0.0))
-            pl.col("discount")
-        )
-        .alias("discount")
+    # apple due to xtra sign similar to an apple
+    not_a_product_filter = pl.col("description").str.contains(
+        "total payment|total amount|apple|maestro"
+    )
+    next_is_korting = (
+        pl.col("next_description").str.to_lowercase().str.starts_with("korting")
     )
 
-    # First extract the total amount from any row with korting/total payment/total amount due
-    invoice_items_df = (
-        invoice_items_df.explode("items")
+    cleaned_lf = (
+        invoices_lf.explode("items")
         .unnest("items")
         .filter(pl.col("description").is_not_null())
         .with_columns(
-            (pl.col("quantity") * pl.col("unit_price")).round(2).alias("price")
+            (pl.col("quantity") * pl.col("unit_price")).round(2).alias("price"),
+            pl.col("description").str.to_lowercase().alias("description"),
         )
-        .with_columns(pl.col("description").str.to_lowercase().alias("description"))
         .with_columns(
-            [
-                pl.col("discount").shift(-1).alias("next_discount"),
-                pl.col("description").shift(-1).alias("next_description"),
-            ]
+            pl.col("discount").shift(-1).over(by).alias("next_discount"),
+            pl.col("description").shift(-1).over(by).alias("next_description"),
         )
         .with_columns(
-            pl.when(
-                pl.col("next_description").str.to_lowercase().str.starts_with("korting")
-            )
-            .then((pl.col("description") + " " + pl.col("next_description")))
+            pl.when(next_is_korting)
+            .then(pl.col("description") + " " + pl.col("next_description"))
             .otherwise(pl.col("description"))
-            .alias("description")
+            .alias("description"),
+            pl.when(next_is_korting)
+            .then(pl.col("next_discount"))
+            .otherwise(pl.col("discount"))
+            .alias("discount"),
         )
-        .with_columns(adjusted_discount)
-    )
-
-    # Get total amount if available (use first match if multiple rows)
-    total_amount_df = invoice_items_df.filter(total_amount_filter)
-    total_amount = (
-        total_amount_df["total_amount_invoice"][0]
-        if not total_amount_df.is_empty()
-        else None
-    )
-
-    # apple due to xtra sign similar to an apple
-    not_a_product_filter = pl.col("description").str.contains(
-        "total payment|total amount|apple|maestro"
-    )
-    cleaned_df = (
-        invoice_items_df.filter(~not_a_product_filter)
+        # Total amount from the first total payment/total amount row, if any
+        .with_columns(
+            pl.col("total_amount_invoice")
+            .filter(total_amount_filter)
+            .first()
+            .over(by)
+            .alias("total_amount")
+        )
+        .filter(~not_a_product_filter)
         # Adjust price by discount
         .with_columns(
             (pl.col("price") * (1 - (pl.col("discount") / 100)))
@@ -408,127 +384,155 @@ def clean_invoice_df(invoice_items_df: pl.DataFrame) -> pl.DataFrame:
         )
     )
 
-    # Add total_amount as a column and check for discrepancy
-    sum_price = cleaned_df["adjusted_amount"].sum()
-    if total_amount is not None and abs(sum_price - total_amount) > 0.01:
-        print(f"Sum of items ({sum_price}) differs from total amount ({total_amount})")
+    # Add date column if it exists in the original data
+    if "invoice_date" in cleaned_lf.collect_schema().names():
+        cleaned_lf = cleaned_lf.with_columns(
+            pl.col("invoice_date").first().over(by).alias("date")
+        )
 
-    # Add date back to each row if we had captured it earlier
-    cleaned_df_with_total = cleaned_df.with_columns(
-        pl.lit(total_amount).alias("total_amount")
+    return (
+        group_waarborg_lazy(cleaned_lf, by)
+        .select(pl.exclude("total_amount"), pl.col("total_amount"))
+        .with_columns(pl.col("adjusted_amount").sum().over(by).alias("items_sum"))
+        .with_columns(
+            ((pl.col("items_sum") - pl.col("total_amount")).abs() > 0.01)
+            .fill_null(False)
+            .alias("amount_mismatch")
+        )
     )
-    # Add date column if it exists in the original data
-    if "invoice_date" in invoice_items_df.columns:
-        invoice_date = invoice_items_df["invoice_date"].first()
-        cleaned_df_with_total = cleaned_df_with_total.with_columns(
-            pl.lit(invoice_date).alias("date")
+
+
+@timed("clean_invoice_df")
+def clean_invoice_df(invoice_items_df: pl.DataFrame) -> pl.DataFrame:
+    """Clean one parsed invoice (all its pages), as `invoice_result_to_df` returns it"""
+    cleaned_df = clean_invoices_lazy(invoice_items_df.lazy()).collect()
+
+    if cleaned_df["amount_mismatch"].any():
+        sum_price = cleaned_df["items_sum"][0]
+        total_amount = cleaned_df["total_amount"][0]
+        logger.warning(
+            f"Sum of items ({sum_price}) differs from total amount ({total_amount})"
         )
 
-    return group_waarborg_fields(cleaned_df_with_total)
+    return cleaned_df.drop("items_sum", "amount_mismatch")
 
 
 def items_dicts_to_items(items_dicts: List[Dict]) -> List[str]:
     return [items["description"] for items in items_dicts]
 
 
+def category_items(labelled_df: pl.DataFrame, category: str) -> pl.DataFrame:
+    """Items of one category, best matches first"""
+    # Make sure to preserve the date field if it exists in the dataframe
+    columns_to_select = ["description", "adjusted_amount"]
+    if "date" in labelled_df.columns:
+        columns_to_select.append("date")
+
+    return (
+        labelled_df.filter(pl.col("category") == category)
+        .sort("similarity_ratio", descending=True, maintain_order=True)
+        .select(columns_to_select)
+    )
+
+
+@timed("process_invoice")
 async def process_invoice(
-    local_file_path: str, payer_name: str, sofies_amount: float, data_path: str
+    local_file_path: str,
+    payer_name: str,
+    sofies_amount: float,
+    data_path: str,
+    collapse: bool = SPLITWISE_COLLAPSE_CATEGORIES,
+    submit_key: Optional[str] = None,
+    ingested: Optional[IngestedFile] = None,
 ) -> str:
-    # Get the invoice data without await
-    invoice_df = parse_invoice(local_file_path, data_path=data_path)
+    """
+    Parse the invoice, register its expenses and return the reply text.
+
+    `submit_key` is recorded right before anything is sent to Splitwise; if
+    it was recorded already (a redelivered job) nothing is registered again.
+    `ingested` is the file as the webhook already read it, if available.
+    """
+    invoice_df = await parse_invoice_async(
+        local_file_path, data_path=data_path, ingested=ingested
+    )
     invoice_items_df = clean_invoice_df(invoice_df)
     total_price = invoice_items_df["adjusted_amount"].sum()
     sofies_pct = (
         sofies_amount / total_price * 100 if payer_name.lower() != "sofie" else 100
     )
-    maartens_items_df = filter_items(
-        invoice_items_df,
-        [
-            "sojadrank",
-            "espresso",
-            "koffie",
-            "graindor",
-            "bananen",
-            "actimel",
-            "san pellegrino clementina",
-            "san pellegrino aranciata",
-            "roomijs vanille",
-            "côte d'or",
-            "pizza Hawaii",
-            "pizza barbecue",
-            "magic star", # appel
-            "coryphee", # appel
-            "bounty", # koek
-
-        ],
-    )
-
-    maartens_items_descriptions = maartens_items_df["description"].to_list()
-    register_splitwise_expenses(
-        maartens_items_df.sort("description").to_dicts(),
-        payer_name=payer_name,
-        friend_names=["Sofie"],
-        maartens_owe_percentage=1,
-        sofies_pct=sofies_pct,
-    )
 
-    sofies_items_df = filter_items(
-        invoice_items_df,
-        [
-            "raclette", "maandverband", "skyr", "sungold", "yoghurt", "frangipane", 
-            "amandelen", "sinaasappel", "agave", "havermout", "havervlokken"],
-    )
-    sofies_items_descriptions = sofies_items_df["description"].to_list()
-    register_splitwise_expenses(
-        sofies_items_df.sort("description").to_dicts(),
-        payer_name=payer_name,
-        friend_names=["Sofie"],
-        maartens_owe_percentage=0,
-        sofies_pct=sofies_pct,
-    )
-
-    common_items_df = filter_items(
-        invoice_items_df,
-        ["handzeep", "ontstopper", "allesreiniger", "afwasmiddel",
-         "toilet"],
-    )
-    common_items_descriptions = common_items_df["description"].to_list()
-    # register_splitwise_expenses(common_items_df.to_dicts(), group_name=BLIJDEBERG_SW_GROUP_NAME, sofies_pct=sofies_pct)
+    # Label every line with its category in a single pass (see categories.json)
+    category_index = get_category_index(CATEGORY_RULES_PATH)
+    with span("classify", lines=invoice_items_df.height):
+        labelled_df = category_index.classify(
+            invoice_items_df.filter(pl.col("description").is_not_null())
+        )
 
-    not_rest_items = (
-        common_items_descriptions
-        + maartens_items_descriptions
-        + sofies_items_descriptions
-    )
-    rest_items_df = invoice_items_df.filter(pl.col("description").is_not_null()).filter(
-        ~pl.col("description").is_in(not_rest_items)
-    )
-    register_splitwise_expenses(
-        rest_items_df.sort("description").to_dicts(), payer_name=payer_name, sofies_pct=sofies_pct
-    )
+    expenses = []
+    answer = ""
+    for rule in category_index.rules:
+        items_df = category_items(labelled_df, rule.name)
+        if rule.register:
+            # Looks up the Splitwise user and groups, which may block on the API
+            expenses += await asyncio.to_thread(
+                build_splitwise_expenses,
+                items_df.sort("description").to_dicts(),
+                payer_name=payer_name,
+                friend_names=rule.friend_names,
+                maartens_owe_percentage=rule.maartens_owe_percentage,
+                sofies_pct=sofies_pct,
+                collapse_description=rule.label if collapse else None,
+            )
+        answer += f"Registered the {rule.label}: \n{tabulate(items_df.select('description', 'adjusted_amount').to_pandas())}\n\n"
+
+    if submit_key is not None and not await asyncio.to_thread(
+        services.idempotency.first_seen, submit_key
+    ):
+        logger.warning(f"Expenses for {submit_key} were already submitted, skipping.")
+        return "This invoice has already been registered."
+
+    # Submit everything at once so the createExpense calls run concurrently
+    with span("splitwise.submit", expenses=len(expenses)):
+        results = await asyncio.to_thread(
+            submit_expenses,
+            services.splitwise,
+            expenses,
+            max_workers=SPLITWISE_MAX_WORKERS,
+        )
 
-    answer = f"Registered the Maartens items: \n{tabulate(maartens_items_df.to_pandas())}\n\n"
-    answer += (
-        f"Registered the Sofies items: \n{tabulate(sofies_items_df.to_pandas())}\n\n"
-    )
-    answer += (
-        f"Registered the common items: \n{tabulate(common_items_df.to_pandas())}\n\n"
-    )
-    answer += f"Registered the rest items: \n{tabulate(rest_items_df.select('description', 'adjusted_amount').to_pandas())}\n\n"
+    failed = [r for r in results if not r.ok]
+    if failed:
+        answer += "Failed to register: \n" + tabulate(
+            [(r.description, r.cost, r.error) for r in failed]
+        )
 
     return answer
 
 
-conversation_state = {}
+# Per-chat conversation state lives in `services.conversation_state`, a
+# StateStore shared by all instances (see STATE_STORE in services.py).
 
 # Add new states for our conversation flow
 CONVERSATION_STATES = {
     "WAIT_FOR_GROUP": "Which group is this expense for? (Anti Hangriness Sofieke/Blijdeberg)",
     "WAIT_FOR_PAYER": "Who paid the invoice?",
-    "WAIT_FOR_PDF": "Send me an invoice PDF file, please.",
+    "WAIT_FOR_PDF": "Send me an invoice PDF file or a photo of the receipt, please.",
 }
 
 
+def invoice_attachment(message: Message) -> Optional[Tuple[str, bool]]:
+    """File id of the receipt sent in `message`, and whether it is a photo"""
+    document = message.document
+    if document and document.mime_type == "application/pdf":
+        return document.file_id, False
+    if document and document.mime_type in IMAGE_MIME_TYPES:
+        return document.file_id, True
+    if message.photo:
+        # Telegram sends every size it generated, largest last
+        return message.photo[-1].file_id, True
+    return None
+
+
 def get_available_members(group_name: str) -> List[str]:
     group = get_group(group_name)
     if group:
@@ -536,20 +540,40 @@ def get_available_members(group_name: str) -> List[str]:
     return []
 
 
+@timed("handle_update")
 async def handle_telegram_update(update_data: dict, data_path=data_path) -> None:
-    update = Update.de_json(update_data, bot)
+    update = Update.de_json(update_data, services.bot)
+    update_key = IdempotencyGuard.update_key(update.update_id)
+
+    # Telegram redelivers updates when the webhook is slow; handle each once
+    if not await asyncio.to_thread(services.idempotency.first_seen, update_key):
+        logger.info(f"Skipping already processed update {update.update_id}.")
+        return
+
+    try:
+        await _handle_update(update, data_path)
+    except Exception:
+        # The webhook fails, so Telegram redelivers the update; handle it then
+        await asyncio.to_thread(services.idempotency.forget, update_key)
+        raise
+
+
+async def _handle_update(update: Update, data_path: str) -> None:
+    bot = services.bot
     chat_id = update.message.chat.id
     text = update.message.text or ""
+    conversation_state = services.conversation_state
+    chat_state = await conversation_state.aget(chat_id)
 
     # Initialize new conversation
-    if chat_id not in conversation_state:
-        conversation_state[chat_id] = {"state": "WAIT_FOR_GROUP"}
+    if chat_state is None:
+        await conversation_state.aset(chat_id, {"state": "WAIT_FOR_GROUP"})
         await bot.send_message(
             chat_id=chat_id, text=CONVERSATION_STATES["WAIT_FOR_GROUP"]
         )
         return
 
-    current_state = conversation_state[chat_id]["state"]
+    current_state = chat_state["state"]
 
     def longest_common_subsequence(str1, str2):
         sequence_matcher = difflib.SequenceMatcher(None, str1, str2)
@@ -562,13 +586,19 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
 
     # Reset conversation if user types "reset"
     if text.strip().lower() == "reset":
-        conversation_state[chat_id] = {"state": "WAIT_FOR_GROUP"}
+        await conversation_state.aset(chat_id, {"state": "WAIT_FOR_GROUP"})
         await bot.send_message(
             chat_id=chat_id,
             text="Conversation reset. " + CONVERSATION_STATES["WAIT_FOR_GROUP"],
         )
         return
 
+    # Reload the cached Splitwise groups, e.g. after membership changed
+    if text.strip().lower() == "refresh":
+        await asyncio.to_thread(services.groups.refresh)
+        await bot.send_message(chat_id=chat_id, text="Splitwise groups refreshed.")
+        return
+
     # Handle group selection
     if current_state == "WAIT_FOR_GROUP":
         group_name = text.strip().lower()
@@ -588,8 +618,8 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
                 text=f"Invalid group. Please choose from: {SOFIE_MAARTEN_SW_GROUP_NAME} or {BLIJDEBERG_SW_GROUP_NAME}",
             )
             return
-        conversation_state[chat_id].update(
-            {"state": "WAIT_FOR_PAYER", "group_name": group_name}
+        await conversation_state.aupdate(
+            chat_id, {"state": "WAIT_FOR_PAYER", "group_name": group_name}
         )
         message = (
             f"Group selected: {group_name}. {CONVERSATION_STATES['WAIT_FOR_PAYER']}"
@@ -600,8 +630,8 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
         # Handle payer name
     if current_state == "WAIT_FOR_PAYER":
         payer_name = text.strip().lower()
-        group_name = conversation_state[chat_id]["group_name"]
-        available_members = get_available_members(group_name)
+        group_name = chat_state["group_name"]
+        available_members = await asyncio.to_thread(get_available_members, group_name)
         payer_name = fuzzy_match(payer_name, available_members)
 
         if not payer_name:
@@ -611,17 +641,13 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
             )
             return
 
-        conversation_state[chat_id].update(
-            {"state": "WAIT_FOR_PDF", "payer_name": payer_name}
-        )
-
         if payer_name.lower() == "sofie":
-            conversation_state[chat_id]["sofies_pct"] = 1
+            changes = {"state": "WAIT_FOR_PDF", "sofies_pct": 1}
             message = CONVERSATION_STATES["WAIT_FOR_PDF"]
         else:
             message = f"Payer selected: {payer_name}. How much did Sofie pay?"
-            conversation_state[chat_id]["state"] = "WAIT_FOR_SOFIE_AMOUNT"
-            conversation_state[chat_id]["sofies_pct"] = 0
+            changes = {"state": "WAIT_FOR_SOFIE_AMOUNT", "sofies_pct": 0}
+        await conversation_state.aupdate(chat_id, {"payer_name": payer_name, **changes})
 
         await bot.send_message(chat_id=chat_id, text=message)
         return
@@ -630,8 +656,8 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
     if current_state == "WAIT_FOR_SOFIE_AMOUNT":
         try:
             sofie_amount = float(text.strip())
-            conversation_state[chat_id].update(
-                {"state": "WAIT_FOR_PDF", "sofie_amount": sofie_amount}
+            await conversation_state.aupdate(
+                chat_id, {"state": "WAIT_FOR_PDF", "sofie_amount": sofie_amount}
             )
             message = (
                 f"Sofie's amount: {sofie_amount}. {CONVERSATION_STATES['WAIT_FOR_PDF']}"
@@ -642,46 +668,152 @@ async def handle_telegram_update(update_data: dict, data_path=data_path) -> None
         return
 
     # Handle PDF upload
+    attachment = invoice_attachment(update.message)
     if current_state == "WAIT_FOR_PDF":
-        if not (
-            update.message.document
-            and update.message.document.mime_type == "application/pdf"
-        ):
-            await bot.send_message(chat_id=chat_id, text="Please send a PDF file.")
+        if attachment is None:
+            await bot.send_message(
+                chat_id=chat_id, text="Please send a PDF file or a photo of the receipt."
+            )
             return
 
     try:
-        file_id = update.message.document.file_id
+        file_id, is_photo = attachment
         file_info = await bot.get_file(file_id)
-        local_file_path = Path(data_path) / f"{file_id}.pdf"
-        await file_info.download_to_drive(local_file_path)
-
-        payer_name = conversation_state[chat_id]["payer_name"]
-        group_name = conversation_state[chat_id]["group_name"]
-        sofies_amount = conversation_state[chat_id].get("sofie_amount", 0)
-
-        # Convert Path to string for process_invoice
-        local_file_path_str = str(local_file_path)
-        answer = await process_invoice(
-            local_file_path_str,
-            payer_name=payer_name,
-            sofies_amount=sofies_amount,
-            data_path=data_path,
+        # Download into memory and store it under its hash in one pass,
+        # instead of writing, re-reading and copying the file
+        with span("telegram.download"):
+            content = await file_info.download_as_bytearray()
+        if is_photo:
+            # Shrink and straighten the photo into a small PDF before OCR
+            with span("image.preprocess", bytes=len(content)) as attributes:
+                content = await asyncio.to_thread(image_to_pdf, bytes(content))
+                attributes["pdf_bytes"] = len(content)
+        with span("ingest", bytes=len(content)):
+            ingested = await asyncio.to_thread(ingest_bytes, bytes(content), data_path)
+        local_file_path = ingested.path
+        file_hash = ingested.file_hash
+
+        job = {
+            "chat_id": chat_id,
+            # Convert Path to string for process_invoice
+            "local_file_path": str(local_file_path),
+            "payer_name": chat_state["payer_name"],
+            "group_name": chat_state["group_name"],
+            "sofies_amount": chat_state.get("sofie_amount", 0),
+            "data_path": data_path,
+            "file_hash": file_hash,
+        }
+    except Exception as e:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"An error occurred while processing the invoice: {str(e)}",
         )
-        logger.info(answer)
-        await bot.send_message(chat_id=chat_id, text=answer)
-        conversation_state.pop(chat_id, None)
+        await conversation_state.adelete(chat_id)
+        return
 
-    except ValueError as e:
-        await bot.send_message(chat_id=chat_id, text=str(e))
-        # Reset to group selection
-        conversation_state[chat_id] = {"state": "WAIT_FOR_GROUP"}
+    # Only submitted expenses make a receipt "registered"; the file key just
+    # keeps the same receipt from being processed twice at once
+    submit_key = IdempotencyGuard.submit_key(chat_id, file_hash)
+    if await asyncio.to_thread(services.idempotency.seen, submit_key):
+        await conversation_state.adelete(chat_id)
         await bot.send_message(
-            chat_id=chat_id, text=CONVERSATION_STATES["WAIT_FOR_GROUP"]
+            chat_id=chat_id, text="This invoice has already been registered."
         )
-    except Exception as e:
+        return
+    file_key = IdempotencyGuard.file_key(chat_id, file_hash)
+    if not await asyncio.to_thread(
+        services.idempotency.first_seen, file_key, INVOICE_CLAIM_TTL
+    ):
+        await conversation_state.adelete(chat_id)
+        await bot.send_message(
+            chat_id=chat_id, text="This invoice is already being processed."
+        )
+        return
+
+    # The conversation is complete once the job has its details; the job
+    # itself never touches it, as the user may have started a new one by then
+    if INVOICE_JOBS == "queue":
+        # Acknowledge right away; worker.py processes the job and replies
+        await asyncio.to_thread(services.job_queue.enqueue, job)
+        await conversation_state.adelete(chat_id)
         await bot.send_message(
             chat_id=chat_id,
-            text=f"An error occurred while processing the invoice: {str(e)}",
+            text="Invoice received, I'll send the registered items once it's processed.",
+        )
+        return
+
+    await conversation_state.adelete(chat_id)
+    try:
+        await run_invoice_job(job, ingested)
+    except Exception as e:
+        # Already reported to the chat; a redelivered update would only
+        # restart the conversation
+        logger.error(f"Processing the invoice for chat {chat_id} failed: {e}")
+
+
+async def release_unregistered(file_key: str, submit_key: str) -> None:
+    """
+    Let the user resend a receipt after a failure, unless its expenses were
+    already submitted (e.g. only the reply failed): resending would then
+    register them twice.
+    """
+    if await asyncio.to_thread(services.idempotency.seen, submit_key):
+        logger.warning(f"Keeping {file_key}: its expenses were already submitted.")
+        return
+    await asyncio.to_thread(services.idempotency.forget, file_key)
+
+
+async def run_invoice_job(
+    job: dict,
+    ingested: Optional[IngestedFile] = None,
+    attempt: int = 1,
+    max_attempts: int = 1,
+) -> None:
+    """
+    Process a downloaded invoice and send the result to the chat. `ingested`
+    saves reading the file again when the job runs inside the webhook.
+
+    Failures are re-raised, so the job queue can retry the job. Only the
+    final attempt reports the failure to the chat and lets the receipt be
+    resent; an earlier one would tell the user it failed just before a
+    retry registers it.
+    """
+    bot = services.bot
+    chat_id = job["chat_id"]
+    file_key = IdempotencyGuard.file_key(chat_id, job.get("file_hash"))
+    submit_key = IdempotencyGuard.submit_key(chat_id, job.get("file_hash"))
+    try:
+        answer = await process_invoice(
+            job["local_file_path"],
+            payer_name=job["payer_name"],
+            sofies_amount=job["sofies_amount"],
+            data_path=job["data_path"],
+            submit_key=submit_key,
+            ingested=ingested,
         )
-        conversation_state.pop(chat_id, None)
+        logger.info(answer)
+        with span("telegram.reply"):
+            await bot.send_message(chat_id=chat_id, text=answer)
+
+    except Exception as e:
+        if attempt < max_attempts:
+            logger.warning(
+                f"Invoice job for chat {chat_id} failed (attempt {attempt} of {max_attempts}), retrying: {e}"
+            )
+            raise
+        await release_unregistered(file_key, submit_key)
+        if isinstance(e, ValueError):
+            await bot.send_message(chat_id=chat_id, text=str(e))
+            # Back to group selection, unless the user already started over
+            await services.conversation_state.asetdefault(
+                chat_id, {"state": "WAIT_FOR_GROUP"}
+            )
+            await bot.send_message(
+                chat_id=chat_id, text=CONVERSATION_STATES["WAIT_FOR_GROUP"]
+            )
+        else:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"An error occurred while processing the invoice: {str(e)}",
+            )
+        raise
@@ -0,0 +1,61 @@
+"""
+Clean a synthetic receipt history per invoice vs. in one lazy pass.
+
+Usage (from ./webhook):
+    python benchmarks/bench_clean_invoices.py --invoices 100 1000 5000 --pages 2
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import polars as pl
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import clean_invoice_df, clean_invoices_lazy  # noqa: E402
+from benchmarks.synthetic import synthetic_invoices  # noqa: E402
+
+
+def clean_per_invoice(history: pl.DataFrame) -> pl.DataFrame:
+    return pl.concat(
+        [clean_invoice_df(invoice) for invoice in history.partition_by("file_hash")]
+    )
+
+
+def clean_batched(history: pl.DataFrame) -> pl.DataFrame:
+    return clean_invoices_lazy(history.lazy()).collect()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--invoices", type=int, nargs="+", default=[100, 1000])
+    arg_parser.add_argument("--lines", type=int, default=30)
+    arg_parser.add_argument("--pages", type=int, default=1, help="Pages per receipt.")
+    args = arg_parser.parse_args()
+    # Every synthetic receipt fails the total-amount check; keep the output readable
+    logger.remove()
+
+    for n_invoices in args.invoices:
+        history = synthetic_invoices(n_invoices, n_lines=args.lines, pages=args.pages)
+
+        start = time.perf_counter()
+        per_invoice = clean_per_invoice(history)
+        per_invoice_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = clean_batched(history)
+        batched_s = time.perf_counter() - start
+
+        key = ["file_hash", "description", "adjusted_amount"]
+        assert per_invoice.select(key).sort(key).equals(batched.select(key).sort(key))
+        print(
+            f"invoices={n_invoices:>6} rows={batched.height:>8} "
+            f"per-invoice={per_invoice_s * 1000:9.1f}ms "
+            f"lazy={batched_s * 1000:8.1f}ms speedup={per_invoice_s / batched_s:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare utils.get_hash_map against the previous difflib/map_elements version.
+
+Usage (from ./webhook):
+    python benchmarks/bench_fuzzy_match.py --lines 10 100 1000 5000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import polars as pl
+import polars_ds as pds
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.synthetic import synthetic_items  # noqa: E402
+from utils import get_hash_map, longest_common_subsequence, similarity_ratio  # noqa: E402
+
+TERMS = [
+    "sojadrank", "espresso", "koffie", "graindor", "bananen", "actimel",
+    "san pellegrino clementina", "san pellegrino aranciata", "roomijs vanille",
+    "côte d'or", "pizza Hawaii", "pizza barbecue", "magic star", "coryphee", "bounty",
+]
+
+
+def reference_get_hash_map(
+    df, terms: List[str], col_name="description", col_name_to_match="for_maarten"
+):
+    """get_hash_map as it was before the batched matcher, for comparison"""
+
+    def normalize_col(col_name: str) -> pl.Expr:
+        return (
+            pds.normalize_whitespace(
+                pds.remove_diacritics(
+                    pl.col(col_name)
+                    .str.to_lowercase()
+                    .str.strip_chars()
+                    .str.replace_all(r"\s+", " ")
+                    .str.split(" ")
+                    .list.set_difference(["boni", "bio", "everyday"])
+                    .list.set_difference(pds.extract_numbers(col_name))
+                    .list.join(" ")
+                )
+            )
+        ).alias(f"{col_name}_normalized")
+
+    cross_joined = df.with_columns(pl.lit(terms).alias(col_name_to_match)).explode(
+        col_name_to_match
+    )
+    output = (
+        cross_joined.with_columns(
+            normalize_col(col_name), normalize_col(col_name_to_match)
+        )
+        .with_columns(
+            pl.struct(f"{col_name}_normalized", f"{col_name_to_match}_normalized")
+            .map_elements(
+                lambda x: longest_common_subsequence(
+                    x[f"{col_name}_normalized"], x[f"{col_name_to_match}_normalized"]
+                ),
+                return_dtype=pl.Struct({"lcs": pl.Utf8, "start_index": pl.Int64}),
+            )
+            .alias("lcs_struct")
+        )
+        .unnest("lcs_struct")
+        .with_columns(
+            pl.struct("lcs", col_name, col_name_to_match)
+            .map_elements(
+                lambda row: similarity_ratio(
+                    row["lcs"], row[col_name], row[col_name_to_match]
+                ),
+                return_dtype=pl.Float64,
+            )
+            .alias("similarity_ratio"),
+        )
+        .with_columns(
+            pl.col("similarity_ratio").max().over(col_name).alias("max_similarity_ratio")
+        )
+        .filter(pl.col("similarity_ratio") == pl.col("max_similarity_ratio"))
+        .unique("description")
+    )
+    return output.filter(pl.col("similarity_ratio") >= 0.8)
+
+
+def timed(fn, *args) -> tuple:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--lines", type=int, nargs="+", default=[10, 100, 1000])
+    args = arg_parser.parse_args()
+
+    for n_lines in args.lines:
+        df = synthetic_items(n_lines)
+        new, new_s = timed(get_hash_map, df, TERMS)
+        old, old_s = timed(reference_get_hash_map, df, TERMS)
+
+        key = ["description", "similarity_ratio"]
+        assert new.select(key).sort(key).equals(old.select(key).sort(key)), (
+            f"Results differ for {n_lines} lines"
+        )
+        print(
+            f"lines={n_lines:>6} difflib={old_s * 1000:9.1f}ms "
+            f"batched={new_s * 1000:9.1f}ms speedup={old_s / new_s:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+pytest-benchmark suite for the polars hot paths of the webhook.
+
+Receipts range from 10 to 10,000 lines and the invoice store history from
+1 to 100,000 invoices. Not collected by a plain `pytest` run; needs
+`pip install pytest-benchmark`.
+
+Usage (from ./webhook):
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-autosave
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-compare --benchmark-compare-fail=median:20%
+
+Results are saved under ./.benchmarks, one JSON file per run;
+`pytest-benchmark compare` lists and diffs them.
+"""
+import sys
+from pathlib import Path
+
+import polars as pl
+import pytest
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import (  # noqa: E402
+    build_splitwise_expenses,
+    clean_invoice_df,
+    group_waarborg_fields,
+)
+from benchmarks.bench_fuzzy_match import TERMS  # noqa: E402
+from benchmarks.bench_replay import FakeMistral, FakeSplitwise  # noqa: E402
+from benchmarks.synthetic import synthetic_invoices  # noqa: E402
+from category_index import get_category_index  # noqa: E402
+from group_directory import GroupDirectory  # noqa: E402
+from invoice_cache import LocalInvoiceCache  # noqa: E402
+from invoice_parser import InvoiceParser  # noqa: E402
+from invoice_store import InvoiceStore  # noqa: E402
+from services import services  # noqa: E402
+from utils import get_hash_map  # noqa: E402
+
+LINES = [10, 100, 1_000, 10_000]
+HISTORY = [1, 1_000, 100_000]
+
+# Synthetic receipts fail the total-amount check; keep the output readable
+logger.remove()
+
+
+@pytest.fixture(scope="module", params=LINES, ids=lambda n: f"lines={n}")
+def receipt(request) -> pl.DataFrame:
+    """One parsed receipt, as parse_invoice returns it."""
+    return synthetic_invoices(1, n_lines=request.param, seed=request.param)
+
+
+@pytest.fixture(scope="module")
+def cleaned(receipt) -> pl.DataFrame:
+    return clean_invoice_df(receipt)
+
+
+@pytest.fixture(scope="module", params=HISTORY, ids=lambda n: f"history={n}")
+def data_path(request, tmp_path_factory) -> str:
+    """A data dir whose invoice store holds `param` one-line invoices."""
+    path = tmp_path_factory.mktemp(f"history-{request.param}")
+    store = InvoiceStore(str(path / "output" / "store"))
+    store.append(synthetic_invoices(request.param, n_lines=1))
+    return str(path)
+
+
+@pytest.fixture
+def fake_splitwise():
+    splitwise = FakeSplitwise(latency=0)
+    services.override(
+        splitwise=splitwise,
+        current_user=splitwise.getCurrentUser(),
+        groups=GroupDirectory(splitwise),
+    )
+    yield splitwise
+    services.reset()
+
+
+def test_get_hash_map(benchmark, cleaned):
+    benchmark(get_hash_map, cleaned, TERMS)
+
+
+def test_clean_invoice_df(benchmark, receipt):
+    benchmark(clean_invoice_df, receipt)
+
+
+def test_group_waarborg_fields(benchmark, cleaned):
+    benchmark(group_waarborg_fields, cleaned)
+
+
+def test_classify(benchmark, cleaned):
+    """Labelling every line with its category, as process_invoice does."""
+    benchmark(get_category_index().classify, cleaned)
+
+
+def test_cached_invoice_lookup(benchmark, receipt, tmp_path):
+    """The cache lookup parse_invoice does before calling Mistral."""
+    client = FakeMistral(n_lines=receipt.height)
+    parser = InvoiceParser(client, cache=LocalInvoiceCache(str(tmp_path)))
+    file_hash = receipt["file_hash"][0]
+    cache_key = parser._cache_key(file_hash)
+    parser._store(cache_key, client._invoice(file_hash.encode()))
+    assert benchmark(parser._cached, cache_key) is not None
+
+
+def test_store_contains_cold(benchmark, data_path):
+    """First history check in a fresh process: loads the stored file hashes."""
+    root = str(Path(data_path) / "output" / "store")
+    file_hash = synthetic_invoices(1, n_lines=1)["file_hash"][0]
+    benchmark.pedantic(
+        lambda store: store.contains(file_hash),
+        setup=lambda: ((InvoiceStore(root),), {}),
+        rounds=20,
+    )
+
+
+def test_share_arithmetic(benchmark, cleaned, fake_splitwise):
+    """Splitting every line between the group members (no Splitwise calls)."""
+    items = cleaned.select("description", "adjusted_amount").to_dicts()
+    expenses = benchmark(
+        build_splitwise_expenses,
+        items,
+        payer_name="Maarten",
+        maartens_owe_percentage=0.5,
+        sofies_pct=25,
+    )
+    assert len(expenses) == len(items)
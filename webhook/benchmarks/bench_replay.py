@@ -0,0 +1,289 @@
+"""
+Replay Telegram conversations through handle_telegram_update under load.
+
+Every chat runs a full conversation (greeting -> group -> payer -> amount ->
+PDF) against a fake Bot, a fake Mistral client with configurable latency and
+a fake Splitwise, so the webhook code itself is what gets measured. The
+conversation is read from a recorded update file (one Telegram update JSON
+per line) or, by default, built in; it is cloned per chat with fresh update,
+chat and file ids.
+
+Usage (from ./webhook):
+    python benchmarks/bench_replay.py --chats 200 --concurrency 50 --ocr-latency 2
+    python benchmarks/bench_replay.py --updates recorded.jsonl --chats 50
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import tracing  # noqa: E402
+from app import (  # noqa: E402
+    BLIJDEBERG_SW_GROUP_NAME,
+    SOFIE_MAARTEN_SW_GROUP_NAME,
+    handle_telegram_update,
+)
+from benchmarks.synthetic import synthetic_invoice  # noqa: E402
+from group_directory import GroupDirectory  # noqa: E402
+from idempotency import IdempotencyGuard, SqliteIdempotencyBackend  # noqa: E402
+from models import Invoice  # noqa: E402
+from services import services  # noqa: E402
+from state_store import InMemoryStateStore  # noqa: E402
+
+# First names as Splitwise returns them (categories.json matches on these)
+MEMBERS = ["Maarten", "Sofie"]
+CONVERSATION = ["hi", "1", "maarten", "12.5", None]  # None: the PDF
+
+
+def _message(update_id: int, chat_id: int, text: str = None) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Replay"},
+    }
+    if text is None:
+        message["document"] = {
+            "file_id": f"pdf-{chat_id}",
+            "file_unique_id": f"pdf-{chat_id}",
+            "file_name": "invoice.pdf",
+            "mime_type": "application/pdf",
+        }
+    else:
+        message["text"] = text
+    return {"update_id": update_id, "message": message}
+
+
+def default_conversation() -> List[dict]:
+    return [_message(i, 0, text) for i, text in enumerate(CONVERSATION)]
+
+
+def load_conversation(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def clone_conversation(updates: List[dict], chat_index: int, chat_id: int) -> List[dict]:
+    """A recorded conversation with update, chat and file ids unique to one chat."""
+    cloned = []
+    for i, update in enumerate(updates):
+        update = copy.deepcopy(update)
+        update["update_id"] = chat_index * len(updates) + i
+        message = update["message"]
+        message["chat"]["id"] = chat_id
+        if "from" in message:
+            message["from"]["id"] = chat_id
+        if "document" in message:
+            message["document"]["file_id"] = f"pdf-{chat_id}"
+            message["document"]["file_unique_id"] = f"pdf-{chat_id}"
+        cloned.append(update)
+    return cloned
+
+
+class FakeFile:
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+    async def download_as_bytearray(self) -> bytearray:
+        # A distinct (tiny) "PDF" per chat, so nothing is deduplicated
+        return bytearray(b"%PDF-1.4\n% " + self.file_id.encode() + b"\n%%EOF\n")
+
+
+class FakeBot:
+    """The Bot methods the webhook uses; replies are counted, not sent."""
+
+    defaults = None
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+    async def get_file(self, file_id: str) -> FakeFile:
+        await asyncio.sleep(self.latency)
+        return FakeFile(file_id)
+
+
+class FakeMistral:
+    """Returns a synthetic receipt after `latency` (+- `jitter`) seconds."""
+
+    ocr_model = "fake-ocr"
+    parse_model = "fake-parse"
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.0, n_lines: int = 30):
+        self.latency = latency
+        self.jitter = jitter
+        self.n_lines = n_lines
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def _invoice(self, content: bytes) -> Invoice:
+        file_hash = hashlib.sha256(content or b"").hexdigest()
+        rng = random.Random(file_hash)
+        return Invoice(**synthetic_invoice(rng, self.n_lines, file_hash))
+
+    def get_response(self, file_path: str, content: bytes = None) -> Invoice:
+        time.sleep(self._delay())
+        return self._invoice(content)
+
+    async def get_response_async(self, file_path: str, content: bytes = None) -> Invoice:
+        await asyncio.sleep(self._delay())
+        return self._invoice(content)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str):
+        self.id = user_id
+        self.first_name = first_name
+
+
+class FakeGroup:
+    def __init__(self, group_id: int, name: str, members: list):
+        self.id = group_id
+        self.name = name
+        self.members = members
+
+    def getName(self):
+        return self.name
+
+    def getMembers(self):
+        return self.members
+
+
+class FakeSplitwise:
+    """Groups with `MEMBERS`; createExpense sleeps `latency` and succeeds."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.users = [FakeUser(i + 1, name) for i, name in enumerate(MEMBERS)]
+        self.created = 0
+        self._lock = threading.Lock()
+
+    def getCurrentUser(self):
+        return self.users[0]
+
+    def getGroups(self):
+        return [
+            FakeGroup(1, SOFIE_MAARTEN_SW_GROUP_NAME, self.users),
+            FakeGroup(2, BLIJDEBERG_SW_GROUP_NAME, self.users),
+        ]
+
+    def createExpense(self, expense):
+        time.sleep(self.latency)
+        with self._lock:
+            self.created += 1
+        return expense, None
+
+
+async def run_chat(updates: List[dict], data_path: str, latencies: List[float]) -> None:
+    for update in updates:
+        start = time.perf_counter()
+        await handle_telegram_update(update, data_path=data_path)
+        if "document" in update["message"]:
+            latencies.append(time.perf_counter() - start)
+
+
+async def replay(conversation: List[dict], n_chats: int, concurrency: int, data_path: str) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def bounded(chat_index: int):
+        async with semaphore:
+            chat_id = 10_000 + chat_index
+            await run_chat(
+                clone_conversation(conversation, chat_index, chat_id), data_path, latencies
+            )
+
+    await asyncio.gather(*(bounded(i) for i in range(n_chats)))
+    return latencies
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--chats", type=int, default=100)
+    arg_parser.add_argument("--concurrency", type=int, default=20)
+    arg_parser.add_argument("--updates", help="Recorded conversation, one update JSON per line.")
+    arg_parser.add_argument("--ocr-latency", type=float, default=1.0)
+    arg_parser.add_argument("--ocr-jitter", type=float, default=0.2)
+    arg_parser.add_argument("--splitwise-latency", type=float, default=0.2)
+    arg_parser.add_argument("--telegram-latency", type=float, default=0.05)
+    arg_parser.add_argument("--lines", type=int, default=30)
+    args = arg_parser.parse_args()
+    # Synthetic receipts fail the total-amount check; keep the output readable
+    logger.remove()
+
+    conversation = load_conversation(args.updates) if args.updates else default_conversation()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        splitwise = FakeSplitwise(args.splitwise_latency)
+        bot = FakeBot(args.telegram_latency)
+        services.override(
+            bot=bot,
+            api_client=FakeMistral(args.ocr_latency, args.ocr_jitter, args.lines),
+            splitwise=splitwise,
+            current_user=splitwise.getCurrentUser(),
+            groups=GroupDirectory(splitwise),
+            conversation_state=InMemoryStateStore(),
+            idempotency=IdempotencyGuard(
+                SqliteIdempotencyBackend(str(Path(data_path) / "idempotency.sqlite"))
+            ),
+            invoice_cache=None,
+            history=None,
+        )
+        tracing.stats.clear()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        latencies = asyncio.run(
+            replay(conversation, args.chats, args.concurrency, data_path)
+        )
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        services.reset()
+
+    latencies_ms = np.array(latencies) * 1000
+    print(
+        f"chats={args.chats} concurrency={args.concurrency} updates={args.chats * len(conversation)} "
+        f"elapsed={elapsed:.2f}s"
+    )
+    print(
+        f"throughput: {args.chats / elapsed:.1f} receipts/s, "
+        f"{args.chats * len(conversation) / elapsed:.1f} updates/s"
+    )
+    if len(latencies_ms):
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        print(f"receipt latency: p50={p50:.0f}ms p95={p95:.0f}ms p99={p99:.0f}ms")
+    print(f"expenses created={splitwise.created} replies sent={bot.sent}")
+    print(
+        f"peak traced memory={peak / 1024**2:.1f}MiB "
+        f"max rss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MiB"
+    )
+    for name, values in tracing.summary().items():
+        print(
+            f"  {name:<28} n={values['count']:>6} "
+            f"p50={values['p50_ms']:9.1f}ms p95={values['p95_ms']:9.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
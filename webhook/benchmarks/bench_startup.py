@@ -0,0 +1,68 @@
+"""
+Measure how long a cold `import app` takes.
+
+Every run imports `app` in a fresh interpreter with outgoing sockets blocked,
+so any client that still talks to Telegram, Mistral or Splitwise at import
+time makes the run fail instead of silently adding latency.
+
+Usage (from ./webhook):
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+WEBHOOK_DIR = Path(__file__).resolve().parents[1]
+
+IMPORT_SNIPPET = """
+import json, socket, sys, time
+
+def _blocked(*args, **kwargs):
+    raise RuntimeError("Network access during import")
+
+socket.socket.connect = _blocked
+socket.create_connection = _blocked
+
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_s": elapsed, "initialised": app.services.initialised}))
+"""
+
+
+def time_import() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=WEBHOOK_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--runs", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        run = time_import()
+        if run["initialised"]:
+            raise SystemExit(f"Services built during import: {run['initialised']}")
+        timings.append(run["import_s"])
+
+    print(
+        f"import app: runs={len(timings)} "
+        f"min={min(timings) * 1000:.1f}ms "
+        f"median={statistics.median(timings) * 1000:.1f}ms "
+        f"max={max(timings) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
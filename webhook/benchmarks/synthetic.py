@@ -0,0 +1,106 @@
+"""Synthetic Colruyt-like receipts for the benchmarks."""
+import random
+from datetime import date, timedelta
+
+import polars as pl
+
+WORDS = [
+    "boni", "bio", "everyday", "melk", "brood", "kaas", "ham", "yoghurt", "appel",
+    "tomaat", "pasta", "rijst", "chips", "water", "cola", "koffie", "bananen",
+    "espresso", "choco", "confituur", "sla", "wortel", "ui", "look", "zeep",
+]
+
+
+def synthetic_description(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, 4))) + f" {rng.randint(1, 999)}g"
+
+
+def synthetic_items(n_lines: int, seed: int = 0) -> pl.DataFrame:
+    """Cleaned invoice lines: description and adjusted_amount."""
+    rng = random.Random(seed)
+    return pl.DataFrame(
+        {
+            "description": [synthetic_description(rng) for _ in range(n_lines)],
+            "adjusted_amount": [round(rng.uniform(0.5, 20), 2) for _ in range(n_lines)],
+        }
+    )
+
+
+def synthetic_invoice(rng: random.Random, n_lines: int, file_hash: str) -> dict:
+    """One parsed invoice, shaped like an `Invoice` row from parse_invoice."""
+    items = []
+    for _ in range(n_lines):
+        items.append(
+            {
+                "unit_price": round(rng.uniform(0.3, 12), 2),
+                "weight": 0.0,
+                "quantity": float(rng.randint(1, 4)),
+                "discount": 0.0,
+                "description": synthetic_description(rng),
+            }
+        )
+        if rng.random() < 0.1:
+            items.append(
+                {
+                    "unit_price": 0.0,
+                    "weight": 0.0,
+                    "quantity": 0.0,
+                    "discount": float(rng.choice([10, 25, 50])),
+                    "description": "Korting",
+                }
+            )
+        if rng.random() < 0.05:
+            items.append(
+                {
+                    "unit_price": 0.1,
+                    "weight": 0.0,
+                    "quantity": float(rng.randint(1, 6)),
+                    "discount": 0.0,
+                    "description": "Waarborg fles",
+                }
+            )
+    items.append(
+        {
+            "unit_price": 0.0,
+            "weight": 0.0,
+            "quantity": 0.0,
+            "discount": 0.0,
+            "description": "Total amount",
+        }
+    )
+    day = date(2024, 1, 1) + timedelta(days=rng.randint(0, 600))
+    return {
+        "date": day.isoformat(),
+        "page": 1,
+        "total_amount_invoice": round(rng.uniform(10, 200), 2),
+        "items": items,
+        "path": f"data/{file_hash}.pdf",
+        "file_hash": file_hash,
+    }
+
+
+def split_pages(invoice: dict, pages: int) -> list:
+    """An invoice as `pages` page rows, like a multi-page receipt parsed per page."""
+    items = invoice["items"]
+    size = -(-len(items) // pages)
+    return [
+        {**invoice, "page": page + 1, "items": items[page * size:(page + 1) * size]}
+        for page in range(pages)
+        if items[page * size:(page + 1) * size]
+    ]
+
+
+def synthetic_invoices(
+    n_invoices: int, n_lines: int = 30, seed: int = 0, pages: int = 1
+) -> pl.DataFrame:
+    """History of parsed invoices, one row per invoice page."""
+    rng = random.Random(seed)
+    return pl.DataFrame(
+        [
+            page
+            for i in range(n_invoices)
+            for page in split_pages(
+                synthetic_invoice(rng, n_lines, f"{seed:04x}{i:060x}"), pages
+            )
+        ]
+    )
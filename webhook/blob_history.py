@@ -0,0 +1,129 @@
+"""
+Incremental invoice history in blob storage.
+
+New records are appended as NDJSON to one append blob per UTC day,
+`<prefix>log/<YYYY-MM-DD>.ndjson`, so each write uploads only the new rows.
+`compact` rolls every finished day into a Parquet segment,
+`<prefix>segments/date=<YYYY-MM-DD>.parquet`, and removes its log.
+"""
+import argparse
+import io
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+import polars as pl
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import ContainerClient
+from loguru import logger
+
+# Append blobs accept at most 4 MiB per block
+MAX_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def _chunks(data: bytes, max_bytes: int = MAX_BLOCK_BYTES) -> List[bytes]:
+    """Split NDJSON into blocks of at most `max_bytes`, at line boundaries."""
+    chunks, start = [], 0
+    while start < len(data):
+        end = min(start + max_bytes, len(data))
+        if end < len(data):
+            newline = data.rfind(b"\n", start, end)
+            if newline >= start:
+                end = newline + 1
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+class BlobHistoryWriter:
+    def __init__(self, container_client: ContainerClient, prefix: str = "history/"):
+        self.container_client = container_client
+        self.prefix = prefix
+
+    def _log_name(self, day: date) -> str:
+        return f"{self.prefix}log/{day.isoformat()}.ndjson"
+
+    def _segment_name(self, day: str) -> str:
+        return f"{self.prefix}segments/date={day}.parquet"
+
+    def append(self, df: pl.DataFrame, day: Optional[date] = None) -> int:
+        """Append `df` to the day's log; returns the number of bytes uploaded."""
+        if df.is_empty():
+            return 0
+        day = day or datetime.now(timezone.utc).date()
+        buffer = io.BytesIO()
+        df.write_ndjson(buffer)
+        data = buffer.getvalue()
+
+        blob_client = self.container_client.get_blob_client(self._log_name(day))
+        try:
+            blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+        except ResourceExistsError:
+            pass
+        for chunk in _chunks(data):
+            blob_client.append_block(chunk, length=len(chunk))
+        logger.info(f"Appended {df.height} record(s) ({len(data)} bytes) to {blob_client.blob_name}.")
+        return len(data)
+
+    def _logs(self) -> List[str]:
+        return sorted(
+            blob.name
+            for blob in self.container_client.list_blobs(name_starts_with=f"{self.prefix}log/")
+        )
+
+    def compact(self, before: Optional[date] = None) -> List[str]:
+        """
+        Roll the logs of days before `before` (default: today, UTC) into
+        Parquet segments. A log is deleted only after its segment is written,
+        so an interrupted run is simply repeated.
+        """
+        before = before or datetime.now(timezone.utc).date()
+        compacted = []
+        for log_name in self._logs():
+            day = log_name.rsplit("/", 1)[-1].removesuffix(".ndjson")
+            if date.fromisoformat(day) >= before:
+                continue
+            log_client = self.container_client.get_blob_client(log_name)
+            df = pl.read_ndjson(io.BytesIO(log_client.download_blob().readall()))
+
+            buffer = io.BytesIO()
+            df.write_parquet(buffer)
+            buffer.seek(0)
+            segment_name = self._segment_name(day)
+            self.container_client.get_blob_client(segment_name).upload_blob(
+                buffer, overwrite=True
+            )
+            log_client.delete_blob()
+            compacted.append(segment_name)
+            logger.info(f"Compacted {log_name} ({df.height} records) into {segment_name}.")
+        return compacted
+
+    def read(self) -> pl.DataFrame:
+        """The full history: all segments plus the logs not compacted yet."""
+        frames = []
+        for blob in self.container_client.list_blobs(name_starts_with=self.prefix):
+            data = io.BytesIO(
+                self.container_client.get_blob_client(blob.name).download_blob().readall()
+            )
+            if blob.name.endswith(".parquet"):
+                frames.append(pl.read_parquet(data))
+            elif blob.name.endswith(".ndjson"):
+                frames.append(pl.read_ndjson(data))
+        if not frames:
+            return pl.DataFrame()
+        return pl.concat(frames, how="diagonal_relaxed")
+
+
+def main():
+    from blob_utils import get_container_client
+
+    arg_parser = argparse.ArgumentParser(description="Compact the invoice history logs.")
+    arg_parser.add_argument("--container", default="function")
+    arg_parser.add_argument("--prefix", default="history/")
+    args = arg_parser.parse_args()
+    writer = BlobHistoryWriter(get_container_client(args.container), prefix=args.prefix)
+    writer.compact()
+
+
+if __name__ == "__main__":
+    main()
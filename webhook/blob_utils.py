@@ -1,57 +1,139 @@
-import os
 import asyncio
+import io
+import os
+import threading
+import weakref
+from functools import lru_cache
+from typing import Literal
+
 import polars as pl
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient, ContainerClient
 from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient, ContainerClient as AsyncContainerClient
 from loguru import logger
 
-async def get_async_container_client(name: str) -> AsyncContainerClient:
-    """Get an async container client for Azure Blob Storage with timeout."""
+from resilience import blob_client_options
+
+DEFAULT_CONTAINER = "function"
+BlobFormat = Literal["ndjson", "parquet"]
+
+_container_lock = threading.Lock()
+# Async clients hold an aiohttp session bound to the event loop that made
+# them, so they are cached per loop: loop -> client, loop -> {name: container}
+_async_clients = weakref.WeakKeyDictionary()
+_async_containers = weakref.WeakKeyDictionary()
+
+
+def _connection_string() -> str:
     connect_str = os.getenv("AzureWebJobsStorage")
     if not connect_str:
         logger.error("AzureWebJobsStorage is not set.")
         raise ValueError("AzureWebJobsStorage environment variable is not set")
-    
+    return connect_str
+
+
+@lru_cache(maxsize=None)
+def _blob_service_client(connect_str: str) -> BlobServiceClient:
+    logger.info("Initialising blob service client.")
+    return BlobServiceClient.from_connection_string(connect_str, **blob_client_options())
+
+
+def get_blob_service_client() -> BlobServiceClient:
+    """Process-wide blob service client, sharing one connection pool."""
+    return _blob_service_client(_connection_string())
+
+
+@lru_cache(maxsize=None)
+def _container_client(connect_str: str, name: str) -> ContainerClient:
+    container_client = _blob_service_client(connect_str).get_container_client(name)
     try:
+        container_client.create_container()
+        logger.info(f"Created container {name}.")
+    except ResourceExistsError:
+        pass
+    return container_client
+
+
+def get_container_client(name: str = DEFAULT_CONTAINER) -> ContainerClient:
+    """Container client for `name`, created (if needed) once per process."""
+    connect_str = _connection_string()
+    with _container_lock:
+        return _container_client(connect_str, name)
+
+
+async def get_async_container_client(name: str = DEFAULT_CONTAINER) -> AsyncContainerClient:
+    """Async container client for `name`, created (if needed) once per event loop."""
+    loop = asyncio.get_running_loop()
+    containers = _async_containers.setdefault(loop, {})
+    if name in containers:
+        return containers[name]
+
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncBlobServiceClient.from_connection_string(
+            conn_str=_connection_string(), **blob_client_options(asynchronous=True)
+        )
+    container_client = _async_clients[loop].get_container_client(name)
+    try:
+        await container_client.create_container()
+        logger.info(f"Created container {name}.")
+    except ResourceExistsError:
+        pass
+    containers[name] = container_client
+    return container_client
+
+
+def df_to_buffer(df: pl.DataFrame, format: BlobFormat = "ndjson") -> io.BytesIO:
+    """Serialise `df` straight from polars into an in-memory buffer."""
+    buffer = io.BytesIO()
+    if format == "parquet":
+        df.write_parquet(buffer)
+    elif format == "ndjson":
+        df.write_ndjson(buffer)
+    else:
+        raise ValueError(f"Unsupported blob format: {format}")
+    buffer.seek(0)
+    return buffer
+
+
+def upload_df(
+    df: pl.DataFrame,
+    blob_name: str,
+    format: BlobFormat = "ndjson",
+    container: str = DEFAULT_CONTAINER,
+) -> None:
+    """Upload `df` as NDJSON or Parquet, overwriting `blob_name`."""
+    buffer = df_to_buffer(df, format)
+    get_container_client(container).get_blob_client(blob_name).upload_blob(
+        buffer, overwrite=True
+    )
+    logger.info(f"Uploaded {format} to Azure container '{container}' as {blob_name}.")
+
+
+async def async_upload_df(
+    df: pl.DataFrame,
+    blob_name: str,
+    format: BlobFormat = "ndjson",
+    container: str = DEFAULT_CONTAINER,
+    timeout: float = 10.0,
+) -> None:
+    """Async `upload_df`, giving up after `timeout` seconds."""
+    buffer = df_to_buffer(df, format)
+    container_client = await get_async_container_client(container)
+    try:
+        await asyncio.wait_for(
+            container_client.get_blob_client(blob_name).upload_blob(buffer, overwrite=True),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout uploading {format} to {blob_name}")
+        raise TimeoutError(f"Blob upload operation timed out after {timeout} seconds")
+    logger.info(f"Uploaded {format} to Azure container '{container}' as {blob_name}.")
 
-        blob_service_client = AsyncBlobServiceClient.from_connection_string(conn_str=connect_str)
-        container_client = blob_service_client.get_container_client(name)
-        
-        try:
-            if not await container_client.exists():
-                await container_client.create_container()
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout creating container {name}, assuming it exists")
-        except Exception as e:
-            logger.warning(f"Container creation error (may already exist): {str(e)}")
-        
-        return container_client
-    except Exception as e:
-        logger.error(f"Error getting container client: {str(e)}")
-        raise
 
 async def async_azure_upload_ndjson(df: pl.DataFrame, file_name: str, timeout: float = 10.0):
     """Upload a Polars DataFrame to Azure Blob Storage as NDJSON format, using async operations with timeout."""
     try:
-        # Get container client with timeout
-        container_client = await get_async_container_client("function")
-        
-        # Convert to NDJSON format
-        ndjson_content = df.to_pandas().to_json(orient="records", lines=True)
-        
-        # Get blob client and upload with timeout
-        blob_client = container_client.get_blob_client(file_name)
-        
-        # Use asyncio.wait_for to prevent hanging
-        try:
-            await asyncio.wait_for(
-                blob_client.upload_blob(ndjson_content, overwrite=True),
-                timeout=timeout
-            )
-            logger.info(f"Uploaded NDJSON to Azure container 'function' as {file_name}.")
-        except asyncio.TimeoutError:
-            logger.error(f"Timeout uploading NDJSON to {file_name}")
-            raise TimeoutError(f"Blob upload operation timed out after {timeout} seconds")
-            
+        await async_upload_df(df, file_name, "ndjson", timeout=timeout)
     except Exception as e:
         logger.error(f"Error uploading NDJSON: {str(e)}")
         raise
@@ -0,0 +1,110 @@
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import polars as pl
+from loguru import logger
+
+from utils import longest_common_substrings, normalize_col
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "categories.json"
+
+
+@dataclass
+class CategoryRule:
+    name: str
+    label: str
+    terms: List[str] = field(default_factory=list)
+    # Whether items in this category are registered in Splitwise
+    register: bool = True
+    friend_names: Optional[List[str]] = None
+    maartens_owe_percentage: Optional[float] = None
+
+
+class CategoryIndex:
+    """
+    Assigns every invoice line to its best matching category in one pass.
+
+    All category terms are normalised once when the index is built. A line
+    goes to the category of its most similar term (ties go to the category
+    listed first) if that similarity reaches `threshold`, otherwise to the
+    default category.
+    """
+
+    def __init__(
+        self, categories: List[CategoryRule], default: CategoryRule, threshold: float = 0.8
+    ):
+        self.categories = categories
+        self.default = default
+        self.threshold = threshold
+
+        terms = [t for c in categories for t in c.terms]
+        self.term_categories = np.array(
+            [c.name for c in categories for _ in c.terms], dtype=object
+        )
+        terms_df = pl.DataFrame({"term": terms}, schema={"term": pl.Utf8}).with_columns(
+            normalize_col("term"), pl.col("term").str.len_chars().alias("term_len")
+        )
+        self.normalized_terms = terms_df["term_normalized"].to_list()
+        self.term_lengths = terms_df["term_len"].to_numpy()
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH) -> "CategoryIndex":
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        categories = [CategoryRule(**c) for c in config["categories"]]
+        index = cls(
+            categories,
+            CategoryRule(**config["default"]),
+            threshold=config.get("threshold", 0.8),
+        )
+        logger.info(f"Loaded {len(categories)} categories from {path}")
+        return index
+
+    @property
+    def rules(self) -> List[CategoryRule]:
+        """All categories, including the default one last."""
+        return self.categories + [self.default]
+
+    def classify(self, items_df: pl.DataFrame, col_name: str = "description") -> pl.DataFrame:
+        """Add `category` and `similarity_ratio` columns to `items_df`."""
+        assert col_name in items_df.columns, f"The DataFrame should have a {col_name} column"
+        if items_df.is_empty() or not self.normalized_terms:
+            return items_df.with_columns(
+                pl.lit(self.default.name).alias("category"),
+                pl.lit(0.0).alias("similarity_ratio"),
+            )
+
+        normalized = items_df.select(normalize_col(col_name)).to_series().fill_null("")
+        unique = normalized.unique().to_list()
+        lengths, _ = longest_common_substrings(unique, self.normalized_terms)
+        position = {s: i for i, s in enumerate(unique)}
+        row_lengths = lengths[[position[s] for s in normalized.to_list()]]
+
+        # Same ratio as utils.similarity_ratio: lcs / shortest raw string
+        raw_lengths = items_df[col_name].str.len_chars().fill_null(0).to_numpy()
+        ratio = row_lengths / np.maximum(
+            np.minimum(raw_lengths[:, None], self.term_lengths[None, :]), 1
+        )
+        best_term = ratio.argmax(axis=1)
+        best_ratio = ratio[np.arange(len(ratio)), best_term]
+        category = np.where(
+            best_ratio >= self.threshold, self.term_categories[best_term], self.default.name
+        )
+        return items_df.with_columns(
+            pl.Series("category", category, dtype=pl.Utf8),
+            pl.Series("similarity_ratio", best_ratio, dtype=pl.Float64),
+        )
+
+
+@lru_cache(maxsize=4)
+def _load_category_index(path: str, mtime: float) -> CategoryIndex:
+    return CategoryIndex.from_file(path)
+
+
+def get_category_index(path: str = DEFAULT_RULES_PATH) -> CategoryIndex:
+    """Category index for `path`, rebuilt only when the file changes."""
+    return _load_category_index(str(path), Path(path).stat().st_mtime)
@@ -0,0 +1,162 @@
+"""
+Deterministic parser for the OCR markdown of a standard Colruyt receipt.
+
+Mistral OCR renders the receipt's article lines as a markdown table, e.g.
+
+    | Hoev. | Omschrijving      | Eenh.prijs | Bedrag |
+    | ----- | ----------------- | ---------- | ------ |
+    | 2     | BONI MELK 1L      | 1,05       | 2,10   |
+    | 25%   | Korting           |            | -0,53  |
+    | 0,512 kg | BANANEN        | 1,99       | 1,02   |
+
+followed by a "Te betalen" (or "Totaal") line. `parse_colruyt_markdown`
+turns that into the same `Invoice` the LLM would return, and returns None as
+soon as anything does not add up, so the caller can fall back to the LLM.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from models import Invoice, Item
+
+# Header keywords identifying each column, checked in order
+COLUMNS = {
+    "unit_price": ("eenh", "prijs", "unit"),
+    "quantity": ("hoev", "aantal", "qty"),
+    "description": ("omschrijving", "artikel", "description"),
+    "amount": ("bedrag", "totaal", "amount"),
+}
+TOTAL_PATTERN = re.compile(
+    r"(?:te betalen|totaal|total)[^0-9\-]*(-?\d+(?:[.,]\d{1,2}))", re.IGNORECASE
+)
+TOTAL_LINE = re.compile(r"^(?:sub)?(?:te betalen|totaal|total)\b", re.IGNORECASE)
+DATE_PATTERN = re.compile(r"\b(\d{2})[/.-](\d{2})[/.-](\d{4})\b")
+NUMBER_PATTERN = re.compile(r"-?\d+(?:[.,]\d+)?")
+# Allowed difference (eur) between a line's amount and quantity * unit price
+TOLERANCE = 0.011
+
+
+def _number(cell: str) -> Optional[float]:
+    match = NUMBER_PATTERN.search(cell.replace(" ", ""))
+    if match is None:
+        return None
+    return float(match.group().replace(",", "."))
+
+
+def _cells(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _header_columns(cells: List[str]) -> Optional[Dict[str, int]]:
+    columns = {}
+    for index, cell in enumerate(cells):
+        cell = cell.lower()
+        for name, keywords in COLUMNS.items():
+            if name not in columns and any(k in cell for k in keywords):
+                columns[name] = index
+                break
+    if {"description", "quantity", "amount"} <= columns.keys():
+        return columns
+    return None
+
+
+def _table_rows(markdown: str) -> Optional[List[Dict[str, str]]]:
+    """Rows of every article table in `markdown`, keyed by column name."""
+    rows, columns = [], None
+    for line in markdown.splitlines():
+        if not line.strip().startswith("|"):
+            columns = None
+            continue
+        cells = _cells(line)
+        if all(set(cell) <= set("-: ") for cell in cells):
+            continue
+        if columns is None:
+            columns = _header_columns(cells)
+            continue
+        rows.append(
+            {name: cells[i] if i < len(cells) else "" for name, i in columns.items()}
+        )
+    return rows or None
+
+
+def _item(row: Dict[str, str], previous: Optional[Item]) -> Optional[Tuple[Item, float]]:
+    """The row as an `Item`, with the amount it adds to the receipt total."""
+    description = row["description"]
+    quantity_cell = row["quantity"].lower()
+    amount = _number(row["amount"])
+    if not description:
+        return None
+
+    if description.lower().startswith("korting"):
+        if previous is None:
+            return None
+        previous_amount = previous.quantity * previous.unit_price
+        # Discount lines carry a percentage, the discounted amount, or both
+        if "%" in quantity_cell:
+            discount = _number(quantity_cell)
+            if amount is None:
+                amount = -round(previous_amount * discount / 100, 2)
+        elif amount is not None and previous_amount:
+            discount = round(abs(amount) / previous_amount * 100, 2)
+        else:
+            return None
+        item = Item(
+            unit_price=0.0, weight=0.0, quantity=0.0, discount=discount, description=description
+        )
+        return item, -abs(amount)
+
+    quantity = _number(quantity_cell)
+    unit_price = _number(row.get("unit_price", ""))
+    if quantity is None or amount is None:
+        return None
+    if unit_price is None:
+        unit_price = round(amount / quantity, 2) if quantity else amount
+    if abs(quantity * unit_price - amount) > TOLERANCE:
+        return None
+    weight = quantity if "kg" in quantity_cell else 0.0
+    item = Item(
+        unit_price=unit_price, weight=weight, quantity=quantity, discount=0.0, description=description
+    )
+    return item, amount
+
+
+def parse_colruyt_markdown(pages: List[str], page: int = 1) -> Optional[Invoice]:
+    """
+    Parse the OCR markdown of a Colruyt receipt (one string per page).
+
+    Returns None unless every article line parses, the date and the total are
+    found and the line amounts add up to the total.
+    """
+    markdown = "\n\n".join(pages)
+    rows = _table_rows(markdown)
+    total_match = TOTAL_PATTERN.findall(markdown)
+    date_match = DATE_PATTERN.search(markdown)
+    if rows is None or not total_match or date_match is None:
+        return None
+
+    items: List[Item] = []
+    items_total = 0.0
+    for row in rows:
+        # The total may land in any column, e.g. from a PDF text layer
+        if any(TOTAL_LINE.match(cell) for cell in row.values()):
+            continue
+        parsed = _item(row, items[-1] if items else None)
+        if parsed is None:
+            return None
+        items.append(parsed[0])
+        items_total += parsed[1]
+
+    # The last total on the receipt is the amount paid
+    total_amount = float(total_match[-1].replace(",", "."))
+    if not items or abs(items_total - total_amount) > 0.01:
+        return None
+
+    day, month, year = date_match.groups()
+    items.append(
+        Item(unit_price=0.0, weight=0.0, quantity=0.0, discount=0.0, description="Total amount")
+    )
+    return Invoice(
+        date=f"{year}-{month}-{day}",
+        page=page,
+        total_amount_invoice=total_amount,
+        items=items,
+    )
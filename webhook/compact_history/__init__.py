@@ -0,0 +1,10 @@
+import azure.functions as func
+
+from services import services
+
+
+def main(timer: func.TimerRequest) -> None:
+    """Nightly: roll the previous days' invoice history logs into Parquet segments."""
+    if services.history is None:
+        return
+    services.history.compact()
@@ -0,0 +1,129 @@
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from splitwise import Splitwise
+from splitwise.expense import Expense
+
+from resilience import call_with_retries, is_rate_limited
+from tracing import span
+
+
+@dataclass
+class ExpenseResult:
+    """Outcome of submitting a single expense to Splitwise."""
+
+    description: str
+    cost: float
+    expense_id: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def collapse_items(items: List[Dict], description: str) -> List[Dict]:
+    """
+    Collapse a category's items into a single item dict.
+
+    The item descriptions and amounts are kept in the `details` field, so the
+    Splitwise expense stays itemised while costing one API call.
+    """
+    if not items:
+        return []
+    details = "\n".join(
+        f"{item['description']}: {item['adjusted_amount']:.2f}" for item in items
+    )
+    return [
+        {
+            "description": description,
+            "adjusted_amount": round(sum(i["adjusted_amount"] for i in items), 2),
+            "date": items[0].get("date", None),
+            "details": details,
+        }
+    ]
+
+
+def _copy_expense(expense: Expense) -> Expense:
+    """
+    Shallow copy of an expense.
+
+    createExpense deletes fields from the expense it is given, so every
+    attempt gets its own copy. (Expense's __getattr__ breaks copy.copy.)
+    """
+    clone = Expense()
+    clone.__dict__.update(expense.__dict__)
+    return clone
+
+
+def submit_expense(
+    splitwise: Splitwise,
+    expense: Expense,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> ExpenseResult:
+    """
+    Create one expense, backing off and retrying when Splitwise rate-limits.
+
+    Other errors are not retried: the expense may have been created anyway.
+    """
+    result = ExpenseResult(
+        description=expense.getDescription(), cost=expense.getCost()
+    )
+    attempts = itertools.count()
+
+    def create(_timeout):
+        with span("splitwise.create_expense", attempt=next(attempts)):
+            return splitwise.createExpense(_copy_expense(expense))
+
+    try:
+        created, errors = call_with_retries(
+            create,
+            retries=max_retries,
+            backoff=backoff,
+            sleep=sleep,
+            retry_on=is_rate_limited,
+        )
+    except Exception as e:
+        result.error = str(e)
+        return result
+    if errors:
+        result.error = str(errors.getErrors())
+    else:
+        result.expense_id = created.getId()
+    return result
+
+
+def submit_expenses(
+    splitwise: Splitwise,
+    expenses: List[Expense],
+    max_workers: int = 4,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+) -> List[ExpenseResult]:
+    """
+    Submit expenses through a bounded thread pool.
+
+    Returns one ExpenseResult per expense, in the order they were given.
+    """
+    if not expenses:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(expenses))) as pool:
+        results = list(
+            pool.map(
+                lambda e: submit_expense(
+                    splitwise, e, max_retries=max_retries, backoff=backoff
+                ),
+                expenses,
+            )
+        )
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        logger.error(f"Failed to register '{r.description}': {r.error}")
+    logger.info(f"Registered {len(results) - len(failed)}/{len(results)} expenses.")
+    return results
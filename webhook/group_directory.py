@@ -0,0 +1,54 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from splitwise import Splitwise
+from splitwise.group import Group
+
+
+class GroupDirectory:
+    """
+    Caches Splitwise groups (and their members) by group name.
+
+    A single `getGroups()` call fills the directory; lookups are served from
+    memory until the entries are older than `ttl` seconds. Call `refresh()`
+    after changing group membership to drop the cached entries.
+    """
+
+    def __init__(
+        self,
+        splitwise: Splitwise,
+        ttl: float = 600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.splitwise = splitwise
+        self.ttl = ttl
+        self.clock = clock
+        self._groups: Dict[str, Group] = {}
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self, group_name: str) -> Optional[Group]:
+        with self._lock:
+            if self._is_stale():
+                self._load()
+            return self._groups.get(group_name)
+
+    def members(self, group_name: str) -> List:
+        group = self.get(group_name)
+        return group.getMembers() if group else []
+
+    def refresh(self) -> None:
+        """Forget the cached groups so the next lookup fetches them again."""
+        with self._lock:
+            self._fetched_at = None
+
+    def _is_stale(self) -> bool:
+        return self._fetched_at is None or self.clock() - self._fetched_at > self.ttl
+
+    def _load(self) -> None:
+        groups = self.splitwise.getGroups()
+        self._groups = {g.getName(): g for g in groups}
+        self._fetched_at = self.clock()
+        logger.info(f"Loaded {len(self._groups)} Splitwise groups.")
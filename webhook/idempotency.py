@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+class SqliteIdempotencyBackend:
+    """Persistent record of processed keys, shared by processes on one machine."""
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_keys (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS seen_keys_expiry ON seen_keys (expires_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def add_if_absent(self, key: str, ttl: Optional[float] = None) -> bool:
+        """Record `key` for `ttl` seconds; returns False if it was already recorded."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM seen_keys WHERE expires_at < ?", (now,))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO seen_keys (key, expires_at) VALUES (?, ?)",
+                (key, now + (self.ttl if ttl is None else ttl)),
+            )
+            return cursor.rowcount == 1
+
+    def contains(self, key: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM seen_keys WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+        return row is not None
+
+    def remove(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM seen_keys WHERE key = ?", (key,))
+
+
+class IdempotencyGuard:
+    """
+    Tells whether a key (e.g. a Telegram update_id) has been processed before.
+
+    Recently seen keys are answered from a bounded in-memory LRU; the optional
+    backend makes the record survive restarts and be shared between workers.
+    Keys expire after `ttl` seconds, or after the shorter ttl they were
+    recorded with (e.g. a claim on work in progress).
+    """
+
+    def __init__(
+        self,
+        backend: Optional[SqliteIdempotencyBackend] = None,
+        max_entries: int = 10_000,
+        ttl: float = 7 * 24 * 3600,
+    ):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = backend.ttl if backend else ttl
+        # key -> expiry time
+        self._seen: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _seen_locally(self, key: str) -> bool:
+        expires_at = self._seen.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.time():
+            del self._seen[key]
+            return False
+        self._seen.move_to_end(key)
+        return True
+
+    def first_seen(self, key: str, ttl: Optional[float] = None) -> bool:
+        """
+        Record `key` for `ttl` seconds (default: the guard's) and return True,
+        or return False if it was seen before.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if self._seen_locally(key):
+                return False
+        is_new = self.backend.add_if_absent(key, ttl) if self.backend else True
+        if is_new:
+            # Only keys recorded here: the expiry of another process's is unknown
+            with self._lock:
+                self._seen[key] = time.time() + ttl
+                self._seen.move_to_end(key)
+                if len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+        return is_new
+
+    def seen(self, key: str) -> bool:
+        """Whether `key` has been recorded, without recording it."""
+        with self._lock:
+            if self._seen_locally(key):
+                return True
+        return self.backend.contains(key) if self.backend else False
+
+    def forget(self, key: str) -> None:
+        """Allow `key` to be processed again, e.g. after processing failed."""
+        with self._lock:
+            self._seen.pop(key, None)
+        if self.backend:
+            self.backend.remove(key)
+
+    @staticmethod
+    def update_key(update_id: int) -> str:
+        return f"update:{update_id}"
+
+    @staticmethod
+    def file_key(chat_id: int, file_hash: str) -> str:
+        """Claims a receipt while it is being processed."""
+        return f"file:{chat_id}:{file_hash}"
+
+    @staticmethod
+    def submit_key(chat_id: int, file_hash: str) -> str:
+        """Marks a receipt whose expenses were handed to Splitwise."""
+        return f"submit:{chat_id}:{file_hash}"
@@ -0,0 +1,106 @@
+"""
+Preprocessing for photographed receipts.
+
+Phone photos are several megapixels of colour for what is a narrow strip of
+black-on-white text. `image_to_pdf` converts a photo to grayscale, scales it
+down to `TARGET_DPI` for a receipt filling the frame, straightens small
+rotations and wraps the result, as a compressed JPEG, in a one-page PDF, so
+it follows the same ingest, cache and OCR path as a PDF receipt.
+
+The limits are read from the environment: IMAGE_TARGET_DPI (300),
+IMAGE_RECEIPT_WIDTH_MM (80), IMAGE_JPEG_QUALITY (75), IMAGE_DESKEW (true)
+and IMAGE_MAX_SKEW_DEGREES (10).
+"""
+import os
+
+import numpy as np
+import pymupdf
+from loguru import logger
+
+IMAGE_MIME_TYPES = ("image/jpeg", "image/png")
+TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", 300))
+# Width of a Colruyt till roll
+RECEIPT_WIDTH_INCHES = float(os.getenv("IMAGE_RECEIPT_WIDTH_MM", 80)) / 25.4
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 75))
+DESKEW = os.getenv("IMAGE_DESKEW", "true").lower() in ("1", "true")
+# Largest rotation (degrees) looked for when straightening
+MAX_SKEW_DEGREES = float(os.getenv("IMAGE_MAX_SKEW_DEGREES", 10))
+SKEW_STEP_DEGREES = 0.5
+# Width the skew is estimated at
+SKEW_SAMPLE_WIDTH = 400
+
+
+def _gray(pix: pymupdf.Pixmap) -> pymupdf.Pixmap:
+    if pix.alpha:
+        pix = pymupdf.Pixmap(pix, 0)
+    if pix.n != 1:
+        pix = pymupdf.Pixmap(pymupdf.csGRAY, pix)
+    return pix
+
+
+def _downscale(pix: pymupdf.Pixmap, max_width: int) -> pymupdf.Pixmap:
+    if pix.width <= max_width:
+        return pix
+    return pymupdf.Pixmap(pix, max_width, round(pix.height * max_width / pix.width))
+
+
+def skew_angle(pix: pymupdf.Pixmap) -> float:
+    """
+    Angle (degrees) of the text lines in a grayscale pixmap; positive when
+    they run downhill to the right.
+
+    Projection profile method: the shear that lines the dark pixels up into
+    the sharpest row histogram is the skew.
+    """
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    step = max(1, pix.width // SKEW_SAMPLE_WIDTH)
+    sample = gray[::step, ::step].astype(np.int16)
+    # Ink is anything well below the paper colour
+    threshold = (int(sample.min()) + int(np.median(sample))) / 2
+    ys, xs = np.nonzero(sample < threshold)
+    if len(ys) < 100:
+        return 0.0
+
+    def sharpness(angle: float) -> float:
+        rows = ys - xs * np.tan(np.radians(angle))
+        histogram = np.bincount(np.round(rows - rows.min()).astype(np.int64))
+        return float(np.sum(np.diff(histogram.astype(np.float64)) ** 2))
+
+    angles = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES, SKEW_STEP_DEGREES)
+    return float(max(angles, key=sharpness))
+
+
+def image_to_pdf(
+    content: bytes,
+    dpi: int = TARGET_DPI,
+    quality: int = JPEG_QUALITY,
+    deskew: bool = DESKEW,
+) -> bytes:
+    """A photo (JPEG/PNG bytes) as a small, straightened grayscale PDF."""
+    pix = _downscale(_gray(pymupdf.Pixmap(content)), round(RECEIPT_WIDTH_INCHES * dpi))
+    angle = skew_angle(pix) if deskew else 0.0
+    jpeg = pix.tobytes("jpeg", jpg_quality=quality)
+
+    # Page size in points, so the image renders at `dpi`
+    width, height = pix.width * 72 / dpi, pix.height * 72 / dpi
+    image_doc = pymupdf.open()
+    image_page = image_doc.new_page(width=width, height=height)
+    image_page.insert_image(image_page.rect, stream=jpeg)
+    if not angle:
+        pdf = image_doc.tobytes(garbage=3, deflate=True)
+    else:
+        # Rotate the image page back into a page fitting its bounding box
+        radians = np.radians(abs(angle))
+        doc = pymupdf.open()
+        page = doc.new_page(
+            width=width * np.cos(radians) + height * np.sin(radians),
+            height=width * np.sin(radians) + height * np.cos(radians),
+        )
+        page.show_pdf_page(page.rect, image_doc, 0, rotate=angle)
+        pdf = doc.tobytes(garbage=3, deflate=True)
+
+    logger.info(
+        f"Prepared photo: {len(content)} -> {len(pdf)} bytes, "
+        f"{pix.width}x{pix.height}px, deskewed {angle:.1f} degrees."
+    )
+    return pdf
@@ -0,0 +1,43 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+
+@dataclass
+class IngestedFile:
+    """A receipt read into memory once, with its hash and content-addressed copy."""
+
+    path: Path
+    file_hash: str
+    content: bytes
+
+
+def ingest_bytes(content: bytes, data_path: str, suffix: str = ".pdf") -> IngestedFile:
+    """
+    Hash `content` and store it as `<data_path>/invoices/<hash><suffix>`.
+
+    The copy is only written if it does not exist yet, and is written to a
+    temporary file first so concurrent ingests of the same receipt never see
+    a partial file.
+    """
+    file_hash = hashlib.sha256(content).hexdigest()
+    invoices_dir = Path(data_path) / "invoices"
+    invoices_dir.mkdir(parents=True, exist_ok=True)
+    path = invoices_dir / f"{file_hash}{suffix}"
+    if not path.exists():
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+        logger.info(f"Stored invoice file as {path}.")
+    return IngestedFile(path=path, file_hash=file_hash, content=content)
+
+
+def ingest_file(file_path: str, data_path: str) -> IngestedFile:
+    """Read `file_path` once and ingest it with `ingest_bytes`."""
+    file_path = Path(file_path)
+    with open(file_path, "rb") as f:
+        content = f.read()
+    return ingest_bytes(content, data_path, suffix=file_path.suffix.lower())
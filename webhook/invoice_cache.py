@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Optional, Union
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+from loguru import logger
+
+from models import Invoice
+
+ParseResult = Union[Invoice, List[Invoice]]
+# Eviction frees room down to this share of max_bytes, so the next few
+# writes do not each trigger another pass
+LOW_WATER_MARK = 0.8
+
+
+class InvoiceCache(ABC):
+    """
+    Content-addressed cache of parsed invoices.
+
+    Entries are keyed by the file's SHA-256 plus the OCR and parse model names,
+    so switching models never serves a stale result.
+
+    The cache keeps a running total of the bytes it holds, counted once by the
+    first eviction pass and then by every write, so it only walks its entries
+    to evict once that total grows past `max_bytes`. Eviction then drops the
+    oldest entries down to `LOW_WATER_MARK` of the budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        self._size_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(file_hash: str, ocr_model: str, parse_model: str) -> str:
+        models = hashlib.sha256(f"{ocr_model}|{parse_model}".encode()).hexdigest()
+        return f"{file_hash}-{models[:12]}"
+
+    def get(self, key: str) -> Optional[ParseResult]:
+        raw = self._read(key)
+        if raw is None:
+            return None
+        try:
+            return self._loads(raw)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            return None
+
+    def set(self, key: str, result: ParseResult) -> None:
+        data = self._dumps(result)
+        self._write(key, data)
+        with self._size_lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_bytes:
+                self._size = self.evict()
+
+    @abstractmethod
+    def evict(self) -> int:
+        """Drop the oldest entries once the cache exceeds `max_bytes`; returns the bytes left."""
+
+    @abstractmethod
+    def _read(self, key: str) -> Optional[bytes]:
+        """The raw entry, or None if absent."""
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes) -> None:
+        """Store the raw entry, replacing any previous one."""
+
+    @staticmethod
+    def _dumps(result: ParseResult) -> bytes:
+        single = isinstance(result, Invoice)
+        invoices = [result] if single else result
+        return json.dumps(
+            {"single": single, "invoices": [inv.model_dump() for inv in invoices]}
+        ).encode()
+
+    @staticmethod
+    def _loads(data: bytes) -> ParseResult:
+        payload = json.loads(data)
+        invoices = [Invoice.model_validate(inv) for inv in payload["invoices"]]
+        return invoices[0] if payload["single"] else invoices
+
+
+class LocalInvoiceCache(InvoiceCache):
+    """
+    Cache on the local file system, one JSON file per entry.
+
+    Reads refresh a file's mtime, so eviction drops the least recently used
+    entries once the directory grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024**2):
+        super().__init__(max_bytes)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    def evict(self) -> int:
+        entries = [(p, p.stat()) for p in self.directory.glob("*.json")]
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_bytes:
+            return total
+        for path, stat in sorted(entries, key=lambda e: e[1].st_mtime):
+            if total <= self.max_bytes * LOW_WATER_MARK:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+            logger.info(f"Evicted invoice cache entry {path.name}")
+        return total
+
+
+class BlobInvoiceCache(InvoiceCache):
+    """
+    Cache in Azure Blob Storage under `prefix`.
+
+    Eviction drops the oldest blobs (by last modification) once the prefix
+    grows past `max_bytes`. The prefix is listed on the first write and then
+    only when the running total crosses `max_bytes`; writes by other
+    instances are picked up at that listing.
+    """
+
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        prefix: str = "invoice_cache/",
+        max_bytes: int = 500 * 1024**2,
+    ):
+        super().__init__(max_bytes)
+        self.container_client = container_client
+        self.prefix = prefix
+
+    def _blob_name(self, key: str) -> str:
+        return f"{self.prefix}{key}.json"
+
+    def _read(self, key: str) -> Optional[bytes]:
+        blob_client = self.container_client.get_blob_client(self._blob_name(key))
+        # One request: a miss is the download's 404, not a separate exists() call
+        try:
+            return blob_client.download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def _write(self, key: str, data: bytes) -> None:
+        blob_client = self.container_client.get_blob_client(self._blob_name(key))
+        blob_client.upload_blob(data, overwrite=True)
+
+    def evict(self) -> int:
+        blobs = list(self.container_client.list_blobs(name_starts_with=self.prefix))
+        total = sum(blob.size for blob in blobs)
+        if total <= self.max_bytes:
+            return total
+        for blob in sorted(blobs, key=lambda b: b.last_modified):
+            if total <= self.max_bytes * LOW_WATER_MARK:
+                break
+            self.container_client.delete_blob(blob.name)
+            total -= blob.size
+            logger.info(f"Evicted invoice cache blob {blob.name}")
+        return total
@@ -1,62 +1,161 @@
-import os
+import asyncio
 import time
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 import polars as pl
-from azure.storage.blob import BlobServiceClient, ContainerClient
 from loguru import logger
 from tqdm import tqdm
 
 from api_client import MistralAIClient
+from blob_history import BlobHistoryWriter
+from blob_utils import get_container_client, upload_df
+from ingest import ingest_file
+from invoice_cache import InvoiceCache
 from models import Invoice
+from pdf_text import parse_text_layer
+from tracing import span
 
 
 class InvoiceParser:
-    def __init__(self, api_client: MistralAIClient = None, output_path: str = "data"):
+    def __init__(
+        self,
+        api_client: MistralAIClient = None,
+        output_path: str = "data",
+        use_async: bool = True,
+        cache: InvoiceCache = None,
+        text_layer: bool = True,
+    ):
         self.api_client = api_client
         self.output_path = output_path
+        # Use the SDK's async calls in parse_invoice_async, otherwise run the
+        # sync client in a worker thread
+        self.use_async = use_async
+        self.cache = cache
+        # Parse digital PDFs from their embedded text before calling OCR
+        self.text_layer = text_layer
 
-    def parse_invoice(self, invoice_path: str) -> Union[Invoice, List[Invoice]]:
+    def _cache_key(self, file_hash: str) -> str:
+        if self.cache is None or file_hash is None:
+            return None
+        return self.cache.make_key(
+            file_hash, self.api_client.ocr_model, self.api_client.parse_model
+        )
+
+    def _cached(self, cache_key: str) -> Union[Invoice, List[Invoice], None]:
+        if cache_key is None:
+            return None
+        try:
+            result = self.cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"Invoice cache lookup failed: {e}")
+            return None
+        if result is not None:
+            logger.info(f"Invoice cache hit for {cache_key}.")
+        return result
+
+    def _store(self, cache_key: str, result: Union[Invoice, List[Invoice]]) -> None:
+        if cache_key is None or result is None:
+            return
+        try:
+            self.cache.set(cache_key, result)
+        except Exception as e:
+            logger.warning(f"Invoice cache write failed: {e}")
+
+    def _parse_text_layer(self, invoice_path: str, content: bytes = None) -> Union[Invoice, None]:
+        """The invoice read from the PDF's own text, or None to use OCR."""
+        if not self.text_layer:
+            return None
+        if content is None:
+            content = Path(invoice_path).read_bytes()
+        with span("pdf.text_layer") as attributes:
+            invoice = parse_text_layer(content)
+            attributes["parsed"] = invoice is not None
+        if invoice is not None:
+            logger.info(f"Parsed {invoice_path} from its text layer, skipping OCR.")
+        return invoice
+
+    def parse_invoice(
+        self, invoice_path: str, file_hash: str = None, content: bytes = None
+    ) -> Union[Invoice, List[Invoice]]:
         """
         Parses the invoice PDF and extracts relevant information.
-        Uses direct PDF OCR if possible, otherwise falls back to image-based OCR.
+        Digital PDFs are parsed locally from their text layer; everything
+        else goes through the OCR client.
+        If a cache and the file's hash are given, a cached result skips OCR.
+        `content` is the file's bytes, when the caller has already read them.
+        Raises ValueError if the invoice could not be parsed.
         """
+        cache_key = self._cache_key(file_hash)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
         logger.info(f"Parsing invoice: {invoice_path}")
         start_time = time.time()
 
         # Check if the file is a PDF
         if invoice_path.lower().endswith(".pdf"):
+            result = self._parse_text_layer(invoice_path, content)
+            if result is not None:
+                self._store(cache_key, result)
+                return result
             try:
                 # Try direct PDF OCR processing first
                 logger.info(f"Using direct PDF OCR for: {invoice_path}")
-                result = self.api_client.get_response(invoice_path)
+                result = self.api_client.get_response(invoice_path, content)
                 end_time = time.time()
                 logger.info(
                     f"Successfully parsed PDF directly: {invoice_path} in {end_time - start_time:.2f} seconds"
                 )
+                self._store(cache_key, result)
                 return result
             except Exception as e:
                 logger.error(f"Direct PDF OCR failed: {e}")
-                pass
+                raise
+        raise ValueError(f"Unsupported invoice file: {invoice_path}")
 
+    async def parse_invoice_async(
+        self, invoice_path: str, file_hash: str = None, content: bytes = None
+    ) -> Union[Invoice, List[Invoice]]:
+        """
+        Non-blocking version of `parse_invoice` for use inside the webhook.
+        """
+        if not self.use_async:
+            return await asyncio.to_thread(
+                self.parse_invoice, invoice_path, file_hash, content
+            )
+
+        cache_key = self._cache_key(file_hash)
+        cached = await asyncio.to_thread(self._cached, cache_key)
+        if cached is not None:
+            return cached
 
-def get_container_client(name: str) -> ContainerClient:
-    connect_str = os.getenv("AzureWebJobsStorage")
-    if not connect_str:
-        logger.error("AzureWebJobsStorage is not set.")
-        return None
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    container_client = blob_service_client.get_container_client(name)
-    if not container_client.exists():
-        container_client.create_container()
-    return container_client
+        logger.info(f"Parsing invoice: {invoice_path}")
+        start_time = time.time()
+
+        if invoice_path.lower().endswith(".pdf"):
+            result = await asyncio.to_thread(self._parse_text_layer, invoice_path, content)
+            if result is not None:
+                await asyncio.to_thread(self._store, cache_key, result)
+                return result
+            try:
+                logger.info(f"Using async PDF OCR for: {invoice_path}")
+                result = await self.api_client.get_response_async(invoice_path, content)
+                end_time = time.time()
+                logger.info(
+                    f"Successfully parsed PDF directly: {invoice_path} in {end_time - start_time:.2f} seconds"
+                )
+                await asyncio.to_thread(self._store, cache_key, result)
+                return result
+            except Exception as e:
+                logger.error(f"Direct PDF OCR failed: {e}")
+                raise
+        raise ValueError(f"Unsupported invoice file: {invoice_path}")
 
 
 def azure_upload_file(local_file_path: str, azure_filename: str):
     container_client = get_container_client("function")
-    if not container_client.exists():
-        container_client.create_container()
     with open(local_file_path, "rb") as f:
         blob_client = container_client.get_blob_client(azure_filename)
         blob_client.upload_blob(f, overwrite=True)
@@ -64,44 +163,102 @@ def azure_upload_file(local_file_path: str, azure_filename: str):
 
 
 def azure_upload_ndjson(df: pl.DataFrame, file_name: str):
-    container_client = get_container_client("function")
-    ndjson_content = df.to_pandas().to_json(orient="records", lines=True)
-    blob_client = container_client.get_blob_client(file_name)
-    blob_client.upload_blob(ndjson_content, overwrite=True)
-    logger.info(f"Uploaded NDJSON to Azure container 'function' as {file_name}.")
+    upload_df(df, file_name, "ndjson")
+
+
+async def backfill(
+    files: List[Path],
+    parser: InvoiceParser,
+    data_path: str = "../data",
+    concurrency: int = 12,
+    batch_size: int = 50,
+    history: BlobHistoryWriter = None,
+) -> dict:
+    """
+    Parse `files` with at most `concurrency` OCR requests in flight.
+
+    Files whose hash is already in the invoice store are skipped. Results are
+    appended to the store (and to the blob `history`, if given) once per
+    batch, so an interrupted run resumes from the last completed batch.
+    """
+    from app import get_invoice_store, invoice_result_to_df
+
+    store = get_invoice_store(data_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    seen = set()
+
+    async def parse_one(file: Path) -> Optional[pl.DataFrame]:
+        """The file's parsed frame, or None if it was parsed before."""
+        async with semaphore:
+            # Read each file once; the same bytes are hashed and sent to OCR
+            ingested = await asyncio.to_thread(ingest_file, file, data_path)
+            file_hash = ingested.file_hash
+            if file_hash in seen or store.contains(file_hash):
+                return None
+            seen.add(file_hash)
+            result = await parser.parse_invoice_async(
+                file.as_posix(), file_hash, content=ingested.content
+            )
+        if result is None:
+            raise ValueError(f"No result for {file}")
+        return invoice_result_to_df(result, file.as_posix(), file_hash)
+
+    stats = {"skipped": 0, "parsed": 0, "failed": []}
+    with tqdm(total=len(files)) as progress:
+        for start in range(0, len(files), batch_size):
+            batch = files[start : start + batch_size]
+            results = await asyncio.gather(
+                *(parse_one(file) for file in batch), return_exceptions=True
+            )
+            dfs = []
+            for file, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to parse invoice {file}: {result}")
+                    stats["failed"].append(file.as_posix())
+                elif result is None:
+                    stats["skipped"] += 1
+                else:
+                    dfs.append(result)
+            if dfs:
+                df = pl.concat(dfs, how="diagonal_relaxed")
+                store.append(df)
+                if history is not None:
+                    history.append(df)
+            stats["parsed"] += len(dfs)
+            progress.update(len(batch))
+    logger.info(f"{stats['skipped']} of {len(files)} files already parsed.")
+    return stats
 
 
 def main():
-    files = set(Path("data").rglob("*.pdf"))
-    api_client = MistralAIClient(os.getenv("MISTRAL_API_TOKEN"))
-    parser = InvoiceParser(api_client)
-    output_path = "../data"
-    for file in tqdm(files, total=len(files)):
-        try:
-            invoice_result = parser.parse_invoice(file)
-
-            # Handle both single Invoice and list of Invoices
-            if isinstance(invoice_result, list):
-                json_outputs = list(map(parser.to_json, invoice_result))
-                df = pl.DataFrame(json_outputs)
-                df = df.select(
-                    pl.col("column_0").str.json_decode().alias("page_struct")
-                ).unnest("page_struct")
-            else:
-                # Single Invoice from direct PDF OCR
-                json_output = parser.to_json(invoice_result)
-                df = pl.DataFrame([json_output])
-                df = df.select(
-                    pl.col("column_0").str.json_decode().alias("page_struct")
-                ).unnest("page_struct")
-
-            df = df.with_columns(pl.lit(file.as_posix()).alias("path"))
-            # Remove local file save:
-            # df.write_ndjson(f'{output_path}/output.ndjson')
-            azure_upload_ndjson(df, "output.ndjson")
-        except Exception as e:
-            logger.error(f"Failed to parse invoice: {e}")
-            raise ValueError(f"Failed to parse invoice: {e}")
+    import argparse
+
+    from services import services
+
+    arg_parser = argparse.ArgumentParser(description="Parse a folder of invoice PDFs.")
+    arg_parser.add_argument("--root", default="data", help="Folder to search for PDFs.")
+    arg_parser.add_argument("--data-path", default="../data")
+    arg_parser.add_argument("--concurrency", type=int, default=12)
+    arg_parser.add_argument("--batch-size", type=int, default=50)
+    arg_parser.add_argument(
+        "--upload", action="store_true", help="Also append each batch to the blob history."
+    )
+    args = arg_parser.parse_args()
+
+    files = sorted(Path(args.root).rglob("*.pdf"))
+    stats = asyncio.run(
+        backfill(
+            files,
+            services.parser,
+            data_path=args.data_path,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            history=BlobHistoryWriter(get_container_client()) if args.upload else None,
+        )
+    )
+    logger.info(
+        f"Parsed {stats['parsed']}, skipped {stats['skipped']}, failed {len(stats['failed'])}."
+    )
 
 
 if __name__ == "__main__":
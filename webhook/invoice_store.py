@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Set
+
+import polars as pl
+from loguru import logger
+
+# Name of the lock file that serialises compactions of a partition
+LOCK_NAME = ".compact.lock"
+# A lock older than this (seconds) was left by a process that died compacting
+STALE_LOCK_AGE = 10 * 60
+
+
+class InvoiceStore:
+    """
+    Append-only history of parsed invoice frames.
+
+    Each `append` writes the invoices not stored yet as one Parquet segment
+    under `<root>/segments/ingested=<YYYY-MM-DD>/`. Once a day's partition
+    holds more than `max_segments` files they are merged into one, so the
+    store stays a few files per day however the invoices trickle in.
+
+    The store is history only: parse results are looked up in the
+    model-keyed `InvoiceCache`, never here.
+    """
+
+    def __init__(self, root: str, max_segments: int = 32):
+        self.root = Path(root)
+        self.segments_dir = self.root / "segments"
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self.max_segments = max_segments
+        self._hashes: Optional[Set[str]] = None
+        self._lock = threading.Lock()
+
+    def _segments(self, partition_dir: Optional[Path] = None) -> List[Path]:
+        return sorted((partition_dir or self.segments_dir).glob("**/*.parquet"))
+
+    def _load_hashes(self) -> Set[str]:
+        """File hashes in the store, read once per process from the segments' hash column."""
+        if self._hashes is None:
+            segments = self._segments()
+            if segments:
+                self._hashes = set(
+                    pl.scan_parquet(segments).select("file_hash").unique().collect()["file_hash"]
+                )
+            else:
+                self._hashes = set()
+        return self._hashes
+
+    def contains(self, file_hash: str) -> bool:
+        with self._lock:
+            return file_hash in self._load_hashes()
+
+    def _write_segment(self, df: pl.DataFrame, path: Path) -> None:
+        tmp_path = path.with_suffix(".tmp")
+        df.write_parquet(tmp_path)
+        tmp_path.replace(path)
+
+    def append(self, df: pl.DataFrame) -> int:
+        """
+        Store the invoices of `df` that are not in the store yet, as one
+        segment. Returns the number of invoices (file hashes) added.
+        """
+        assert "file_hash" in df.columns, "The DataFrame should have a file_hash column"
+        partition_dir = self.segments_dir / f"ingested={datetime.now(timezone.utc):%Y-%m-%d}"
+        with self._lock:
+            hashes = self._load_hashes()
+            new_df = df.filter(~pl.col("file_hash").is_in(list(hashes)))
+            if new_df.is_empty():
+                return 0
+            partition_dir.mkdir(exist_ok=True)
+            self._write_segment(
+                new_df, partition_dir / f"part-{time.time_ns()}-{os.getpid()}.parquet"
+            )
+            added = set(new_df["file_hash"])
+            hashes.update(added)
+        logger.info(f"Stored {len(added)} invoice(s) under {partition_dir}")
+
+        if len(self._segments(partition_dir)) > self.max_segments:
+            self.compact(partition_dir)
+        return len(added)
+
+    @contextmanager
+    def _compaction_lock(self, partition: Path) -> Iterator[bool]:
+        """
+        Hold the partition's lock file, shared with other processes. Yields
+        False, without waiting, if another process is compacting it.
+        """
+        lock_path = partition / LOCK_NAME
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    age = time.time() - lock_path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < STALE_LOCK_AGE:
+                    yield False
+                    return
+                logger.warning(f"Removing stale compaction lock {lock_path}.")
+                lock_path.unlink(missing_ok=True)
+        else:
+            yield False
+            return
+        try:
+            os.close(fd)
+            yield True
+        finally:
+            lock_path.unlink(missing_ok=True)
+
+    def compact(self, partition_dir: Optional[Path] = None) -> None:
+        """
+        Merge the segments of each partition (or only of `partition_dir`)
+        into one file. An invoice stored twice, e.g. by two processes, keeps
+        the rows of its first segment.
+
+        The merged rows go to a new segment and only the segments that were
+        read are removed, so segments appended meanwhile are kept. A lock
+        file keeps two processes from compacting the same partition at once;
+        the one that finds it taken skips the partition.
+        """
+        partitions = [partition_dir] if partition_dir else [
+            p for p in self.segments_dir.iterdir() if p.is_dir()
+        ]
+        for partition in partitions:
+            with self._lock, self._compaction_lock(partition) as locked:
+                if not locked:
+                    logger.info(f"{partition.name} is being compacted by another process.")
+                    continue
+                segments = self._segments(partition)
+                if len(segments) < 2:
+                    continue
+                merged = pl.concat(
+                    [
+                        pl.read_parquet(path).with_columns(pl.lit(i).alias("_segment"))
+                        for i, path in enumerate(segments)
+                    ],
+                    how="diagonal_relaxed",
+                )
+                merged = merged.filter(
+                    pl.col("_segment") == pl.col("_segment").min().over("file_hash")
+                ).drop("_segment")
+                self._write_segment(
+                    merged, partition / f"part-{time.time_ns()}-{os.getpid()}-compacted.parquet"
+                )
+                for path in segments:
+                    path.unlink(missing_ok=True)
+            logger.info(f"Compacted {len(segments)} segments of {partition.name}.")
+
+    def scan(self) -> pl.LazyFrame:
+        """Lazily scan the full history, e.g. for reporting."""
+        return pl.scan_parquet(
+            self.segments_dir / "**" / "*.parquet", hive_partitioning=True
+        )
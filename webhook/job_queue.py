@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from loguru import logger
+
+
+@dataclass
+class Job:
+    id: int
+    payload: dict
+    attempts: int
+
+
+class SqliteJobQueue:
+    """
+    Local stand-in for Azure Queue Storage backed by a SQLite file.
+
+    Semantics follow Azure queues: a dequeued job stays invisible for
+    `visibility_timeout` seconds and is handed out again if it is neither
+    completed nor failed by then (e.g. because the worker crashed). Jobs that
+    fail `max_attempts` times are kept with status 'failed' for inspection.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float = 300,
+        max_attempts: int = 3,
+        retry_delay: float = 30,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    visible_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    error TEXT
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, visible_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, payload: dict) -> int:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (payload, visible_at, created_at) VALUES (?, ?, ?)",
+                (json.dumps(payload), now, now),
+            )
+            job_id = cursor.lastrowid
+        logger.info(f"Enqueued job {job_id}.")
+        return job_id
+
+    def dequeue(self) -> Optional[Job]:
+        """Claim the oldest visible job, or return None if there is none."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT id, payload, attempts FROM jobs
+                WHERE status IN ('queued', 'running') AND visible_at <= ?
+                ORDER BY id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, payload, attempts = row
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                    visible_at = ?
+                WHERE id = ?
+                """,
+                (now + self.visibility_timeout, job_id),
+            )
+            conn.execute("COMMIT")
+        return Job(id=job_id, payload=json.loads(payload), attempts=attempts + 1)
+
+    def extend(self, job: Job) -> None:
+        """Keep a running job invisible for another `visibility_timeout` seconds."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET visible_at = ? WHERE id = ? AND status = 'running'",
+                (time.time() + self.visibility_timeout, job.id),
+            )
+
+    def complete(self, job: Job) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job.id,))
+
+    def fail(self, job: Job, error: str) -> None:
+        """Make the job visible again after `retry_delay`, or give up on it."""
+        status = "failed" if job.attempts >= self.max_attempts else "queued"
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, visible_at = ? WHERE id = ?",
+                (status, error, time.time() + self.retry_delay, job.id),
+            )
+        logger.warning(f"Job {job.id} attempt {job.attempts} failed ({status}): {error}")
+
+    def pending(self) -> int:
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
@@ -0,0 +1,66 @@
+"""
+Local parsing of PDFs that carry an embedded text layer.
+
+Colruyt "Kasticket" PDFs are generated digitally, so their text can be read
+straight from the file. The article table is rebuilt as markdown with
+PyMuPDF's table finder and handed to `parse_colruyt_markdown`, which only
+returns an invoice if the line amounts add up to the receipt total.
+Scanned or photographed PDFs have (next to) no text layer and are left to
+the OCR client.
+"""
+from typing import List, Optional
+
+import pymupdf
+from loguru import logger
+
+from colruyt_parser import parse_colruyt_markdown
+from models import Invoice
+
+# Fewer extractable characters than this per page means a scan
+MIN_CHARS_PER_PAGE = 50
+
+
+def _table_markdown(rows: List[List[Optional[str]]]) -> str:
+    """Rows as a markdown table, shaped like the OCR output; empty rows dropped."""
+    lines = []
+    for row in rows:
+        cells = [" ".join((cell or "").split()).replace("|", " ") for cell in row]
+        if any(cells):
+            lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def _page_markdown(page: pymupdf.Page) -> str:
+    """The page's tables as markdown, followed by its plain text."""
+    tables = page.find_tables()
+    if not tables.tables:
+        # Receipts usually align their columns without ruling lines
+        tables = page.find_tables(strategy="text")
+    markdown = [_table_markdown(table.extract()) for table in tables]
+    return "\n\n".join(markdown + [page.get_text()])
+
+
+def text_layer_pages(content: bytes) -> Optional[List[str]]:
+    """Markdown per page, or None if the PDF has no usable text layer."""
+    with pymupdf.open(stream=content, filetype="pdf") as doc:
+        if doc.page_count == 0:
+            return None
+        chars = sum(len(page.get_text().strip()) for page in doc)
+        if chars < MIN_CHARS_PER_PAGE * doc.page_count:
+            return None
+        return [_page_markdown(page) for page in doc]
+
+
+def parse_text_layer(content: bytes) -> Optional[Invoice]:
+    """
+    Parse a digital receipt from its text layer. Returns None (never raises)
+    when the PDF is a scan or the extracted table does not validate.
+    """
+    try:
+        pages = text_layer_pages(content)
+    except Exception as e:
+        logger.warning(f"Could not read the PDF text layer: {e}")
+        return None
+    if pages is None:
+        return None
+    return parse_colruyt_markdown(pages)
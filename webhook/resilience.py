@@ -0,0 +1,372 @@
+"""
+Shared HTTP plumbing for the Mistral, Splitwise and blob storage calls.
+
+- pooled, keep-alive connections (`requests_session`, `httpx_clients`)
+- retries of transient errors with exponential backoff and full jitter,
+  within a deadline per call (`call_with_retries`, `acall_with_retries`)
+- a circuit breaker per provider that fails fast while it is down
+  (`breaker`, `CircuitBreaker`)
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+import requests
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from azure.core.pipeline.policies import AsyncHTTPPolicy, HTTPPolicy
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+RATE_LIMIT_STATUS = 429
+# Connections kept open per host
+POOL_SIZE = 16
+
+
+class CircuitOpenError(Exception):
+    """Raised without contacting the provider while its circuit is open."""
+
+
+class TransientHTTPError(Exception):
+    """A response with a status worth retrying (429 or 5xx)."""
+
+    def __init__(self, status_code: int, response=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = response
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK exception, if any."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        # Splitwise stores the status as a one-element tuple
+        status = getattr(error, "http_status", None)
+        if isinstance(status, tuple):
+            status = status[0] if status else None
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) and status > 0 else None
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether retrying the call that raised `error` may succeed."""
+    if isinstance(
+        error,
+        (
+            TimeoutError,
+            asyncio.TimeoutError,
+            ConnectionError,
+            httpx.TransportError,
+            requests.ConnectionError,
+            requests.Timeout,
+            ServiceRequestError,
+            ServiceResponseError,
+        ),
+    ):
+        return True
+    status = status_code(error)
+    return status is not None and (status == RATE_LIMIT_STATUS or status >= 500)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return status_code(error) == RATE_LIMIT_STATUS
+
+
+def is_outage(error: BaseException) -> bool:
+    """Transient errors that count against the circuit (rate limits do not)."""
+    return is_transient(error) and not is_rate_limited(error)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive outage errors, rejecting calls
+    for `reset_timeout` seconds. After that one trial call is let through: if
+    it succeeds the circuit closes again, otherwise it re-opens.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self.clock() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> bool:
+        """Raise while the circuit is open; returns whether this call is the trial."""
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial_running):
+                raise CircuitOpenError(f"{self.name} is unavailable, not calling it.")
+            if state == "half_open":
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit for {self.name} opened.")
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+    def release_trial(self) -> None:
+        """Let another trial through, without recording an outcome."""
+        with self._lock:
+            self._trial_running = False
+
+    def record(self, error: Optional[BaseException]) -> None:
+        if error is None or not is_outage(error):
+            # Client errors still prove the provider is up
+            self.record_success()
+        else:
+            self.record_failure()
+
+    @contextmanager
+    def guard(self):
+        trial = self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record(e)
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the provider
+            if trial:
+                self.release_trial()
+            raise
+        self.record_success()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The process-wide circuit breaker of provider `name`."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def backoff_delay(attempt: int, backoff: float, max_delay: float = 30.0) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)."""
+    return random.uniform(0, min(max_delay, backoff * 2**attempt))
+
+
+def _retry_delay(error: BaseException, attempt: int, backoff: float) -> float:
+    delay = backoff_delay(attempt, backoff)
+    headers = (
+        getattr(getattr(error, "response", None), "headers", None)
+        # Splitwise exceptions keep the response headers themselves
+        or getattr(error, "http_headers", None)
+        or {}
+    )
+    try:
+        return max(delay, float(headers.get("Retry-After", 0)))
+    except (TypeError, ValueError):
+        return delay
+
+
+def call_with_retries(
+    fn: Callable[[Optional[float]], T],
+    retries: int = 2,
+    backoff: float = 0.5,
+    deadline: Optional[float] = None,
+    circuit: Optional[CircuitBreaker] = None,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+    retry_on: Callable[[BaseException], bool] = is_transient,
+) -> T:
+    """
+    Call `fn(timeout)`, retrying the errors `retry_on` accepts (transient
+    ones by default).
+
+    `timeout` is the time left until `deadline` seconds after the first
+    attempt (None without a deadline); `fn` should pass it on as the
+    request timeout. No retry is started that could not finish in time.
+    """
+    end = None if deadline is None else clock() + deadline
+    for attempt in range(retries + 1):
+        remaining = None if end is None else end - clock()
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError(f"deadline of {deadline}s exceeded")
+        try:
+            if circuit is None:
+                return fn(remaining)
+            with circuit.guard():
+                return fn(remaining)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if not retry_on(e) or attempt == retries:
+                raise
+            delay = _retry_delay(e, attempt, backoff)
+            if end is not None and clock() + delay >= end:
+                raise
+            logger.warning(f"Transient error ({e}), retrying in {delay:.2f}s.")
+            sleep(delay)
+
+
+async def acall_with_retries(
+    fn: Callable[[], Awaitable[T]],
+    retries: int = 2,
+    backoff: float = 0.5,
+    deadline: Optional[float] = None,
+    circuit: Optional[CircuitBreaker] = None,
+) -> T:
+    """Async `call_with_retries`; each attempt is cancelled at the deadline."""
+    loop = asyncio.get_running_loop()
+    end = None if deadline is None else loop.time() + deadline
+    for attempt in range(retries + 1):
+        remaining = None if end is None else end - loop.time()
+        if remaining is not None and remaining <= 0:
+            raise asyncio.TimeoutError(f"deadline of {deadline}s exceeded")
+        try:
+            if circuit is None:
+                return await asyncio.wait_for(fn(), timeout=remaining)
+            with circuit.guard():
+                return await asyncio.wait_for(fn(), timeout=remaining)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if not is_transient(e) or attempt == retries:
+                raise
+            delay = _retry_delay(e, attempt, backoff)
+            if end is not None and loop.time() + delay >= end:
+                raise
+            logger.warning(f"Transient error ({e}), retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+
+
+@lru_cache(maxsize=None)
+def requests_session() -> requests.Session:
+    """Process-wide keep-alive session for requests-based SDKs."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def httpx_clients(timeout: float = 120.0) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Pooled sync and async clients for httpx-based SDKs."""
+    limits = httpx.Limits(
+        max_connections=POOL_SIZE * 2, max_keepalive_connections=POOL_SIZE
+    )
+    return (
+        httpx.Client(limits=limits, timeout=timeout),
+        httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+
+
+class CircuitBreakerPolicy(HTTPPolicy):
+    """Azure SDK pipeline policy feeding a circuit breaker."""
+
+    def __init__(self, circuit: CircuitBreaker):
+        super().__init__()
+        self.circuit = circuit
+
+    def send(self, request):
+        trial = self.circuit.before_call()
+        try:
+            response = self.next.send(request)
+        except Exception as e:
+            self.circuit.record(e)
+            raise
+        except BaseException:
+            # Cancelled, e.g. at an upload deadline: no outcome to record
+            if trial:
+                self.circuit.release_trial()
+            raise
+        self.circuit.record(_response_error(response.http_response.status_code))
+        return response
+
+
+class AsyncCircuitBreakerPolicy(AsyncHTTPPolicy):
+    """Async version of `CircuitBreakerPolicy`."""
+
+    def __init__(self, circuit: CircuitBreaker):
+        super().__init__()
+        self.circuit = circuit
+
+    async def send(self, request):
+        trial = self.circuit.before_call()
+        try:
+            response = await self.next.send(request)
+        except Exception as e:
+            self.circuit.record(e)
+            raise
+        except BaseException:
+            # Cancelled, e.g. at an upload deadline: no outcome to record
+            if trial:
+                self.circuit.release_trial()
+            raise
+        self.circuit.record(_response_error(response.http_response.status_code))
+        return response
+
+
+def _response_error(status: int) -> Optional[TransientHTTPError]:
+    if status == RATE_LIMIT_STATUS or status >= 500:
+        return TransientHTTPError(status)
+    return None
+
+
+def blob_client_options(asynchronous: bool = False) -> dict:
+    """
+    Keyword arguments for `BlobServiceClient.from_connection_string`.
+
+    The SDK already retries with exponential backoff; this adds the breaker,
+    per-request timeouts and (for the sync client) the pooled session.
+    """
+    circuit = breaker("blob")
+    timeouts = {"connection_timeout": 10, "read_timeout": 60}
+    options = {
+        "retry_total": 3,
+        **timeouts,
+        "per_call_policies": [
+            AsyncCircuitBreakerPolicy(circuit)
+            if asynchronous
+            else CircuitBreakerPolicy(circuit)
+        ],
+    }
+    if not asynchronous:
+        from azure.core.pipeline.transport import RequestsTransport
+
+        options["transport"] = RequestsTransport(
+            session=requests_session(), session_owner=False, **timeouts
+        )
+    return options
@@ -0,0 +1,148 @@
+import os
+from functools import cached_property
+from typing import Optional
+
+from loguru import logger
+from splitwise.user import CurrentUser
+from telegram import Bot
+
+from api_client import DEFAULT_INLINE_MAX_BYTES, MistralAIClient
+from blob_history import BlobHistoryWriter
+from blob_utils import get_container_client
+from group_directory import GroupDirectory
+from idempotency import IdempotencyGuard, SqliteIdempotencyBackend
+from invoice_cache import BlobInvoiceCache, InvoiceCache, LocalInvoiceCache
+from invoice_parser import InvoiceParser
+from job_queue import SqliteJobQueue
+from splitwise_client import ResilientSplitwise
+from state_store import BlobStateStore, InMemoryStateStore, SqliteStateStore, StateStore
+
+
+class Services:
+    """
+    Lazily built clients shared by the webhook handlers.
+
+    Nothing is constructed (and no network call is made) until an attribute is
+    first accessed, so importing `app` stays cheap on a cold start.
+    """
+
+    @cached_property
+    def bot(self) -> Bot:
+        logger.info("Initialising Telegram bot.")
+        return Bot(token=os.getenv("TELEGRAM_TOKEN"))
+
+    @cached_property
+    def api_client(self) -> MistralAIClient:
+        logger.info("Initialising Mistral client.")
+        return MistralAIClient(
+            os.getenv("MISTRAL_API_TOKEN"),
+            inline_max_bytes=int(
+                os.getenv("MISTRAL_INLINE_MAX_BYTES", DEFAULT_INLINE_MAX_BYTES)
+            ),
+            local_parser=os.getenv("MISTRAL_LOCAL_PARSER", "true").lower() in ("1", "true"),
+            split_pages=os.getenv("MISTRAL_SPLIT_PAGES", "").lower() in ("1", "true"),
+        )
+
+    @cached_property
+    def parser(self) -> InvoiceParser:
+        """
+        Invoice parser for the webhook and backfill. MISTRAL_USE_ASYNC=false
+        runs the sync Mistral client in a thread; PDF_TEXT_LAYER=false sends
+        every PDF to OCR, also those with an embedded text layer.
+        """
+        return InvoiceParser(
+            self.api_client,
+            use_async=os.getenv("MISTRAL_USE_ASYNC", "true").lower() in ("1", "true"),
+            cache=self.invoice_cache,
+            text_layer=os.getenv("PDF_TEXT_LAYER", "true").lower() in ("1", "true"),
+        )
+
+    @cached_property
+    def invoice_cache(self) -> Optional[InvoiceCache]:
+        """Parsed-invoice cache, selected by INVOICE_CACHE_BACKEND (local/blob/none)."""
+        backend = os.getenv("INVOICE_CACHE_BACKEND", "local").lower()
+        max_bytes = int(os.getenv("INVOICE_CACHE_MAX_BYTES", 50 * 1024**2))
+        if backend == "local":
+            return LocalInvoiceCache(
+                os.getenv("INVOICE_CACHE_DIR", "../data/cache"), max_bytes=max_bytes
+            )
+        if backend == "blob":
+            return BlobInvoiceCache(get_container_client("function"), max_bytes=max_bytes)
+        return None
+
+    @cached_property
+    def history(self) -> Optional[BlobHistoryWriter]:
+        """Incremental blob copy of parsed invoices, enabled by INVOICE_HISTORY=blob."""
+        if os.getenv("INVOICE_HISTORY", "").lower() != "blob":
+            return None
+        return BlobHistoryWriter(get_container_client("function"))
+
+    @cached_property
+    def splitwise(self) -> ResilientSplitwise:
+        logger.info("Initialising Splitwise client.")
+        return ResilientSplitwise(
+            os.getenv("SPLITWISE_CONSUMER_KEY"),
+            os.getenv("SPLITWISE_CONSUMER_SECRET"),
+            api_key=os.getenv("SPLITWISE_API_KEY"),
+        )
+
+    @cached_property
+    def current_user(self) -> CurrentUser:
+        return self.splitwise.getCurrentUser()
+
+    @cached_property
+    def groups(self) -> GroupDirectory:
+        ttl = float(os.getenv("SPLITWISE_GROUP_TTL", 600))
+        return GroupDirectory(self.splitwise, ttl=ttl)
+
+    @cached_property
+    def job_queue(self) -> SqliteJobQueue:
+        return SqliteJobQueue(os.getenv("JOB_QUEUE_PATH", "../data/jobs.sqlite"))
+
+    @cached_property
+    def idempotency(self) -> IdempotencyGuard:
+        backend = SqliteIdempotencyBackend(
+            os.getenv("IDEMPOTENCY_DB_PATH", "../data/idempotency.sqlite")
+        )
+        return IdempotencyGuard(backend)
+
+    @cached_property
+    def conversation_state(self) -> StateStore:
+        """Per-chat state, selected by STATE_STORE (memory/sqlite/blob)."""
+        backend = os.getenv("STATE_STORE", "memory").lower()
+        ttl = float(os.getenv("STATE_TTL", 24 * 3600))
+        if backend == "sqlite":
+            return SqliteStateStore(
+                os.getenv("STATE_STORE_PATH", "../data/state.sqlite"), ttl=ttl
+            )
+        if backend == "blob":
+            return BlobStateStore(get_container_client("function"), ttl=ttl)
+        return InMemoryStateStore(ttl=ttl)
+
+    @property
+    def initialised(self) -> list:
+        """Names of the services that have been built so far."""
+        return [name for name in self._names() if name in self.__dict__]
+
+    def override(self, **services) -> None:
+        """Replace services with prebuilt instances, e.g. fakes in a benchmark."""
+        for name, service in services.items():
+            if name not in self._names():
+                raise ValueError(f"Unknown service '{name}'.")
+            self.__dict__[name] = service
+
+    def reset(self) -> None:
+        """Drop all built services so they are rebuilt on next access."""
+        for name in self._names():
+            self.__dict__.pop(name, None)
+
+    @classmethod
+    def _names(cls) -> list:
+        return [
+            name
+            for name, attr in vars(cls).items()
+            if isinstance(attr, cached_property)
+        ]
+
+
+services = Services()
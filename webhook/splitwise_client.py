@@ -0,0 +1,87 @@
+from typing import Optional
+
+import requests
+from requests import Request
+from splitwise import Splitwise
+
+from resilience import (
+    CircuitBreaker,
+    TransientHTTPError,
+    breaker,
+    call_with_retries,
+    requests_session,
+)
+
+# ResilientSplitwise replaces the SDK's private request method and calls its
+# private helpers; fail at import rather than silently bypass the session,
+# deadline and breaker on an SDK version that renamed them
+_SDK_PRIVATES = (
+    "_Splitwise__makeRequest",
+    "_Splitwise__handleUppercaseBoolean",
+    "_Splitwise__handleResponse",
+)
+_missing = [name for name in _SDK_PRIVATES if not hasattr(Splitwise, name)]
+if _missing:
+    raise ImportError(
+        f"This splitwise version lacks {', '.join(_missing)}; "
+        "install the version pinned in requirements.txt."
+    )
+
+
+class ResilientSplitwise(Splitwise):
+    """
+    Splitwise client sending every request through a shared keep-alive
+    session, with a per-request deadline and the "splitwise" circuit breaker.
+
+    The SDK opens a new session (and TLS connection) for each request. Only
+    GET requests are retried here; createExpense retries rate limits itself
+    (see expense_batch.submit_expense), because a blind POST retry could
+    register an expense twice.
+    """
+
+    def __init__(
+        self,
+        *args,
+        session: requests.Session = None,
+        timeout: float = 30.0,
+        retries: int = 2,
+        circuit: Optional[CircuitBreaker] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.session = session or requests_session()
+        self.timeout = timeout
+        self.retries = retries
+        self.circuit = circuit or breaker("splitwise")
+
+    def _send(self, prepared, timeout: Optional[float]) -> requests.Response:
+        response = self.session.send(prepared, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientHTTPError(response.status_code, response)
+        return response
+
+    # Overrides the SDK's private Splitwise.__makeRequest
+    def _Splitwise__makeRequest(self, url, method="GET", data=None, auth=None, files=None):
+        headers = {}
+        if auth is None:
+            if self.auth:
+                auth = self.auth
+            elif self.api_key:
+                headers = {"Authorization": "Bearer {}".format(self.api_key)}
+
+        data = Splitwise._Splitwise__handleUppercaseBoolean(data)
+        prepared = Request(
+            method=method, url=url, headers=headers, data=data, auth=auth, files=files
+        ).prepare()
+
+        try:
+            response = call_with_retries(
+                lambda timeout: self._send(prepared, timeout),
+                retries=self.retries if method == "GET" else 0,
+                deadline=self.timeout,
+                circuit=self.circuit,
+            )
+        except TransientHTTPError as e:
+            # Let the SDK raise its usual exception for the final response
+            response = e.response
+        return self._Splitwise__handleResponse(response)
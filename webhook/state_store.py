@@ -0,0 +1,266 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.storage.blob import ContainerClient
+from loguru import logger
+
+from resilience import backoff_delay
+
+Version = Optional[str]
+# Longest pause (seconds) between compare-and-set attempts
+MAX_RETRY_DELAY = 0.5
+
+
+class StateConflictError(Exception):
+    """Raised when an entry keeps changing under a compare-and-set."""
+
+
+class StateStore(ABC):
+    """
+    Key-value store for per-chat conversation state.
+
+    Entries expire `ttl` seconds after their last write. Every entry carries a
+    version, so concurrent instances can update it with compare-and-set
+    instead of overwriting each other; a lost race is retried up to
+    `max_attempts` times with jittered backoff.
+
+    The `a*` methods run the (possibly blocking) store calls in a thread, for
+    use on the event loop.
+    """
+
+    def __init__(self, ttl: float = 24 * 3600, max_attempts: int = 10, backoff: float = 0.01):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    @abstractmethod
+    def get_versioned(self, key) -> Tuple[Optional[dict], Version]:
+        """The entry and its version, or (None, None) if absent."""
+
+    @abstractmethod
+    def compare_and_set(self, key, value: Optional[dict], expected: Version) -> bool:
+        """
+        Write `value` (or delete the entry if it is None) only if the stored
+        version still equals `expected`; `expected=None` means "absent".
+        """
+
+    def _write(self, key, change: Callable[[Optional[dict]], Optional[dict]]) -> Optional[dict]:
+        """Compare-and-set `change(current value)`, retrying lost races."""
+        for attempt in range(self.max_attempts):
+            value, version = self.get_versioned(key)
+            new_value = change(value)
+            if self.compare_and_set(key, new_value, version):
+                return new_value
+            if attempt + 1 < self.max_attempts:
+                logger.debug(f"Concurrent update of state {key}, retrying.")
+                time.sleep(backoff_delay(attempt, self.backoff, max_delay=MAX_RETRY_DELAY))
+        raise StateConflictError(
+            f"State {key} kept changing, gave up after {self.max_attempts} attempts."
+        )
+
+    def set(self, key, value: dict) -> None:
+        self._write(key, lambda _: value)
+
+    def delete(self, key) -> None:
+        self._write(key, lambda _: None)
+
+    def get(self, key) -> Optional[dict]:
+        return self.get_versioned(key)[0]
+
+    def setdefault(self, key, value: dict) -> dict:
+        """Set the entry only if there is none, e.g. to avoid clobbering a newer conversation."""
+        return self._write(key, lambda current: current if current is not None else value)
+
+    def update(self, key, changes: dict) -> dict:
+        """Merge `changes` into the entry, retrying if another writer got there first."""
+        return self._write(key, lambda value: {**(value or {}), **changes})
+
+    async def aget(self, key) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value: dict) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    async def adelete(self, key) -> None:
+        await asyncio.to_thread(self.delete, key)
+
+    async def asetdefault(self, key, value: dict) -> dict:
+        return await asyncio.to_thread(self.setdefault, key, value)
+
+    async def aupdate(self, key, changes: dict) -> dict:
+        return await asyncio.to_thread(self.update, key, changes)
+
+
+class InMemoryStateStore(StateStore):
+    """Single-process store; state is lost when the instance recycles."""
+
+    def __init__(self, ttl: float = 24 * 3600):
+        super().__init__(ttl)
+        self._entries: Dict[str, Tuple[dict, int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get_versioned(self, key) -> Tuple[Optional[dict], Version]:
+        with self._lock:
+            entry = self._entries.get(str(key))
+            if entry is None or entry[2] < time.time():
+                return None, None
+            value, version, _ = entry
+            return dict(value), str(version)
+
+    def _prune(self, now: float) -> None:
+        """Drop expired entries (with the lock held), as SqliteStateStore does on write."""
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at < now]
+        for key in expired:
+            del self._entries[key]
+
+    def compare_and_set(self, key, value: Optional[dict], expected: Version) -> bool:
+        key = str(key)
+        with self._lock:
+            self._prune(time.time())
+            entry = self._entries.get(key)
+            current = str(entry[1]) if entry else None
+            if current != expected:
+                return False
+            if value is None:
+                self._entries.pop(key, None)
+            else:
+                version = entry[1] + 1 if entry else 1
+                self._entries[key] = (dict(value), version, time.time() + self.ttl)
+            return True
+
+
+class SqliteStateStore(StateStore):
+    """Store shared by all processes that can reach the same SQLite file."""
+
+    def __init__(self, path: str, ttl: float = 24 * 3600):
+        super().__init__(ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def get_versioned(self, key) -> Tuple[Optional[dict], Version]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, version FROM state WHERE key = ? AND expires_at >= ?",
+                (str(key), time.time()),
+            ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), str(row[1])
+
+    def compare_and_set(self, key, value: Optional[dict], expected: Version) -> bool:
+        key = str(key)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM state WHERE expires_at < ?", (now,))
+            row = conn.execute(
+                "SELECT version FROM state WHERE key = ?", (key,)
+            ).fetchone()
+            current = str(row[0]) if row else None
+            if current != expected:
+                conn.execute("ROLLBACK")
+                return False
+            if value is None:
+                conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    """
+                    INSERT INTO state (key, value, version, expires_at)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value,
+                        version = state.version + 1, expires_at = excluded.expires_at
+                    """,
+                    (key, json.dumps(value), now + self.ttl),
+                )
+            conn.execute("COMMIT")
+        return True
+
+
+class BlobStateStore(StateStore):
+    """
+    Store in Azure Blob Storage (or Azurite locally), one blob per chat.
+
+    The blob's ETag is the version, so compare-and-set maps onto conditional
+    uploads and deletes.
+    """
+
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        prefix: str = "conversation_state/",
+        ttl: float = 24 * 3600,
+    ):
+        super().__init__(ttl)
+        self.container_client = container_client
+        self.prefix = prefix
+
+    def _blob_client(self, key):
+        return self.container_client.get_blob_client(f"{self.prefix}{key}.json")
+
+    def get_versioned(self, key) -> Tuple[Optional[dict], Version]:
+        try:
+            downloader = self._blob_client(key).download_blob()
+        except ResourceNotFoundError:
+            return None, None
+        payload = json.loads(downloader.readall())
+        version = downloader.properties.etag
+        if payload["expires_at"] < time.time():
+            # Expired entries still need their ETag so they can be replaced
+            return None, version
+        return payload["value"], version
+
+    def compare_and_set(self, key, value: Optional[dict], expected: Version) -> bool:
+        blob_client = self._blob_client(key)
+        try:
+            if value is None:
+                if expected is not None:
+                    blob_client.delete_blob(
+                        etag=expected, match_condition=MatchConditions.IfNotModified
+                    )
+                return True
+            data = json.dumps({"value": value, "expires_at": time.time() + self.ttl})
+            if expected is None:
+                blob_client.upload_blob(data, overwrite=False)
+            else:
+                blob_client.upload_blob(
+                    data,
+                    overwrite=True,
+                    etag=expected,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            return True
+        except (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError):
+            return False
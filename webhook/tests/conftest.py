@@ -0,0 +1,69 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+# The function app imports its modules flat, from ./webhook
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class ScriptedServer(ThreadingHTTPServer):
+    """
+    Local HTTP server answering with `responses` in order, one per request;
+    the last response repeats once the script runs out.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ScriptedHandler)
+        self.responses: List[Tuple[int, dict, dict]] = [(200, {}, {})]
+        self.requests: List[Tuple[str, str]] = []
+        self.delay = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def script(self, *responses) -> None:
+        """Responses as `(status, body)` or `(status, body, headers)`."""
+        self.responses = [(r + ({},))[:3] for r in responses]
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    def _respond(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.requests.append((self.command, self.path))
+        if server.delay:
+            time.sleep(server.delay)
+        index = min(len(server.requests), len(server.responses)) - 1
+        status, body, headers = server.responses[index]
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ScriptedServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,165 @@
+import io
+from datetime import date
+
+import polars as pl
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+from blob_history import MAX_BLOCK_BYTES, BlobHistoryWriter, _chunks
+
+
+class FakeBlob:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readall(self) -> bytes:
+        return self.data
+
+
+class FakeBlobClient:
+    def __init__(self, container, name: str):
+        self.container = container
+        self.blob_name = name
+
+    def create_append_blob(self, match_condition=None):
+        if match_condition == MatchConditions.IfMissing and self.blob_name in self.container.blobs:
+            raise ResourceExistsError("exists")
+        self.container.blobs[self.blob_name] = b""
+
+    def append_block(self, data: bytes, length: int = None):
+        assert len(data) <= MAX_BLOCK_BYTES, "block too large for an append blob"
+        assert length == len(data)
+        self.container.blocks.append(len(data))
+        self.container.blobs[self.blob_name] += data
+
+    def upload_blob(self, data, overwrite=False):
+        if not overwrite and self.blob_name in self.container.blobs:
+            raise ResourceExistsError("exists")
+        self.container.blobs[self.blob_name] = data.read()
+
+    def download_blob(self) -> FakeDownload:
+        if self.blob_name not in self.container.blobs:
+            raise ResourceNotFoundError("missing")
+        return FakeDownload(self.container.blobs[self.blob_name])
+
+    def delete_blob(self):
+        del self.container.blobs[self.blob_name]
+
+
+class FakeContainerClient:
+    """The append-blob subset of ContainerClient that BlobHistoryWriter uses."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.blocks = []
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+    def list_blobs(self, name_starts_with: str = ""):
+        return [FakeBlob(name) for name in sorted(self.blobs) if name.startswith(name_starts_with)]
+
+
+def invoices(n: int, start: int = 0) -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "file_hash": [f"hash-{i}" for i in range(start, start + n)],
+            "description": [f"Article {i}" for i in range(start, start + n)],
+            "amount": [float(i) for i in range(start, start + n)],
+        }
+    )
+
+
+@pytest.fixture
+def container() -> FakeContainerClient:
+    return FakeContainerClient()
+
+
+@pytest.fixture
+def writer(container) -> BlobHistoryWriter:
+    return BlobHistoryWriter(container)
+
+
+def test_chunks_split_at_line_boundaries():
+    data = b"".join(f'{{"line": {i}}}\n'.encode() for i in range(100))
+    chunks = _chunks(data, max_bytes=64)
+    assert b"".join(chunks) == data
+    assert all(len(chunk) <= 64 for chunk in chunks)
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+
+
+def test_chunks_split_lines_longer_than_a_block():
+    data = b"x" * 150 + b"\n"
+    chunks = _chunks(data, max_bytes=64)
+    assert b"".join(chunks) == data
+    assert [len(chunk) for chunk in chunks] == [64, 64, 23]
+
+
+def test_append_creates_the_days_log_once(writer, container):
+    day = date(2025, 3, 1)
+    writer.append(invoices(2), day=day)
+    writer.append(invoices(3, start=2), day=day)
+    log = container.blobs["history/log/2025-03-01.ndjson"]
+    assert pl.read_ndjson(io.BytesIO(log)).equals(invoices(5))
+
+
+def test_append_uploads_only_the_new_rows(writer, container):
+    day = date(2025, 3, 1)
+    writer.append(invoices(100), day=day)
+    size = len(container.blobs["history/log/2025-03-01.ndjson"])
+    uploaded = writer.append(invoices(1, start=100), day=day)
+    assert len(container.blobs["history/log/2025-03-01.ndjson"]) == size + uploaded
+    assert uploaded < size / 50
+
+
+def test_append_skips_empty_frames(writer, container):
+    assert writer.append(invoices(0)) == 0
+    assert container.blobs == {}
+
+
+def test_append_splits_large_frames_into_blocks(writer, container):
+    df = invoices(60_000)
+    uploaded = writer.append(df, day=date(2025, 3, 1))
+    assert MAX_BLOCK_BYTES < uploaded < 2 * MAX_BLOCK_BYTES
+    assert len(container.blocks) == 2
+    log = container.blobs["history/log/2025-03-01.ndjson"]
+    assert pl.read_ndjson(io.BytesIO(log)).equals(df)
+
+
+def test_compact_rolls_finished_days_into_segments(writer, container):
+    writer.append(invoices(2), day=date(2025, 3, 1))
+    writer.append(invoices(2, start=2), day=date(2025, 3, 2))
+    writer.append(invoices(2, start=4), day=date(2025, 3, 3))
+
+    compacted = writer.compact(before=date(2025, 3, 3))
+
+    assert compacted == [
+        "history/segments/date=2025-03-01.parquet",
+        "history/segments/date=2025-03-02.parquet",
+    ]
+    assert sorted(container.blobs) == [
+        "history/log/2025-03-03.ndjson",
+        "history/segments/date=2025-03-01.parquet",
+        "history/segments/date=2025-03-02.parquet",
+    ]
+    segment = container.blobs["history/segments/date=2025-03-02.parquet"]
+    assert pl.read_parquet(io.BytesIO(segment)).equals(invoices(2, start=2))
+
+
+def test_compact_is_repeatable(writer, container):
+    writer.append(invoices(2), day=date(2025, 3, 1))
+    writer.compact(before=date(2025, 3, 2))
+    assert writer.compact(before=date(2025, 3, 2)) == []
+
+
+def test_read_combines_segments_and_logs(writer):
+    writer.append(invoices(2), day=date(2025, 3, 1))
+    writer.compact(before=date(2025, 3, 2))
+    writer.append(invoices(3, start=2), day=date(2025, 3, 2))
+    assert writer.read().sort("file_hash").equals(invoices(5).sort("file_hash"))
@@ -0,0 +1,165 @@
+import asyncio
+import io
+
+import polars as pl
+import pytest
+from azure.core.exceptions import ResourceExistsError
+
+import blob_utils
+
+
+class FakeBlobClient:
+    def __init__(self, container, name: str):
+        self.container = container
+        self.name = name
+
+    def upload_blob(self, data, overwrite=False):
+        self.container.blobs[self.name] = (data.read(), overwrite)
+
+
+class FakeContainerClient:
+    def __init__(self, name: str, exists: bool = False):
+        self.name = name
+        self.exists = exists
+        self.create_calls = 0
+        self.blobs = {}
+
+    def create_container(self):
+        self.create_calls += 1
+        if self.exists:
+            raise ResourceExistsError("exists")
+        self.exists = True
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+
+class FakeBlobServiceClient:
+    def __init__(self):
+        self.containers = {}
+
+    def get_container_client(self, name: str) -> FakeContainerClient:
+        return self.containers.setdefault(name, FakeContainerClient(name))
+
+
+class FakeAsyncBlobClient(FakeBlobClient):
+    async def upload_blob(self, data, overwrite=False):
+        await asyncio.sleep(self.container.latency)
+        super().upload_blob(data, overwrite)
+
+
+class FakeAsyncContainerClient(FakeContainerClient):
+    latency = 0.0
+
+    async def create_container(self):
+        super().create_container()
+
+    def get_blob_client(self, name: str) -> FakeAsyncBlobClient:
+        return FakeAsyncBlobClient(self, name)
+
+
+class FakeAsyncBlobServiceClient:
+    created = []
+
+    def __init__(self):
+        self.containers = {}
+
+    @classmethod
+    def from_connection_string(cls, conn_str, **kwargs):
+        client = cls()
+        cls.created.append(client)
+        return client
+
+    def get_container_client(self, name: str) -> FakeAsyncContainerClient:
+        return self.containers.setdefault(name, FakeAsyncContainerClient(name))
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("AzureWebJobsStorage", "UseDevelopmentStorage=true")
+    service = FakeBlobServiceClient()
+    monkeypatch.setattr(blob_utils, "_blob_service_client", lambda connect_str: service)
+    blob_utils._container_client.cache_clear()
+    yield service
+    blob_utils._container_client.cache_clear()
+
+
+@pytest.fixture
+def async_service(monkeypatch):
+    monkeypatch.setenv("AzureWebJobsStorage", "UseDevelopmentStorage=true")
+    monkeypatch.setattr(blob_utils, "AsyncBlobServiceClient", FakeAsyncBlobServiceClient)
+    FakeAsyncBlobServiceClient.created = []
+    return FakeAsyncBlobServiceClient
+
+
+@pytest.fixture
+def df() -> pl.DataFrame:
+    return pl.DataFrame({"description": ["Melk", "Brood"], "amount": [1.09, 2.35]})
+
+
+@pytest.mark.parametrize("format", ["ndjson", "parquet"])
+def test_df_to_buffer_round_trips(df, format):
+    buffer = blob_utils.df_to_buffer(df, format)
+    read = pl.read_parquet if format == "parquet" else pl.read_ndjson
+    assert read(buffer).equals(df)
+
+
+def test_df_to_buffer_rejects_unknown_formats(df):
+    with pytest.raises(ValueError):
+        blob_utils.df_to_buffer(df, "csv")
+
+
+def test_connection_string_is_required(monkeypatch):
+    monkeypatch.delenv("AzureWebJobsStorage", raising=False)
+    with pytest.raises(ValueError):
+        blob_utils.get_container_client()
+
+
+def test_container_is_created_once_per_process(service):
+    container = blob_utils.get_container_client("function")
+    assert blob_utils.get_container_client("function") is container
+    assert container.create_calls == 1
+
+
+def test_existing_container_is_reused(service):
+    service.containers["function"] = FakeContainerClient("function", exists=True)
+    assert blob_utils.get_container_client("function").exists
+
+
+def test_upload_df_overwrites_the_blob(service, df):
+    blob_utils.upload_df(df, "invoices/a.parquet", format="parquet")
+    data, overwrite = service.containers["function"].blobs["invoices/a.parquet"]
+    assert overwrite
+    assert pl.read_parquet(io.BytesIO(data)).equals(df)
+
+
+def test_async_container_client_is_cached_per_loop(async_service):
+    async def twice():
+        first = await blob_utils.get_async_container_client("function")
+        second = await blob_utils.get_async_container_client("function")
+        return first, second
+
+    first, second = asyncio.run(twice())
+    assert first is second
+    assert first.create_calls == 1
+    # A new event loop gets its own client and session
+    other, _ = asyncio.run(twice())
+    assert other is not first
+    assert len(async_service.created) == 2
+
+
+def test_async_upload_df(async_service, df):
+    async def upload():
+        await blob_utils.async_upload_df(df, "invoices/a.ndjson")
+        return await blob_utils.get_async_container_client("function")
+
+    container = asyncio.run(upload())
+    data, overwrite = container.blobs["invoices/a.ndjson"]
+    assert overwrite
+    assert pl.read_ndjson(io.BytesIO(data)).equals(df)
+
+
+def test_async_upload_df_times_out(async_service, df, monkeypatch):
+    monkeypatch.setattr(FakeAsyncContainerClient, "latency", 1.0)
+    with pytest.raises(TimeoutError):
+        asyncio.run(blob_utils.async_upload_df(df, "invoices/a.ndjson", timeout=0.05))
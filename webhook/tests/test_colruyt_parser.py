@@ -0,0 +1,121 @@
+import pytest
+
+from colruyt_parser import parse_colruyt_markdown
+
+HEADER = """Colruyt Halle 01/03/2025 10:12
+
+| Hoev. | Omschrijving | Eenh.prijs | Bedrag |
+| ----- | ------------ | ---------- | ------ |
+"""
+
+
+def receipt(*rows: str, total: str = "Te betalen 2,10") -> str:
+    return HEADER + "\n".join(rows) + "\n\n" + total
+
+
+# (receipt, expected (description, quantity, unit_price, weight, discount) per line, total)
+PARSED = {
+    "plain": (
+        receipt("| 2 | BONI MELK 1L | 1,05 | 2,10 |"),
+        [("BONI MELK 1L", 2, 1.05, 0, 0)],
+        2.10,
+    ),
+    "korting-percentage": (
+        receipt(
+            "| 2 | BONI MELK 1L | 1,05 | 2,10 |",
+            "| 25% | Korting | | |",
+            total="Te betalen 1,57",
+        ),
+        [("BONI MELK 1L", 2, 1.05, 0, 0), ("Korting", 0, 0, 0, 25)],
+        1.57,
+    ),
+    "korting-percentage-and-amount": (
+        receipt(
+            "| 2 | BONI MELK 1L | 1,05 | 2,10 |",
+            "| 25% | Korting | | -0,53 |",
+            total="Te betalen 1,57",
+        ),
+        [("BONI MELK 1L", 2, 1.05, 0, 0), ("Korting", 0, 0, 0, 25)],
+        1.57,
+    ),
+    "korting-amount": (
+        receipt(
+            "| 1 | KAAS | 4,00 | 4,00 |",
+            "| | Korting | | -1,00 |",
+            total="Te betalen 3,00",
+        ),
+        [("KAAS", 1, 4.0, 0, 0), ("Korting", 0, 0, 0, 25)],
+        3.00,
+    ),
+    "per-kg": (
+        receipt("| 0,512 kg | BANANEN | 1,99 | 1,02 |", total="Te betalen 1,02"),
+        [("BANANEN", 0.512, 1.99, 0.512, 0)],
+        1.02,
+    ),
+    "no-unit-price": (
+        receipt("| 3 | EIEREN | | 3,30 |", total="Te betalen 3,30"),
+        [("EIEREN", 3, 1.10, 0, 0)],
+        3.30,
+    ),
+    "total-row-in-the-table": (
+        receipt(
+            "| 2 | BONI MELK 1L | 1,05 | 2,10 |",
+            "| Totaal | | | 2,10 |",
+            total="",
+        ),
+        [("BONI MELK 1L", 2, 1.05, 0, 0)],
+        2.10,
+    ),
+    "subtotal-and-total": (
+        receipt(
+            "| 2 | BONI MELK 1L | 1,05 | 2,10 |",
+            "| Subtotaal | | | 2,10 |",
+            "| 1 | KAAS | 4,00 | 4,00 |",
+            total="Totaal 6,10",
+        ),
+        [("BONI MELK 1L", 2, 1.05, 0, 0), ("KAAS", 1, 4.0, 0, 0)],
+        6.10,
+    ),
+    "two-tables": (
+        receipt("| 2 | BONI MELK 1L | 1,05 | 2,10 |", total="")
+        + "\n\n"
+        + "| Hoev. | Omschrijving | Eenh.prijs | Bedrag |\n| 1 | KAAS | 4,00 | 4,00 |\n\nTe betalen 6,10",
+        [("BONI MELK 1L", 2, 1.05, 0, 0), ("KAAS", 1, 4.0, 0, 0)],
+        6.10,
+    ),
+}
+
+
+@pytest.mark.parametrize("markdown, lines, total", PARSED.values(), ids=PARSED.keys())
+def test_parse_colruyt_markdown(markdown, lines, total):
+    invoice = parse_colruyt_markdown([markdown])
+    assert invoice.date == "2025-03-01"
+    assert invoice.total_amount_invoice == pytest.approx(total)
+    assert invoice.items[-1].description == "Total amount"
+    parsed = [
+        (item.description, item.quantity, item.unit_price, item.weight, item.discount)
+        for item in invoice.items[:-1]
+    ]
+    assert [line[0] for line in parsed] == [line[0] for line in lines]
+    for got, expected in zip(parsed, lines):
+        assert got[1:] == pytest.approx(expected[1:])
+
+
+# Receipts the parser must leave to the LLM
+FALLBACK = {
+    "totals-do-not-add-up": receipt("| 2 | BONI MELK 1L | 1,05 | 2,10 |", total="Te betalen 3,10"),
+    "korting-does-not-add-up": receipt(
+        "| 2 | BONI MELK 1L | 1,05 | 2,10 |", "| 50% | Korting | | |", total="Te betalen 1,57"
+    ),
+    "line-does-not-add-up": receipt("| 2 | BONI MELK 1L | 1,05 | 2,50 |", total="Te betalen 2,50"),
+    "korting-first": receipt("| 25% | Korting | | -0,53 |", total="Te betalen -0,53"),
+    "unreadable-quantity": receipt("| ? | BONI MELK 1L | 1,05 | 2,10 |"),
+    "no-total": receipt("| 2 | BONI MELK 1L | 1,05 | 2,10 |", total=""),
+    "no-date": receipt("| 2 | BONI MELK 1L | 1,05 | 2,10 |").replace("01/03/2025", ""),
+    "no-table": "Colruyt 01/03/2025\n\nBONI MELK 1L 2,10\n\nTe betalen 2,10",
+}
+
+
+@pytest.mark.parametrize("markdown", FALLBACK.values(), ids=FALLBACK.keys())
+def test_parse_colruyt_markdown_falls_back(markdown):
+    assert parse_colruyt_markdown([markdown]) is None
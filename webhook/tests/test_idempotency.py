@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import time
+
+import pytest
+from loguru import logger
+
+import app
+from benchmarks.bench_replay import (
+    FakeBot,
+    FakeFile,
+    FakeMistral,
+    FakeSplitwise,
+    clone_conversation,
+    default_conversation,
+)
+from group_directory import GroupDirectory
+from idempotency import IdempotencyGuard, SqliteIdempotencyBackend
+from services import services
+from state_store import InMemoryStateStore
+
+
+@pytest.fixture
+def backend(tmp_path) -> SqliteIdempotencyBackend:
+    return SqliteIdempotencyBackend(str(tmp_path / "idempotency.sqlite"))
+
+
+def test_first_seen_records_the_key():
+    guard = IdempotencyGuard()
+    assert guard.first_seen("update:1")
+    assert not guard.first_seen("update:1")
+    assert guard.seen("update:1")
+    assert not guard.seen("update:2")
+
+
+def test_forget_lets_a_key_be_processed_again(backend):
+    guard = IdempotencyGuard(backend)
+    guard.first_seen("update:1")
+    guard.forget("update:1")
+    assert guard.first_seen("update:1")
+
+
+def test_backend_is_shared_between_guards(backend):
+    IdempotencyGuard(backend).first_seen("update:1")
+    other = IdempotencyGuard(backend)
+    assert other.seen("update:1")
+    assert not other.first_seen("update:1")
+
+
+@pytest.mark.parametrize("with_backend", [False, True])
+def test_keys_expire_after_their_ttl(backend, with_backend):
+    guard = IdempotencyGuard(backend if with_backend else None)
+    guard.first_seen("file:1:hash", ttl=0.05)
+    guard.first_seen("submit:1:hash")
+    assert guard.seen("file:1:hash")
+    time.sleep(0.1)
+    assert not guard.seen("file:1:hash")
+    assert guard.first_seen("file:1:hash")
+    assert guard.seen("submit:1:hash")
+
+
+def test_lru_is_bounded(backend):
+    guard = IdempotencyGuard(backend, max_entries=2)
+    for i in range(3):
+        guard.first_seen(f"update:{i}")
+    assert list(guard._seen) == ["update:1", "update:2"]
+    # Evicted keys are still answered by the backend
+    assert guard.seen("update:0")
+
+
+class RecordingBot(FakeBot):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.texts.append(text)
+
+
+CHAT_ID = 5
+
+
+@pytest.fixture
+def webhook(tmp_path, backend):
+    logger.disable("app")
+    splitwise = FakeSplitwise(latency=0)
+    bot = RecordingBot()
+    services.override(
+        bot=bot,
+        api_client=FakeMistral(latency=0),
+        splitwise=splitwise,
+        current_user=splitwise.getCurrentUser(),
+        groups=GroupDirectory(splitwise),
+        conversation_state=InMemoryStateStore(),
+        idempotency=IdempotencyGuard(backend),
+        invoice_cache=None,
+        history=None,
+    )
+    yield bot, splitwise
+    services.reset()
+    logger.enable("app")
+
+
+def send_receipt(data_path, chat_index: int) -> None:
+    """Run the whole conversation ending in the same receipt for CHAT_ID."""
+
+    async def conversation():
+        for update in clone_conversation(default_conversation(), chat_index, CHAT_ID):
+            await app.handle_telegram_update(update, str(data_path))
+
+    asyncio.run(conversation())
+
+
+def receipt_hash() -> str:
+    content = asyncio.run(FakeFile(f"pdf-{CHAT_ID}").download_as_bytearray())
+    return hashlib.sha256(content).hexdigest()
+
+
+def test_registered_receipt_is_refused(webhook, tmp_path):
+    bot, splitwise = webhook
+    send_receipt(tmp_path, 0)
+    created = splitwise.created
+    assert created > 0
+    send_receipt(tmp_path, 1)
+    assert bot.texts[-1] == "This invoice has already been registered."
+    assert splitwise.created == created
+
+
+def test_receipt_being_processed_is_refused(webhook, tmp_path):
+    bot, splitwise = webhook
+    services.idempotency.first_seen(IdempotencyGuard.file_key(CHAT_ID, receipt_hash()))
+    send_receipt(tmp_path, 0)
+    assert bot.texts[-1] == "This invoice is already being processed."
+    assert splitwise.created == 0
+
+
+def test_claim_of_a_dead_host_lapses(webhook, tmp_path, backend, monkeypatch):
+    bot, splitwise = webhook
+    # A host claimed the receipt and was killed mid-parse, before submitting
+    monkeypatch.setattr(app, "INVOICE_CLAIM_TTL", 0.05)
+    IdempotencyGuard(backend).first_seen(
+        IdempotencyGuard.file_key(CHAT_ID, receipt_hash()), app.INVOICE_CLAIM_TTL
+    )
+    time.sleep(0.1)
+    send_receipt(tmp_path, 0)
+    assert bot.texts[-1].startswith("Registered")
+    assert splitwise.created > 0
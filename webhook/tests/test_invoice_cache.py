@@ -0,0 +1,173 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+from invoice_cache import LOW_WATER_MARK, BlobInvoiceCache, InvoiceCache, LocalInvoiceCache
+from models import Invoice, Item
+
+INVOICE = Invoice(
+    date="2025-03-01",
+    page=1,
+    total_amount_invoice=2.10,
+    items=[Item(unit_price=1.05, weight=0.0, quantity=2.0, discount=0.0, description="Melk")],
+)
+ENTRY_BYTES = len(InvoiceCache._dumps(INVOICE))
+
+
+def test_make_key_depends_on_the_models():
+    key = InvoiceCache.make_key("hash", "ocr-1", "parse-1")
+    assert key.startswith("hash-")
+    assert key != InvoiceCache.make_key("hash", "ocr-2", "parse-1")
+    assert key == InvoiceCache.make_key("hash", "ocr-1", "parse-1")
+
+
+@pytest.mark.parametrize("result", [INVOICE, [INVOICE, INVOICE]], ids=["single", "pages"])
+def test_round_trip(tmp_path, result):
+    cache = LocalInvoiceCache(str(tmp_path))
+    cache.set("key", result)
+    assert cache.get("key") == result
+    assert cache.get("missing") is None
+
+
+def test_unreadable_entries_are_misses(tmp_path):
+    cache = LocalInvoiceCache(str(tmp_path))
+    (tmp_path / "key.json").write_text("{not json")
+    assert cache.get("key") is None
+
+
+class CountingLocalCache(LocalInvoiceCache):
+    evictions = 0
+
+    def evict(self) -> int:
+        self.evictions += 1
+        return super().evict()
+
+
+def age(cache: LocalInvoiceCache, key: str, seconds: float) -> None:
+    path = cache._path(key)
+    mtime = path.stat().st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_running_total_avoids_listing_on_every_write(tmp_path):
+    cache = CountingLocalCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    for i in range(10):
+        cache.set(f"key-{i}", INVOICE)
+    # Counted once on the first write, then kept by the writes themselves
+    assert cache.evictions == 1
+    assert cache._size == 10 * ENTRY_BYTES
+    cache.set("key-10", INVOICE)
+    assert cache.evictions == 2
+
+
+def test_eviction_drops_the_least_recently_used_to_the_low_water_mark(tmp_path):
+    cache = LocalInvoiceCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    for i in range(10):
+        cache.set(f"key-{i}", INVOICE)
+        age(cache, f"key-{i}", 100 - i)
+    # Reading key-0 makes it the most recently used
+    assert cache.get("key-0") == INVOICE
+    cache.set("key-10", INVOICE)
+
+    remaining = sorted(p.stem for p in tmp_path.glob("*.json"))
+    assert len(remaining) == int(10 * LOW_WATER_MARK)
+    assert remaining == sorted(["key-0", "key-10"] + [f"key-{i}" for i in range(4, 10)])
+    assert cache._size == len(remaining) * ENTRY_BYTES
+
+
+def test_running_total_picks_up_entries_of_other_processes(tmp_path):
+    cache = LocalInvoiceCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    other = LocalInvoiceCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    for i in range(5):
+        other.set(f"other-{i}", INVOICE)
+    cache.set("key", INVOICE)
+    assert cache._size == 6 * ENTRY_BYTES
+
+
+class FakeBlobProperties:
+    def __init__(self, name: str, size: int, last_modified: datetime):
+        self.name = name
+        self.size = size
+        self.last_modified = last_modified
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readall(self) -> bytes:
+        return self.data
+
+
+class FakeBlobClient:
+    """No exists(): a read must be a single download."""
+
+    def __init__(self, container, name: str):
+        self.container = container
+        self.name = name
+
+    def download_blob(self) -> FakeDownload:
+        self.container.requests += 1
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError("missing")
+        return FakeDownload(self.container.blobs[self.name][0])
+
+    def upload_blob(self, data: bytes, overwrite=False):
+        self.container.requests += 1
+        self.container.clock += timedelta(seconds=1)
+        self.container.blobs[self.name] = (data, self.container.clock)
+
+
+class FakeContainerClient:
+    def __init__(self):
+        self.blobs = {}
+        self.requests = 0
+        self.listings = 0
+        self.clock = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+    def list_blobs(self, name_starts_with: str = ""):
+        self.listings += 1
+        return [
+            FakeBlobProperties(name, len(data), modified)
+            for name, (data, modified) in self.blobs.items()
+            if name.startswith(name_starts_with)
+        ]
+
+    def delete_blob(self, name: str):
+        del self.blobs[name]
+
+
+@pytest.fixture
+def container() -> FakeContainerClient:
+    return FakeContainerClient()
+
+
+def test_blob_cache_round_trip(container):
+    cache = BlobInvoiceCache(container)
+    cache.set("key", INVOICE)
+    assert "invoice_cache/key.json" in container.blobs
+    assert cache.get("key") == INVOICE
+
+
+def test_blob_cache_miss_is_a_single_request(container):
+    cache = BlobInvoiceCache(container)
+    assert cache.get("missing") is None
+    assert container.requests == 1
+
+
+def test_blob_cache_evicts_the_oldest_blobs(container):
+    container.blobs["other/keep.json"] = (b"x" * 100 * ENTRY_BYTES, container.clock)
+    cache = BlobInvoiceCache(container, max_bytes=10 * ENTRY_BYTES)
+    for i in range(11):
+        cache.set(f"key-{i}", INVOICE)
+    assert container.listings == 2
+    remaining = sorted(name for name in container.blobs if name.startswith(cache.prefix))
+    assert remaining == sorted(f"invoice_cache/key-{i}.json" for i in range(3, 11))
+    # Blobs outside the prefix are not the cache's
+    assert "other/keep.json" in container.blobs
+    assert cache._size == 8 * ENTRY_BYTES
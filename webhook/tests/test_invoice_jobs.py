@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import app
+import worker
+from idempotency import IdempotencyGuard
+from job_queue import SqliteJobQueue
+from services import services
+from state_store import InMemoryStateStore
+
+CHAT_ID = 1
+FILE_HASH = "hash"
+FILE_KEY = IdempotencyGuard.file_key(CHAT_ID, FILE_HASH)
+JOB = {
+    "chat_id": CHAT_ID,
+    "local_file_path": "data/receipt.pdf",
+    "payer_name": "Maarten",
+    "group_name": "g",
+    "sofies_amount": 0,
+    "data_path": "data",
+    "file_hash": FILE_HASH,
+}
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+
+@pytest.fixture
+def bot():
+    bot = RecordingBot()
+    services.override(
+        bot=bot, conversation_state=InMemoryStateStore(), idempotency=IdempotencyGuard()
+    )
+    services.idempotency.first_seen(FILE_KEY)
+    yield bot
+    services.reset()
+
+
+def script_process_invoice(monkeypatch, *outcomes):
+    """Make process_invoice raise or return the outcomes in turn."""
+    outcomes = list(outcomes)
+
+    async def process_invoice(*args, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(app, "process_invoice", process_invoice)
+
+
+@pytest.fixture
+def queue(tmp_path) -> SqliteJobQueue:
+    queue = SqliteJobQueue(str(tmp_path / "jobs.sqlite"), retry_delay=0)
+    queue.enqueue(JOB)
+    return queue
+
+
+def run_queue(queue: SqliteJobQueue) -> None:
+    asyncio.run(worker.run_worker(queue, poll_interval=0, once=True))
+
+
+def test_retried_job_only_sends_the_result(bot, queue, monkeypatch):
+    script_process_invoice(monkeypatch, RuntimeError("Mistral timed out"), "Registered 3 items")
+    run_queue(queue)
+    assert bot.sent == ["Registered 3 items"]
+    assert queue.pending() == 0
+    # The receipt stays registered throughout
+    assert services.idempotency.seen(FILE_KEY)
+
+
+def test_final_failure_is_reported_once(bot, queue, monkeypatch):
+    script_process_invoice(monkeypatch, *[RuntimeError("Mistral timed out")] * queue.max_attempts)
+    run_queue(queue)
+    assert bot.sent == ["An error occurred while processing the invoice: Mistral timed out"]
+    # The user may resend the receipt
+    assert not services.idempotency.seen(FILE_KEY)
+
+
+def test_job_leaves_a_new_conversation_alone(bot, queue, monkeypatch):
+    new_conversation = {"state": "WAIT_FOR_PAYER", "group_name": "g"}
+    services.conversation_state.set(CHAT_ID, new_conversation)
+    script_process_invoice(monkeypatch, "Registered 3 items")
+    run_queue(queue)
+    assert services.conversation_state.get(CHAT_ID) == new_conversation
+
+
+def test_final_invalid_invoice_restarts_the_conversation(bot, monkeypatch):
+    script_process_invoice(monkeypatch, ValueError("The totals do not match."))
+    with pytest.raises(ValueError):
+        asyncio.run(app.run_invoice_job(JOB))
+    assert bot.sent == ["The totals do not match.", app.CONVERSATION_STATES["WAIT_FOR_GROUP"]]
+    assert services.conversation_state.get(CHAT_ID) == {"state": "WAIT_FOR_GROUP"}
+
+
+def test_final_invalid_invoice_keeps_a_new_conversation(bot, monkeypatch):
+    new_conversation = {"state": "WAIT_FOR_PAYER", "group_name": "g"}
+    services.conversation_state.set(CHAT_ID, new_conversation)
+    script_process_invoice(monkeypatch, ValueError("The totals do not match."))
+    with pytest.raises(ValueError):
+        asyncio.run(app.run_invoice_job(JOB))
+    assert services.conversation_state.get(CHAT_ID) == new_conversation
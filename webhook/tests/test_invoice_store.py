@@ -0,0 +1,109 @@
+import os
+import time
+
+import polars as pl
+import pytest
+
+import invoice_store
+from invoice_store import LOCK_NAME, STALE_LOCK_AGE, InvoiceStore
+
+
+def invoices(*hashes: str, line: str = "Melk") -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "file_hash": list(hashes),
+            "description": [line] * len(hashes),
+            "amount": [1.0] * len(hashes),
+        }
+    )
+
+
+@pytest.fixture
+def store(tmp_path) -> InvoiceStore:
+    return InvoiceStore(str(tmp_path / "store"), max_segments=4)
+
+
+def stored(store: InvoiceStore) -> pl.DataFrame:
+    return store.scan().drop("ingested").collect().sort("file_hash")
+
+
+def partition(store: InvoiceStore):
+    [partition_dir] = [p for p in store.segments_dir.iterdir() if p.is_dir()]
+    return partition_dir
+
+
+def test_append_writes_one_segment_per_call(store):
+    assert store.append(invoices("a", "b")) == 2
+    assert store.append(invoices("c")) == 1
+    assert len(store._segments()) == 2
+    assert stored(store).equals(invoices("a", "b", "c"))
+    assert store.contains("c")
+    assert not store.contains("d")
+
+
+def test_append_skips_stored_invoices(store):
+    store.append(invoices("a"))
+    assert store.append(invoices("a", "b", line="Brood")) == 1
+    assert store.append(invoices("a")) == 0
+    assert len(store._segments()) == 2
+    assert stored(store)["description"].to_list() == ["Melk", "Brood"]
+
+
+def test_stored_invoices_are_known_to_a_new_process(store):
+    store.append(invoices("a"))
+    assert InvoiceStore(str(store.root)).append(invoices("a", "b")) == 1
+
+
+def test_append_compacts_a_full_partition(store):
+    for i in range(store.max_segments + 1):
+        store.append(invoices(f"hash-{i}"))
+    assert len(store._segments()) == 1
+    assert stored(store).equals(invoices(*(f"hash-{i}" for i in range(5))))
+
+
+def test_compaction_keeps_the_first_copy_of_an_invoice(store):
+    # Two processes that both stored "a" before seeing each other's segment
+    store.append(invoices("a", line="Melk"))
+    InvoiceStore(str(store.root)).append(invoices("a", "b", line="Brood"))
+    store.compact()
+    assert len(store._segments()) == 1
+    assert stored(store)["description"].to_list() == ["Melk", "Brood"]
+
+
+def test_compaction_keeps_segments_appended_meanwhile(store, monkeypatch):
+    store.append(invoices("a"))
+    store.append(invoices("b"))
+    other = InvoiceStore(str(store.root))
+    read_parquet = pl.read_parquet
+
+    def read_while_another_process_appends(path, *args, **kwargs):
+        if not other.contains("c"):
+            other.append(invoices("c"))
+        return read_parquet(path, *args, **kwargs)
+
+    monkeypatch.setattr(invoice_store.pl, "read_parquet", read_while_another_process_appends)
+    store.compact()
+    assert len(store._segments()) == 2
+    assert stored(store).equals(invoices("a", "b", "c"))
+
+
+def test_compaction_skips_a_partition_another_process_is_compacting(store):
+    store.append(invoices("a"))
+    store.append(invoices("b"))
+    lock_path = partition(store) / LOCK_NAME
+    lock_path.touch()
+    store.compact()
+    assert len(store._segments()) == 2
+    assert lock_path.exists()
+
+
+def test_compaction_takes_over_a_stale_lock(store):
+    store.append(invoices("a"))
+    store.append(invoices("b"))
+    lock_path = partition(store) / LOCK_NAME
+    lock_path.touch()
+    stale = time.time() - STALE_LOCK_AGE - 1
+    os.utime(lock_path, (stale, stale))
+    store.compact()
+    assert len(store._segments()) == 1
+    assert not lock_path.exists()
@@ -0,0 +1,79 @@
+from typing import Optional, Sequence
+
+import pymupdf
+import pytest
+
+from pdf_text import parse_text_layer, text_layer_pages
+
+# Left edge (pt) of each receipt column
+COLUMN_X = [20, 70, 190, 250]
+HEADER = ("Hoev.", "Omschrijving", "Eenh.prijs", "Bedrag")
+ROWS = [
+    ("2", "BONI MELK 1L", "1,05", "2,10"),
+    ("25%", "Korting", None, "-0,53"),
+    ("0,512 kg", "BANANEN", "1,99", "1,02"),
+]
+
+
+def receipt_pdf(rows: Sequence[Sequence[Optional[str]]], total: str) -> bytes:
+    """A digital receipt: the article columns aligned as text, without ruling lines."""
+    with pymupdf.open() as doc:
+        page = doc.new_page(width=300, height=400)
+        page.insert_text((20, 25), "Colruyt Halle 01/03/2025 10:12", fontsize=9)
+        y = 40
+        for row in [HEADER, *rows]:
+            for x, cell in zip(COLUMN_X, row):
+                if cell:
+                    page.insert_text((x, y), cell, fontsize=9)
+            y += 14
+        page.insert_text((20, y + 10), total, fontsize=9)
+        return doc.tobytes()
+
+
+def scanned_pdf(pages: int = 1) -> bytes:
+    """Pages holding only an image of the receipt, no text layer."""
+    pixmap = pymupdf.Pixmap(pymupdf.csGRAY, pymupdf.IRect(0, 0, 60, 80), False)
+    pixmap.clear_with(200)
+    with pymupdf.open() as doc:
+        for _ in range(pages):
+            page = doc.new_page(width=300, height=400)
+            page.insert_image(page.rect, pixmap=pixmap)
+        return doc.tobytes()
+
+
+def test_text_layer_pages_rebuild_the_article_table():
+    [page] = text_layer_pages(receipt_pdf(ROWS, "Te betalen 2,59"))
+    assert "| Hoev. | Omschrijving | Eenh.prijs | Bedrag |" in page
+    assert "| 2 | BONI MELK 1L | 1,05 | 2,10 |" in page
+    assert "| 25% | Korting |  | -0,53 |" in page
+
+
+def test_parse_text_layer_reads_a_digital_receipt():
+    invoice = parse_text_layer(receipt_pdf(ROWS, "Te betalen 2,59"))
+    assert invoice.date == "2025-03-01"
+    assert invoice.total_amount_invoice == 2.59
+    assert [item.description for item in invoice.items] == [
+        "BONI MELK 1L",
+        "Korting",
+        "BANANEN",
+        "Total amount",
+    ]
+    assert invoice.items[1].discount == 25
+    assert invoice.items[2].weight == 0.512
+
+
+def test_parse_text_layer_rejects_totals_that_do_not_add_up():
+    pdf = receipt_pdf(ROWS, "Te betalen 9,99")
+    assert "| 2 | BONI MELK 1L | 1,05 | 2,10 |" in text_layer_pages(pdf)[0]
+    assert parse_text_layer(pdf) is None
+
+
+@pytest.mark.parametrize("pages", [1, 2])
+def test_scans_have_no_text_layer(pages):
+    pdf = scanned_pdf(pages)
+    assert text_layer_pages(pdf) is None
+    assert parse_text_layer(pdf) is None
+
+
+def test_parse_text_layer_never_raises():
+    assert parse_text_layer(b"not a pdf") is None
@@ -0,0 +1,293 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import requests
+from azure.core.pipeline import AsyncPipeline, Pipeline
+from azure.core.pipeline.transport import AsyncHttpTransport, HttpRequest, HttpTransport
+
+from resilience import (
+    AsyncCircuitBreakerPolicy,
+    CircuitBreaker,
+    CircuitBreakerPolicy,
+    CircuitOpenError,
+    TransientHTTPError,
+    acall_with_retries,
+    call_with_retries,
+    is_rate_limited,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeTransport(HttpTransport):
+    """Answers every request with `status`."""
+
+    def __init__(self, status: int = 200):
+        self.status = status
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(status_code=self.status)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeAsyncTransport(AsyncHttpTransport):
+    """Answers every request with `status`, after `latency` seconds."""
+
+    def __init__(self, status: int = 200, latency: float = 0.0):
+        self.status = status
+        self.latency = latency
+
+    async def send(self, request, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(status_code=self.status)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+
+def half_open_circuit() -> CircuitBreaker:
+    clock = FakeClock()
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    circuit.record_failure()
+    clock.now = 31
+    return circuit
+
+
+def get(url: str, timeout=None) -> requests.Response:
+    response = requests.get(url, timeout=timeout)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientHTTPError(response.status_code, response)
+    response.raise_for_status()
+    return response
+
+
+async def aget(url: str) -> httpx.Response:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientHTTPError(response.status_code, response)
+    response.raise_for_status()
+    return response
+
+
+def test_call_with_retries_retries_transient_errors(http_server):
+    http_server.script((503, {}), (502, {}), (200, {"ok": True}))
+    delays = []
+    response = call_with_retries(
+        lambda timeout: get(http_server.url, timeout), retries=2, sleep=delays.append
+    )
+    assert response.json() == {"ok": True}
+    assert len(http_server.requests) == 3
+    assert len(delays) == 2
+
+
+def test_call_with_retries_gives_up_after_retries(http_server):
+    http_server.script((503, {}))
+    with pytest.raises(TransientHTTPError):
+        call_with_retries(
+            lambda timeout: get(http_server.url, timeout), retries=2, sleep=lambda _: None
+        )
+    assert len(http_server.requests) == 3
+
+
+def test_call_with_retries_does_not_retry_client_errors(http_server):
+    http_server.script((400, {}))
+    with pytest.raises(requests.HTTPError):
+        call_with_retries(lambda timeout: get(http_server.url, timeout), sleep=lambda _: None)
+    assert len(http_server.requests) == 1
+
+
+def test_call_with_retries_honours_retry_after(http_server):
+    http_server.script((429, {}, {"Retry-After": "7"}), (200, {}))
+    delays = []
+    call_with_retries(
+        lambda timeout: get(http_server.url, timeout), backoff=0.01, sleep=delays.append
+    )
+    assert delays == [7.0]
+
+
+def test_call_with_retries_retry_on(http_server):
+    http_server.script((503, {}), (200, {}))
+    with pytest.raises(TransientHTTPError):
+        call_with_retries(
+            lambda timeout: get(http_server.url, timeout),
+            sleep=lambda _: None,
+            retry_on=is_rate_limited,
+        )
+    assert len(http_server.requests) == 1
+
+
+def test_call_with_retries_passes_the_remaining_deadline(http_server):
+    http_server.delay = 0.5
+    with pytest.raises(requests.Timeout):
+        call_with_retries(lambda timeout: get(http_server.url, timeout), deadline=0.1)
+    assert len(http_server.requests) == 1
+
+
+def test_call_with_retries_skips_retries_past_the_deadline(http_server):
+    http_server.script((429, {}, {"Retry-After": "60"}), (200, {}))
+    with pytest.raises(TransientHTTPError):
+        call_with_retries(
+            lambda timeout: get(http_server.url, timeout), deadline=10, sleep=lambda _: None
+        )
+    assert len(http_server.requests) == 1
+
+
+def test_acall_with_retries_retries_transient_errors(http_server):
+    http_server.script((503, {}), (200, {"ok": True}))
+    response = asyncio.run(
+        acall_with_retries(lambda: aget(http_server.url), backoff=0.01)
+    )
+    assert response.json() == {"ok": True}
+    assert len(http_server.requests) == 2
+
+
+def test_acall_with_retries_cancels_at_the_deadline(http_server):
+    http_server.delay = 0.5
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(acall_with_retries(lambda: aget(http_server.url), deadline=0.1))
+
+
+def test_circuit_opens_after_consecutive_outages(http_server):
+    http_server.script((503, {}))
+    circuit = CircuitBreaker("test", failure_threshold=2, reset_timeout=30, clock=FakeClock())
+    for _ in range(2):
+        with pytest.raises(TransientHTTPError):
+            call_with_retries(
+                lambda timeout: get(http_server.url, timeout), retries=0, circuit=circuit
+            )
+    assert circuit.state == "open"
+    with pytest.raises(CircuitOpenError):
+        call_with_retries(
+            lambda timeout: get(http_server.url, timeout), retries=0, circuit=circuit
+        )
+    assert len(http_server.requests) == 2
+
+
+def test_rate_limits_do_not_open_the_circuit(http_server):
+    http_server.script((429, {}))
+    circuit = CircuitBreaker("test", failure_threshold=1, clock=FakeClock())
+    with pytest.raises(TransientHTTPError):
+        call_with_retries(
+            lambda timeout: get(http_server.url, timeout), retries=0, circuit=circuit
+        )
+    assert circuit.state == "closed"
+
+
+def test_circuit_lets_one_trial_through_when_half_open(http_server):
+    clock = FakeClock()
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    circuit.record_failure()
+    clock.now = 31
+    assert circuit.state == "half_open"
+
+    assert circuit.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+
+    # A failed trial re-opens the circuit
+    circuit.record_failure()
+    assert circuit.state == "open"
+    clock.now = 62
+    http_server.script((200, {}))
+    call_with_retries(lambda timeout: get(http_server.url, timeout), circuit=circuit)
+    assert circuit.state == "closed"
+
+
+def test_cancelled_trial_leaves_the_circuit_half_open(http_server):
+    clock = FakeClock()
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    circuit.record_failure()
+    clock.now = 31
+    http_server.delay = 1.0
+
+    async def cancelled_trial():
+        task = asyncio.create_task(
+            acall_with_retries(lambda: aget(http_server.url), circuit=circuit)
+        )
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_trial())
+    assert circuit.state == "half_open"
+    # The next call gets to be the trial
+    assert circuit.before_call() is True
+
+
+def test_cancelled_call_does_not_release_another_trial():
+    clock = FakeClock()
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    with pytest.raises(KeyboardInterrupt):
+        with circuit.guard():
+            # The circuit opens and half-opens while this call runs
+            circuit.record_failure()
+            clock.now = 31
+            assert circuit.before_call() is True
+            raise KeyboardInterrupt
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+
+
+def test_pipeline_policy_records_error_responses():
+    circuit = CircuitBreaker("test", failure_threshold=2, clock=FakeClock())
+    transport = FakeTransport(status=503)
+    pipeline = Pipeline(transport, policies=[CircuitBreakerPolicy(circuit)])
+    for _ in range(2):
+        pipeline.run(HttpRequest("GET", "https://blob.example/a"))
+    assert circuit.state == "open"
+    with pytest.raises(CircuitOpenError):
+        pipeline.run(HttpRequest("GET", "https://blob.example/a"))
+    assert transport.sent == 2
+
+
+def test_pipeline_policy_closes_after_a_successful_trial():
+    circuit = half_open_circuit()
+    pipeline = Pipeline(FakeTransport(status=404), policies=[CircuitBreakerPolicy(circuit)])
+    pipeline.run(HttpRequest("GET", "https://blob.example/a"))
+    assert circuit.state == "closed"
+
+
+def test_cancelled_trial_through_the_async_pipeline_policy():
+    circuit = half_open_circuit()
+    pipeline = AsyncPipeline(
+        FakeAsyncTransport(latency=1.0), policies=[AsyncCircuitBreakerPolicy(circuit)]
+    )
+
+    async def upload_with_deadline():
+        # As async_upload_df does around the blob upload
+        await asyncio.wait_for(
+            pipeline.run(HttpRequest("PUT", "https://blob.example/a")), timeout=0.05
+        )
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(upload_with_deadline())
+    assert circuit.state == "half_open"
+    # The next call gets to be the trial, and closes the circuit
+    asyncio.run(pipeline.run(HttpRequest("PUT", "https://blob.example/a")))
+    assert circuit.state == "closed"
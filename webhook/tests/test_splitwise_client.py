@@ -0,0 +1,118 @@
+import pytest
+import requests
+from splitwise import Splitwise
+from splitwise.exception import SplitwiseException
+from splitwise.expense import Expense
+
+from expense_batch import submit_expense
+from resilience import CircuitBreaker, CircuitOpenError
+from splitwise_client import ResilientSplitwise
+
+# Response bodies with the fields the SDK models read
+USER = {
+    "user": {
+        "id": 1,
+        "first_name": "Maarten",
+        **dict.fromkeys(
+            ["last_name", "default_currency", "locale", "date_format", "default_group_id"]
+        ),
+    }
+}
+EXPENSE_FIELDS = [
+    "group_id", "description", "repeats", "repeat_interval", "email_reminder",
+    "email_reminder_in_advance", "next_repeat", "details", "comments_count",
+    "payment", "creation_method", "transaction_method", "transaction_confirmed",
+    "cost", "currency_code", "created_by", "date", "created_at", "updated_at",
+    "deleted_at", "updated_by", "deleted_by",
+]
+CREATED = {
+    "expenses": [
+        {
+            "id": 7,
+            "receipt": {"original": None, "large": None},
+            "category": {"id": 18, "name": "General"},
+            "users": [],
+            "repayments": [],
+            **dict.fromkeys(EXPENSE_FIELDS),
+        }
+    ],
+    "errors": {},
+}
+
+
+@pytest.fixture
+def splitwise(http_server, monkeypatch):
+    monkeypatch.setattr(Splitwise, "GET_CURRENT_USER_URL", f"{http_server.url}/get_current_user")
+    monkeypatch.setattr(Splitwise, "CREATE_EXPENSE_URL", f"{http_server.url}/create_expense")
+    return ResilientSplitwise(
+        "key",
+        "secret",
+        api_key="api-key",
+        session=requests.Session(),
+        timeout=2,
+        circuit=CircuitBreaker("splitwise-test"),
+    )
+
+
+def expense() -> Expense:
+    expense = Expense()
+    expense.setCost("12.50")
+    expense.setDescription("Groceries")
+    return expense
+
+
+def test_get_retries_server_errors(http_server, splitwise):
+    http_server.script((503, {}), (200, USER))
+    assert splitwise.getCurrentUser().getFirstName() == "Maarten"
+    assert http_server.requests == [("GET", "/get_current_user")] * 2
+
+
+def test_post_is_not_retried(http_server, splitwise):
+    http_server.script((503, {}), (200, CREATED))
+    with pytest.raises(SplitwiseException):
+        splitwise.createExpense(expense())
+    assert http_server.requests == [("POST", "/create_expense")]
+
+
+def test_client_errors_raise_the_sdk_exceptions(http_server, splitwise):
+    http_server.script((401, {}))
+    with pytest.raises(SplitwiseException):
+        splitwise.getCurrentUser()
+    assert len(http_server.requests) == 1
+
+
+def test_requests_time_out_at_the_deadline(http_server, splitwise):
+    http_server.delay = 0.5
+    splitwise.timeout = 0.1
+    with pytest.raises(requests.Timeout):
+        splitwise.getCurrentUser()
+
+
+def test_open_circuit_skips_the_request(http_server, splitwise):
+    splitwise.circuit = CircuitBreaker("splitwise-test", failure_threshold=1)
+    splitwise.retries = 0
+    http_server.script((503, {}))
+    with pytest.raises(SplitwiseException):
+        splitwise.getCurrentUser()
+    with pytest.raises(CircuitOpenError):
+        splitwise.getCurrentUser()
+    assert len(http_server.requests) == 1
+
+
+def test_submit_expense_retries_rate_limits(http_server, splitwise):
+    http_server.script(
+        (429, {}, {"Retry-After": "3"}),
+        (200, CREATED),
+    )
+    delays = []
+    result = submit_expense(splitwise, expense(), sleep=delays.append)
+    assert result.ok and result.expense_id == 7
+    assert delays == [3.0]
+    assert len(http_server.requests) == 2
+
+
+def test_submit_expense_does_not_retry_server_errors(http_server, splitwise):
+    http_server.script((503, {}), (200, CREATED))
+    result = submit_expense(splitwise, expense(), sleep=lambda _: None)
+    assert not result.ok
+    assert len(http_server.requests) == 1
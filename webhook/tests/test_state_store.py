@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+import state_store
+from state_store import (
+    MAX_RETRY_DELAY,
+    InMemoryStateStore,
+    SqliteStateStore,
+    StateConflictError,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryStateStore()
+    return SqliteStateStore(str(tmp_path / "state.sqlite"))
+
+
+def test_set_get_delete(store):
+    assert store.get(1) is None
+    store.set(1, {"state": "WAIT_FOR_GROUP"})
+    assert store.get(1) == {"state": "WAIT_FOR_GROUP"}
+    store.delete(1)
+    assert store.get(1) is None
+
+
+def test_update_merges_changes(store):
+    store.set(1, {"state": "WAIT_FOR_GROUP"})
+    assert store.update(1, {"state": "WAIT_FOR_PAYER", "group_name": "g"}) == {
+        "state": "WAIT_FOR_PAYER",
+        "group_name": "g",
+    }
+
+
+def test_setdefault_keeps_an_existing_entry(store):
+    assert store.setdefault(1, {"state": "WAIT_FOR_GROUP"}) == {"state": "WAIT_FOR_GROUP"}
+    store.update(1, {"state": "WAIT_FOR_PAYER"})
+    assert store.setdefault(1, {"state": "WAIT_FOR_GROUP"}) == {"state": "WAIT_FOR_PAYER"}
+
+
+def test_compare_and_set_rejects_a_stale_version(store):
+    store.set(1, {"state": "WAIT_FOR_GROUP"})
+    _, version = store.get_versioned(1)
+    # Another writer gets there first
+    store.update(1, {"state": "WAIT_FOR_PAYER"})
+    assert not store.compare_and_set(1, {"state": "WAIT_FOR_PDF"}, version)
+    assert store.get(1) == {"state": "WAIT_FOR_PAYER"}
+    _, current = store.get_versioned(1)
+    assert store.compare_and_set(1, {"state": "WAIT_FOR_PDF"}, current)
+
+
+def test_compare_and_set_expects_absent_entries(store):
+    assert store.compare_and_set(1, {"state": "WAIT_FOR_GROUP"}, None)
+    assert not store.compare_and_set(1, {"state": "WAIT_FOR_GROUP"}, None)
+
+
+def test_entries_expire(store):
+    store.ttl = 0.05
+    store.set(1, {"state": "WAIT_FOR_GROUP"})
+    time.sleep(0.1)
+    assert store.get_versioned(1) == (None, None)
+    # An expired entry counts as absent
+    assert store.compare_and_set(1, {"state": "WAIT_FOR_PAYER"}, None)
+
+
+def test_in_memory_store_prunes_expired_entries_on_write():
+    store = InMemoryStateStore(ttl=0.05)
+    for chat_id in range(100):
+        store.set(chat_id, {"state": "WAIT_FOR_GROUP"})
+    time.sleep(0.1)
+    store.set("new", {"state": "WAIT_FOR_GROUP"})
+    assert list(store._entries) == ["new"]
+
+
+class RacingStore(InMemoryStateStore):
+    """Loses the compare-and-set `losses` times, as if another writer kept winning."""
+
+    def __init__(self, losses: int):
+        super().__init__()
+        self.losses = losses
+        self.attempts = 0
+
+    def compare_and_set(self, key, value, expected) -> bool:
+        self.attempts += 1
+        if self.attempts <= self.losses:
+            return False
+        return super().compare_and_set(key, value, expected)
+
+
+def test_write_retries_lost_races(monkeypatch):
+    delays = []
+    monkeypatch.setattr(state_store.time, "sleep", delays.append)
+    store = RacingStore(losses=2)
+    store.set(1, {"state": "WAIT_FOR_GROUP"})
+    assert store.get(1) == {"state": "WAIT_FOR_GROUP"}
+    assert store.attempts == 3
+    assert len(delays) == 2
+
+
+def test_write_gives_up_after_max_attempts(monkeypatch):
+    delays = []
+    monkeypatch.setattr(state_store.time, "sleep", delays.append)
+    store = RacingStore(losses=100)
+    store.backoff = 1.0
+    with pytest.raises(StateConflictError):
+        store.set(1, {"state": "WAIT_FOR_GROUP"})
+    assert store.attempts == store.max_attempts
+    # No pause after the last attempt, and none longer than the cap
+    assert len(delays) == store.max_attempts - 1
+    assert max(delays) <= MAX_RETRY_DELAY
@@ -0,0 +1,169 @@
+"""
+Lightweight spans for timing the stages of the webhook pipeline.
+
+    with span("ocr", file=name):
+        ...
+
+Every finished span goes to each registered exporter:
+
+- `LogExporter` writes one structured log line (fields bound on the record).
+- `StatsExporter` keeps the last durations per stage for `summary()`
+  (count, p50, p95), and doubles as the in-memory exporter for tests.
+- `OpenTelemetryExporter` re-emits the span through OpenTelemetry, so an
+  Azure Monitor / App Insights exporter configured on the OTel SDK picks it
+  up. Only used if `opentelemetry` is installed.
+"""
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start: float  # time.time() when the span started
+    duration: float  # seconds
+    attributes: Dict[str, object] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class LogExporter:
+    def export(self, record: SpanRecord) -> None:
+        logger.bind(
+            span=record.name,
+            duration_ms=round(record.duration * 1000, 1),
+            error=record.error,
+            **record.attributes,
+        ).info(f"span {record.name} took {record.duration * 1000:.1f}ms")
+
+
+class StatsExporter:
+    """Keeps the last `max_samples` spans per stage in memory."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._records: Dict[str, Deque[SpanRecord]] = defaultdict(
+            lambda: deque(maxlen=self.max_samples)
+        )
+        self._lock = threading.Lock()
+
+    def export(self, record: SpanRecord) -> None:
+        with self._lock:
+            self._records[record.name].append(record)
+
+    def records(self, name: Optional[str] = None) -> List[SpanRecord]:
+        with self._lock:
+            if name is not None:
+                return list(self._records.get(name, ()))
+            return [r for records in self._records.values() for r in records]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, p50 and p95 (in ms) per stage."""
+        with self._lock:
+            durations = {
+                name: [r.duration * 1000 for r in records]
+                for name, records in self._records.items()
+                if records
+            }
+        return {
+            name: {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+            }
+            for name, values in sorted(durations.items())
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+class OpenTelemetryExporter:
+    def __init__(self, tracer_name: str = "colli_parser"):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+
+    def export(self, record: SpanRecord) -> None:
+        start_ns = int(record.start * 1e9)
+        otel_span = self.tracer.start_span(
+            record.name,
+            start_time=start_ns,
+            attributes={k: str(v) for k, v in record.attributes.items()},
+        )
+        if record.error is not None:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, record.error))
+        otel_span.end(end_time=start_ns + int(record.duration * 1e9))
+
+
+stats = StatsExporter()
+exporters: list = [LogExporter(), stats]
+try:
+    exporters.append(OpenTelemetryExporter())
+except ImportError:
+    pass
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as stage `name` and export it."""
+    start, begin = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record = SpanRecord(name, start, time.perf_counter() - begin, attributes, error)
+        for exporter in exporters:
+            try:
+                exporter.export(record)
+            except Exception as e:
+                logger.warning(f"Span exporter {type(exporter).__name__} failed: {e}")
+
+
+def timed(name: str):
+    """Decorator version of `span` for sync and async functions."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """p50/p95 per stage over the recent spans of this process."""
+    return stats.summary()
+
+
+def log_summary() -> None:
+    for name, values in summary().items():
+        logger.info(
+            f"stage {name}: n={values['count']} "
+            f"p50={values['p50_ms']:.1f}ms p95={values['p95_ms']:.1f}ms"
+        )
@@ -1,6 +1,7 @@
 import difflib
-from typing import List
+from typing import List, Sequence, Tuple
 
+import numpy as np
 import polars as pl
 import polars_ds as pds
 
@@ -16,60 +17,122 @@ def similarity_ratio(lcs, str1, str2):
     return len(lcs) / max(min(len(str1), len(str2)), 1)
 
 
+def normalize_col(col_name: str) -> pl.Expr:
+    """Lowercased description without brand words, numbers or diacritics"""
+    return (
+        pds.normalize_whitespace(
+            pds.remove_diacritics(
+                pl.col(col_name)
+                .str.to_lowercase()
+                .str.strip_chars()
+                .str.replace_all(r"\s+", " ")
+                .str.split(" ")
+                .list.set_difference(["boni", "bio", "everyday"])
+                .list.set_difference(pds.extract_numbers(col_name))
+                .list.join(" ")
+            )
+        )
+    ).alias(f"{col_name}_normalized")
+
+
+def _encode(strings: Sequence[str], pad: int) -> np.ndarray:
+    """Code points of `strings` as a right-padded (n, max_len) int array"""
+    max_len = max((len(s) for s in strings), default=0)
+    codes = np.full((len(strings), max(max_len, 1)), pad, dtype=np.int32)
+    for i, s in enumerate(strings):
+        codes[i, : len(s)] = [ord(c) for c in s]
+    return codes
+
+
+def longest_common_substrings(
+    left: Sequence[str], right: Sequence[str], max_cells: int = 4_000_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Longest common substring of every (left, right) pair in one batched DP.
+
+    Returns (length, start index in left) arrays of shape (len(left), len(right)),
+    matching what `longest_common_subsequence` finds with difflib per pair.
+    """
+    n_left, n_right = len(left), len(right)
+    lengths = np.zeros((n_left, n_right), dtype=np.int64)
+    starts = np.zeros((n_left, n_right), dtype=np.int64)
+    if n_left == 0 or n_right == 0:
+        return lengths, starts
+
+    # Different pad values so padding never matches padding
+    b = _encode(right, pad=-2)
+    dtype = np.uint8 if b.shape[1] < 255 else np.uint16
+    # Sort by length so each chunk only runs as many DP rows as it needs
+    order = np.argsort([len(s) for s in left], kind="stable")
+    chunk = max(1, max_cells // (n_right * (b.shape[1] + 1)))
+    for lo in range(0, n_left, chunk):
+        idx = order[lo : lo + chunk]
+        a = _encode([left[i] for i in idx], pad=-1)
+        shape = (len(idx), n_right, b.shape[1] + 1)
+        prev, cur = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        matches = np.empty(shape[:2] + (b.shape[1],), dtype=bool)
+        best_len = np.zeros(shape[:2], dtype=dtype)
+        best_end = np.zeros(shape[:2], dtype=np.int64)
+        for i in range(a.shape[1]):
+            np.equal(a[:, i, None, None], b[None, :, :], out=matches)
+            np.add(prev[:, :, :-1], 1, out=cur[:, :, 1:])
+            cur[:, :, 1:] *= matches
+            row_best = cur.max(axis=2)
+            # Strictly greater keeps the earliest match in left, like difflib
+            better = row_best > best_len
+            best_len[better] = row_best[better]
+            best_end[better] = i
+            prev, cur = cur, prev
+        lengths[idx] = best_len
+        starts[idx] = np.where(best_len > 0, best_end - best_len + 1, 0)
+    return lengths, starts
+
+
 def get_hash_map(
     df, terms: List[str], col_name="description", col_name_to_match="for_maarten"
 ):
     assert col_name in df.columns, f"The DataFrame should have a {col_name} column"
 
-    def normalize_col(col_name: str) -> pl.Expr:
-        return (
-            pds.normalize_whitespace(
-                pds.remove_diacritics(
-                    pl.col(col_name)
-                    .str.to_lowercase()
-                    .str.strip_chars()
-                    .str.replace_all(r"\s+", " ")
-                    .str.split(" ")
-                    .list.set_difference(["boni", "bio", "everyday"])
-                    .list.set_difference(pds.extract_numbers(col_name))
-                    .list.join(" ")
-                )
-            )
-        ).alias(f"{col_name}_normalized")
+    # Normalise descriptions and terms once, before the cross join
+    left_col, right_col = f"{col_name}_normalized", f"{col_name_to_match}_normalized"
+    terms_df = pl.DataFrame({col_name_to_match: terms}, schema={col_name_to_match: pl.Utf8})
+    cross_joined = df.with_columns(normalize_col(col_name)).join(
+        terms_df.with_columns(normalize_col(col_name_to_match)), how="cross"
+    )
 
-    cross_joined = df.with_columns(pl.lit(terms).alias(col_name_to_match)).explode(
-        col_name_to_match
+    # Longest common substring of each unique (description, term) pair at once
+    left = cross_joined[left_col].unique().drop_nulls()
+    right = cross_joined[right_col].unique().drop_nulls()
+    lengths, starts = longest_common_substrings(left.to_list(), right.to_list())
+    lcs_df = pl.DataFrame(
+        {
+            left_col: np.repeat(left.to_numpy(), len(right)),
+            right_col: np.tile(right.to_numpy(), len(left)),
+            "start_index": starts.ravel().astype(np.int64),
+            "lcs_len": lengths.ravel().astype(np.uint32),
+        },
+        schema={
+            left_col: pl.Utf8,
+            right_col: pl.Utf8,
+            "start_index": pl.Int64,
+            "lcs_len": pl.UInt32,
+        },
     )
 
     output = (
-        cross_joined.with_columns(
-            normalize_col(col_name), normalize_col(col_name_to_match)
-        )
+        cross_joined.join(lcs_df, on=[left_col, right_col], how="left")
         .with_columns(
-            [
-                pl.struct(f"{col_name}_normalized", f"{col_name_to_match}_normalized")
-                .map_elements(
-                    lambda x: longest_common_subsequence(
-                        x[f"{col_name}_normalized"],
-                        x[f"{col_name_to_match}_normalized"],
-                    ),
-                    return_dtype=pl.Struct({"lcs": pl.Utf8, "start_index": pl.Int64}),
-                )
-                .alias("lcs_struct")
-            ]
+            pl.col(left_col).str.slice(pl.col("start_index"), pl.col("lcs_len")).alias("lcs")
         )
-        .unnest("lcs_struct")
-        .with_columns(pl.col("lcs").str.len_chars().alias("lcs_len"))
         .with_columns(
-            pl.struct("lcs", col_name, col_name_to_match)
-            .map_elements(
-                lambda row: similarity_ratio(
-                    row["lcs"], row[col_name], row[col_name_to_match]
-                ),
-                return_dtype=pl.Float64,
-            )
-            .alias("similarity_ratio"),
-            pl.col("lcs").str.len_chars().alias("lcs_length"),
+            (
+                pl.col("lcs_len")
+                / pl.min_horizontal(
+                    pl.col(col_name).str.len_chars(),
+                    pl.col(col_name_to_match).str.len_chars(),
+                ).clip(lower_bound=1)
+            ).alias("similarity_ratio"),
+            pl.col("lcs_len").alias("lcs_length"),
         )
         .with_columns(
             pl.col("similarity_ratio")
@@ -0,0 +1,72 @@
+"""
+Background worker for invoices enqueued by the webhook (INVOICE_JOBS=queue).
+
+Usage (from ./webhook):
+    python worker.py --concurrency 2
+"""
+import argparse
+import asyncio
+
+from loguru import logger
+
+from app import run_invoice_job
+from job_queue import Job, SqliteJobQueue
+from services import services
+from tracing import log_summary
+
+
+async def keep_invisible(queue: SqliteJobQueue, job: Job) -> None:
+    """Renew the job's visibility timeout until cancelled, so a slow job is not redelivered."""
+    while True:
+        await asyncio.sleep(queue.visibility_timeout / 3)
+        await asyncio.to_thread(queue.extend, job)
+
+
+async def run_worker(
+    queue: SqliteJobQueue, poll_interval: float = 1.0, once: bool = False
+) -> None:
+    """
+    Process jobs until cancelled, or until the queue is empty if `once` is set.
+    """
+    while True:
+        job = await asyncio.to_thread(queue.dequeue)
+        if job is None:
+            if once:
+                return
+            await asyncio.sleep(poll_interval)
+            continue
+
+        logger.info(f"Processing job {job.id} (attempt {job.attempts}).")
+        heartbeat = asyncio.create_task(keep_invisible(queue, job))
+        try:
+            await run_invoice_job(
+                job.payload, attempt=job.attempts, max_attempts=queue.max_attempts
+            )
+        except Exception as e:
+            await asyncio.to_thread(queue.fail, job, str(e))
+        else:
+            await asyncio.to_thread(queue.complete, job)
+        finally:
+            heartbeat.cancel()
+
+
+async def main(concurrency: int, poll_interval: float, once: bool) -> None:
+    queue = services.job_queue
+    try:
+        await asyncio.gather(
+            *(run_worker(queue, poll_interval, once) for _ in range(concurrency))
+        )
+    finally:
+        # p50/p95 per pipeline stage over the jobs this worker ran
+        log_summary()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--concurrency", type=int, default=1)
+    arg_parser.add_argument("--poll-interval", type=float, default=1.0)
+    arg_parser.add_argument(
+        "--once", action="store_true", help="Exit once the queue is empty."
+    )
+    args = arg_parser.parse_args()
+    asyncio.run(main(args.concurrency, args.poll_interval, args.once))